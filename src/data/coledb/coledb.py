@@ -19,52 +19,130 @@ Within the market ticker folders, we store data in files called chunks
 that contain a fixed number of messages (defined as msgs_per_chunk). There is also a
 metadata file that contains information about the start time of each chunk, the
 number of the last chunk, and the number of objects in the last chunk (ColeDBMetadata).
+Writes append small records to a journal next to the metadata file rather than
+rewriting it, and the journal is folded back into the metadata file periodically.
 
 Each chunk file needs to start with a snapshot. The idea is that if someone queries
 for a particular timestamp range, we can find the chunk in which the time stamp starts
 using the metadata file, we can open the file start from the snapshot, apply the
 deltas, and find the starting point. In order to create a new chunk, we get the
-snapshot of the new chunk by reading the previous chunk from the start and
-applying all of the deltas. The name of the chunks are 1 indexed
+snapshot of the new chunk from the orderbook that we keep in memory as we write
+(or, the first time we see a ticker, by reading the previous chunk from the start
+and applying all of the deltas). The name of the chunks are 1 indexed
+
+Chunks can optionally have a sidecar index file (named <chunk>.index, see
+build_index) that stores a checkpoint of the orderbook every few messages, so
+reads that start in the middle of a chunk don't need to decode from its start.
+
+Sealed chunks (every chunk but the last one) can be compressed with zlib or lzma.
+Writers do this as they start each new chunk if you pass sealed_chunk_compression,
+and compress_sealed_chunks does it for markets that are already written. The
+metadata file records the compression of each chunk, compressed chunks are named
+<chunk>.<compression>, and reads decompress them transparently.
+
+Chunks can be rewritten offline by the compactor (see compaction.py), which
+re-chunks a market by size or time span and can compress the sealed chunks.
+The rewritten chunks live in a gen<generation> folder in the market folder, and
+the metadata file records the generation.
+
+Several processes can write to the same ColeDB. A ColeDBWriter takes a write
+lock (write.lock in the market folder) before it writes to a market, and writes
+to a market that another writer has locked raise ColeDBLockedError. The
+compactor takes the lock while it compacts a market. To split the exchange
+between several collectors, give each one a ColeDBShard. Updates to the catalog
+are serialized by a lock next to the catalog file.
 
 FUTURE RESEARCH AND DEVELOPMENT
 It takes about 206 microseconds per message to read. This is high.
-TODO: we need to speed up reads
+TODO: we need to speed up reads. If you don't need an Orderbook object
+per message, use read_arrays, which decodes whole chunks with numpy, or
+read_bbo_arrays if you only need the top of the book.
 
 This DB interface supports the following operations:
 1. Query by start timestamp by market
 2. Query by start and and timestamp by market
-3. TODO: Query by timestamps for multiple markets (streamed together sorted by time)
+3. Query by timestamps for multiple markets (streamed together sorted by time)
 4. Write a snapshot or delta
-5. TODO: Market ticker discovery (maybe cli? Let you sort by duration/metadata)
-6. TODO: include settlement as a part of data because it's a profitable event
-
-TODO: maybe we should also have a metadata file on the market (not chunk) level
-to define some of the market information (like expiration, settlement, settlement
-direction, etc.)
-
-TODO: maybe we should parallelize the writes if it's too slow?
+5. Market ticker discovery through the catalog (see ColeDBCatalog)
+6. Read and write market level info, like the close time, the result (settlement),
+and the strikes (see read_market_info). The info is stored as a market.json file
+in the market ticker folder.
+7. Read and write trades (see write_trade). Trades are fixed size records in a
+trades file in the market ticker folder, so we can binary search them by time.
+8. Follow markets as the collector writes them, like tail -f (see follow)
+
+TODO: maybe we should parallelize the writes if it's too slow? (see ColeDBShard)
 """
 
+import heapq
 import io
+import lzma
+import mmap
+import os
 import pickle
+import struct
 import sys
+import time
+import weakref
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from enum import Enum, IntEnum
+from itertools import chain, islice, repeat
+from multiprocessing import Pool, cpu_count, resource_tracker, shared_memory
 from pathlib import Path
-from typing import Dict, Generator, Iterable, List, Optional, Tuple
+from typing import ClassVar, Dict, Generator, Iterable, List, Optional, Tuple
 
 import numpy as np
 import pytz
+from filelock import FileLock, Timeout
 from numpy.typing import NDArray
 from pandas import DataFrame
 
 from helpers.constants import COLEDB_DEFAULT_STORAGE_PATH
-from helpers.types.markets import EventTicker, MarketTicker, SeriesTicker, Ticker
+from helpers.types.markets import (
+    EventTicker,
+    Market,
+    MarketTicker,
+    SeriesTicker,
+    Ticker,
+)
 from helpers.types.money import Price
 from helpers.types.orderbook import Orderbook
 from helpers.types.orders import Quantity, QuantityDelta, Side
-from helpers.types.websockets.response import OrderbookDeltaRM, OrderbookSnapshotRM
+from helpers.types.websockets.response import (
+    OrderbookDeltaRM,
+    OrderbookSnapshotRM,
+    TradeRM,
+)
+
+
+class ChunkCompression(str, Enum):
+    """General purpose compression that a chunk can be stored with
+
+    Only sealed chunks (every chunk but the last one) can be compressed, since
+    we append to the last chunk as we write."""
+
+    NONE = "none"
+    ZLIB = "zlib"
+    LZMA = "lzma"
+
+    def compress(self, data: bytes) -> bytes:
+        if self == ChunkCompression.ZLIB:
+            return zlib.compress(data, level=9)
+        if self == ChunkCompression.LZMA:
+            return lzma.compress(data)
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        if self == ChunkCompression.ZLIB:
+            return zlib.decompress(data)
+        if self == ChunkCompression.LZMA:
+            return lzma.decompress(data)
+        return data
 
 
 @dataclass
@@ -80,38 +158,163 @@ class ColeDBMetadata:
     chunk_first_time_stamps: the starting timestamp of each chunk
     last_chunk_num: the number of the chunk at the end
     num_msgs_in_last_file: number of messages in the chunk at the end
+    generation: bumped every time the chunks are rewritten (see compaction.py).
+        Chunks of generation 0 live in the market folder, and later generations
+        live in a gen<generation> folder inside of it
+    num_msgs_in_sealed_chunks: number of messages in all of the chunks before
+        the last one. None for markets from before we tracked this, where all
+        of the sealed chunks have msgs_per_chunk messages
+    chunk_compressions: the compression of each chunk that is compressed
     """
 
     path: Path
     chunk_first_time_stamps: List[datetime] = field(default_factory=list)
     last_chunk_num: int = field(default=0)
     num_msgs_in_last_file: int = field(default=0)
+    generation: int = field(default=0)
+    num_msgs_in_sealed_chunks: int | None = field(default=None)
+    chunk_compressions: Dict[int, ChunkCompression] = field(default_factory=dict)
+    # Number of records appended to the journal since the last save
+    num_journal_records: int = field(default=0, compare=False, repr=False)
+
+    # Once the journal has this many records, we fold it into the metadata file
+    max_journal_records: ClassVar[int] = 10000
 
     def save(self):
+        """Writes the full metadata file and clears the journal"""
         # TODO: small legacy issue, the path saved may be incorrect.
         # When we reload, we overwrite the path. Remove path when saving.
-        self.path.write_bytes(pickle.dumps(self))
+        self.num_journal_records = 0
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_bytes(pickle.dumps(self))
+        tmp_path.replace(self.path)
+        self.journal_path.unlink(missing_ok=True)
+
+    def append_to_journal(self):
+        """Records the latest state of the last chunk in the journal
+
+        Rather than re-pickling all of the metadata on every write, we append
+        a small fixed size record with the last chunk num, the number of
+        messages in it, and its first timestamp. Every so often, we compact
+        the journal into the metadata file."""
+        with open(str(self.journal_path), "ab") as f:
+            f.write(
+                _JOURNAL_RECORD.pack(
+                    self.last_chunk_num,
+                    self.num_msgs_in_last_file,
+                    round(self.latest_chunk_timestamp.timestamp() * 1_000_000),
+                )
+            )
+        self.num_journal_records += 1
+        if self.num_journal_records >= self.max_journal_records:
+            self.save()
 
     @classmethod
     def load(cls, path: Path):
         metadata: ColeDBMetadata = pickle.loads(path.read_bytes())
         # In case we move around the folder structure
         metadata.path = path
+        # Metadata files from before we had compression
+        if not hasattr(metadata, "chunk_compressions"):
+            metadata.chunk_compressions = {}
         # Time zones
         metadata.chunk_first_time_stamps = [
             dt.astimezone(ColeDBInterface.tz) for dt in metadata.chunk_first_time_stamps
         ]
+        metadata._replay_journal()
         return metadata
 
+    def _replay_journal(self):
+        """Applies the journal records on top of the metadata file"""
+        if not self.journal_path.exists():
+            return
+        journal = self.journal_path.read_bytes()
+        # Ignore a partially written record at the end
+        num_records = len(journal) // _JOURNAL_RECORD.size
+        for last_chunk_num, num_msgs, micros in _JOURNAL_RECORD.iter_unpack(
+            journal[: num_records * _JOURNAL_RECORD.size]
+        ):
+            self.num_journal_records += 1
+            # Records that are already part of the metadata file
+            if (last_chunk_num, num_msgs) <= (
+                self.last_chunk_num,
+                self.num_msgs_in_last_file,
+            ):
+                continue
+            if last_chunk_num != self.last_chunk_num:
+                assert last_chunk_num == self.last_chunk_num + 1
+                self.seal_last_chunk()
+                self.chunk_first_time_stamps.append(
+                    datetime.fromtimestamp(micros / 1_000_000, ColeDBInterface.tz)
+                )
+                self.last_chunk_num = last_chunk_num
+            self.num_msgs_in_last_file = num_msgs
+
+    def seal_last_chunk(self):
+        """Counts the messages of the last chunk as sealed before we add a chunk"""
+        if self.num_msgs_in_sealed_chunks is not None and self.last_chunk_num > 0:
+            self.num_msgs_in_sealed_chunks += self.num_msgs_in_last_file
+
+    @property
+    def journal_path(self) -> Path:
+        """Returns path to the journal of the metadata file"""
+        return self.path.with_name(self.path.name + ".journal")
+
     @property
     def path_to_market_data(self) -> Path:
         """Returns path to the market data"""
         return self.path.parent
 
+    @property
+    def path_to_chunks(self) -> Path:
+        """Returns path to the folder with the chunks of the current generation"""
+        if self.generation == 0:
+            return self.path_to_market_data
+        return self.path_to_market_data / f"gen{self.generation}"
+
+    def path_to_chunk(
+        self, chunk_num: int, compression: ChunkCompression | None = None
+    ) -> Path:
+        """Returns path to a chunk (1 indexed)
+
+        Compressed chunks have the compression as their extension. By default,
+        we use the compression of the chunk in the metadata."""
+        if compression is None:
+            compression = self.chunk_compressions.get(chunk_num, ChunkCompression.NONE)
+        if compression == ChunkCompression.NONE:
+            return self.path_to_chunks / str(chunk_num)
+        return self.path_to_chunks / f"{chunk_num}.{compression.value}"
+
+    def chunk_location(self, chunk_num: int) -> Tuple[Path, ChunkCompression]:
+        """Returns the path to a chunk and its compression
+
+        A writer may have compressed a sealed chunk after we loaded the
+        metadata (see sealed_chunk_compression). In that case, the
+        uncompressed chunk is gone and we look for the compressed one."""
+        compression = self.chunk_compressions.get(chunk_num, ChunkCompression.NONE)
+        path = self.path_to_chunk(chunk_num, compression)
+        if compression == ChunkCompression.NONE and not path.exists():
+            for candidate in (ChunkCompression.ZLIB, ChunkCompression.LZMA):
+                candidate_path = self.path_to_chunk(chunk_num, candidate)
+                if candidate_path.exists():
+                    self.chunk_compressions[chunk_num] = candidate
+                    return candidate_path, candidate
+        return path, compression
+
     @property
     def path_to_last_chunk(self) -> Path:
         """Return path to the last chunk"""
-        return self.path_to_market_data / str(self.last_chunk_num)
+        return self.path_to_chunk(self.last_chunk_num)
+
+    @property
+    def num_msgs(self) -> int:
+        """Number of messages in all of the chunks"""
+        num_msgs_in_sealed_chunks = self.num_msgs_in_sealed_chunks
+        if num_msgs_in_sealed_chunks is None:
+            num_msgs_in_sealed_chunks = (
+                max(self.last_chunk_num - 1, 0) * ColeDBInterface.msgs_per_chunk
+            )
+        return num_msgs_in_sealed_chunks + self.num_msgs_in_last_file
 
     @property
     def latest_chunk_timestamp(self) -> datetime:
@@ -119,20 +322,254 @@ class ColeDBMetadata:
         return self.chunk_first_time_stamps[self.last_chunk_num - 1]
 
 
+@dataclass
+class ColeDBCatalogEntry:
+    """Summary of the data that we have for a market
+
+    WARNING: this class is pickled with the catalog, be careful with
+    backwards compatibility.
+    """
+
+    ticker: MarketTicker
+    first_ts: datetime
+    last_ts: datetime
+    num_msgs: int
+    num_chunks: int
+    num_bytes: int
+
+
+class ColeDBCatalog:
+    """Persistent catalog of the markets in ColeDB
+
+    Finding markets by walking the folders takes a stat call per folder,
+    which adds up on a large store. The catalog keeps a summary of every
+    market in a single file at the top of the store instead, so you can
+    look up markets by series and time range without touching the folders.
+
+    Like ColeDBMetadata, updates are appended to a journal next to the
+    catalog file and folded into it periodically. The ColeDBWriter keeps
+    the catalog up to date as it flushes. If you write with the base
+    interface, or the catalog does not exist yet, call rebuild.
+
+    The catalog is only complete (has every market in the store, and their
+    entries are up to date) once it has been rebuilt. rebuild leaves a
+    catalog.complete file next to the catalog, and the base interface removes
+    it whenever it writes. Check complete before you rely on the catalog.
+    """
+
+    # Once the journal has this many records, we fold it into the catalog file
+    max_journal_records: ClassVar[int] = 10000
+
+    def __init__(self, storage_path: Path):
+        self.path = storage_path / "catalog"
+        self.entries: Dict[MarketTicker, ColeDBCatalogEntry] = {}
+        self.num_journal_records = 0
+        # Several writer processes can update the catalog
+        self._lock = FileLock(str(storage_path / "catalog.lock"))
+        self.reload()
+
+    @property
+    def journal_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".journal")
+
+    @staticmethod
+    def complete_path(storage_path: Path) -> Path:
+        return storage_path / "catalog.complete"
+
+    @property
+    def complete(self) -> bool:
+        """Whether the catalog has every market in the store"""
+        return ColeDBCatalog.complete_path(self.path.parent).exists()
+
+    @staticmethod
+    def mark_incomplete(storage_path: Path):
+        """Records that there are markets in the store that the catalog
+        doesn't have, until the next rebuild"""
+        ColeDBCatalog.complete_path(storage_path).unlink(missing_ok=True)
+
+    def reload(self):
+        """Loads the catalog file and replays the journal on top"""
+        self.entries = {}
+        self.num_journal_records = 0
+        if self.path.exists():
+            self.entries = pickle.loads(self.path.read_bytes())
+        if not self.journal_path.exists():
+            return
+        journal = self.journal_path.read_bytes()
+        offset = 0
+        while offset + _CATALOG_RECORD_HEADER.size <= len(journal):
+            (ticker_length,) = _CATALOG_RECORD_HEADER.unpack_from(journal, offset)
+            record_end = offset + _CATALOG_RECORD_HEADER.size + ticker_length
+            if record_end + _CATALOG_RECORD.size > len(journal):
+                # Partially written record at the end
+                break
+            ticker = MarketTicker(
+                journal[offset + _CATALOG_RECORD_HEADER.size : record_end].decode()
+            )
+            (
+                first_micros,
+                last_micros,
+                num_msgs,
+                num_chunks,
+                num_bytes,
+            ) = _CATALOG_RECORD.unpack_from(journal, record_end)
+            self.entries[ticker] = ColeDBCatalogEntry(
+                ticker=ticker,
+                first_ts=_micros_to_datetime(first_micros),
+                last_ts=_micros_to_datetime(last_micros),
+                num_msgs=num_msgs,
+                num_chunks=num_chunks,
+                num_bytes=num_bytes,
+            )
+            self.num_journal_records += 1
+            offset = record_end + _CATALOG_RECORD.size
+
+    def save(self):
+        """Writes the full catalog file and clears the journal"""
+        self.num_journal_records = 0
+        with self._lock:
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_bytes(pickle.dumps(self.entries))
+            tmp_path.replace(self.path)
+            self.journal_path.unlink(missing_ok=True)
+
+    def update(self, entry: ColeDBCatalogEntry):
+        """Sets the entry of a market and records it in the journal"""
+        self.update_many([entry])
+
+    def update_many(self, entries: Iterable[ColeDBCatalogEntry]):
+        """Sets the entries of several markets and records them in the
+        journal with a single append"""
+        records = bytearray()
+        num_records = 0
+        for entry in entries:
+            self.entries[entry.ticker] = entry
+            ticker = entry.ticker.encode()
+            records += (
+                _CATALOG_RECORD_HEADER.pack(len(ticker))
+                + ticker
+                + _CATALOG_RECORD.pack(
+                    _datetime_to_micros(entry.first_ts),
+                    _datetime_to_micros(entry.last_ts),
+                    entry.num_msgs,
+                    entry.num_chunks,
+                    entry.num_bytes,
+                )
+            )
+            num_records += 1
+        if num_records == 0:
+            return
+        with self._lock:
+            with open(str(self.journal_path), "ab") as f:
+                f.write(records)
+            self.num_journal_records += num_records
+            if self.num_journal_records >= self.max_journal_records:
+                # Pick up the records of the other processes before we
+                # fold the journal into the catalog file
+                self.reload()
+                self.save()
+
+    def get(self, ticker: MarketTicker) -> ColeDBCatalogEntry | None:
+        return self.entries.get(ticker)
+
+    def markets(
+        self,
+        series_ticker: SeriesTicker | None = None,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+    ) -> List[ColeDBCatalogEntry]:
+        """Returns the markets (sorted by ticker) in a series that have
+        data between start_ts and end_ts"""
+        return [
+            entry
+            for ticker, entry in sorted(self.entries.items())
+            if (series_ticker is None or ticker.split("-")[0] == series_ticker)
+            and (start_ts is None or entry.last_ts >= start_ts)
+            and (end_ts is None or entry.first_ts <= end_ts)
+        ]
+
+    @staticmethod
+    def entry_from_disk(
+        db: "ColeDBInterface", ticker: MarketTicker
+    ) -> ColeDBCatalogEntry | None:
+        """Builds the entry of a market by looking at its files"""
+        metadata = db.get_metadata(ticker)
+        if metadata.last_chunk_num == 0:
+            return None
+        rows = db.read_chunk_arrays(ticker, metadata.last_chunk_num)
+        last_ts = metadata.latest_chunk_timestamp
+        if len(rows) > 0:
+            last_ts = datetime.fromtimestamp(rows["ts"][-1], ColeDBInterface.tz)
+        return ColeDBCatalogEntry(
+            ticker=ticker,
+            first_ts=metadata.chunk_first_time_stamps[0],
+            last_ts=last_ts,
+            num_msgs=metadata.num_msgs,
+            num_chunks=metadata.last_chunk_num,
+            num_bytes=sum(
+                metadata.path_to_chunk(chunk_num).stat().st_size
+                for chunk_num in range(1, metadata.last_chunk_num + 1)
+            ),
+        )
+
+    def rebuild(self, db: "ColeDBInterface"):
+        """Rebuilds the whole catalog by walking the folders of db"""
+        self.entries = {}
+        for series_ticker in db.get_series_tickers():
+            for event_ticker in db.get_event_tickers(series_ticker):
+                for ticker in db.get_market_tickers(event_ticker):
+                    entry = ColeDBCatalog.entry_from_disk(db, ticker)
+                    if entry is not None:
+                        self.entries[ticker] = entry
+        self.save()
+        ColeDBCatalog.complete_path(self.path.parent).touch()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def _datetime_to_micros(ts: datetime) -> int:
+    return round(ts.timestamp() * 1_000_000)
+
+
+def _micros_to_datetime(micros: int) -> datetime:
+    return datetime.fromtimestamp(micros / 1_000_000, ColeDBInterface.tz)
+
+
 class ColeBytes:
     """Bytes object used to read the binary files from db"""
 
     # Number of bytes to read per chunk
     chunk_read_size_bytes = 8  # 2^6
 
-    def __init__(self, bytes_io: io.BytesIO | io.BufferedReader):
+    def __init__(
+        self, bytes_io: io.BytesIO | io.BufferedReader | memoryview, offset: int = 0
+    ):
+        """Reads from a file like object or directly from a buffer
+
+        If you pass in a memoryview (for example, of a memory mapped chunk),
+        we slice it as we go rather than copying into intermediate bytes.
+        offset is where to start reading in the buffer."""
         self._bio = bytes_io
+        # Position in the buffer if we're reading from a memoryview
+        self._position = offset
         # If we read too many bits, stores remaining bits here
         self._last_bits = 0
         # We expose this so the client can access remaining bits after EOFError
         self.last_bits_length = 0
         self._eof_reached = False
 
+    @property
+    def byte_offset(self) -> int:
+        """Offset in the underlying buffer of the next unread byte
+
+        Only meaningful when we're at a byte boundary (like between messages)"""
+        if isinstance(self._bio, memoryview):
+            position = self._position
+        else:
+            position = self._bio.tell()
+        return position - (self.last_bits_length // 8)
+
     def read(self, size: int) -> int:
         """Reads size bits (if they exist) and returns them
 
@@ -142,7 +579,14 @@ class ColeBytes:
         if size == 0:
             raise ValueError("Must read more than 0 bytes")
         if size > self.last_bits_length:
-            pulled_bytes = self._bio.read(ColeBytes.chunk_read_size_bytes)
+            pulled_bytes: bytes | memoryview
+            if isinstance(self._bio, memoryview):
+                pulled_bytes = self._bio[
+                    self._position : self._position + ColeBytes.chunk_read_size_bytes
+                ]
+                self._position += len(pulled_bytes)
+            else:
+                pulled_bytes = self._bio.read(ColeBytes.chunk_read_size_bytes)
             num_bits_pulled = 8 * len(pulled_bytes)
             self.last_bits_length += num_bits_pulled
             self._last_bits <<= num_bits_pulled
@@ -162,6 +606,83 @@ class ColeBytes:
         return bits
 
 
+class ColeDBChunkCache:
+    """LRU cache of decoded chunks, keyed by (ticker, chunk number)
+
+    The values are the compact arrays from read_chunk_arrays. We evict the
+    least recently used chunks once the arrays take up more than max_bytes.
+    Since the last chunk of a market can still grow, each entry remembers
+    the size of the chunk file that it was decoded from, and we treat the
+    entry as a miss if the file size changed. Likewise, entries remember the
+    generation of the chunks (see ColeDBMetadata) in case they were compacted.
+
+    You can share one cache between multiple interfaces.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Maps the key to the ((generation, chunk file size), rows)
+        self._entries: OrderedDict[
+            Tuple[MarketTicker, int], Tuple[Tuple[int, int], NDArray]
+        ] = OrderedDict()
+
+    def get(
+        self,
+        ticker: MarketTicker,
+        chunk_num: int,
+        chunk_size: int,
+        generation: int = 0,
+    ) -> NDArray | None:
+        """Returns the rows of the chunk if they're cached"""
+        key = (ticker, chunk_num)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != (generation, chunk_size):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(
+        self,
+        ticker: MarketTicker,
+        chunk_num: int,
+        chunk_size: int,
+        rows: NDArray,
+        generation: int = 0,
+    ):
+        """Caches the rows of the chunk and evicts chunks if we're over budget"""
+        key = (ticker, chunk_num)
+        self._remove(key)
+        if rows.nbytes > self.max_bytes:
+            # Would evict everything else
+            return
+        # Callers should not modify the cached rows
+        rows.flags.writeable = False
+        self._entries[key] = ((generation, chunk_size), rows)
+        self.num_bytes += rows.nbytes
+        while self.num_bytes > self.max_bytes:
+            _, (_, evicted_rows) = self._entries.popitem(last=False)
+            self.num_bytes -= evicted_rows.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.num_bytes = 0
+
+    def _remove(self, key: Tuple[MarketTicker, int]):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.num_bytes -= entry[1].nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
 OrderbookCursor = Iterable[Orderbook]
 
 
@@ -171,23 +692,105 @@ class ColeDBCursor(OrderbookCursor):
     ticker: MarketTicker
     start_ts: datetime | None = None
     end_ts: datetime | None = None
+    snapshot: bool = False
 
     def __iter__(self) -> Generator[Orderbook, None, None]:
         return self.interface.read(
-            ticker=self.ticker, start_ts=self.start_ts, end_ts=self.end_ts
+            ticker=self.ticker,
+            start_ts=self.start_ts,
+            end_ts=self.end_ts,
+            snapshot=self.snapshot,
         )
 
 
+class ColeDBLockedError(Exception):
+    """Another process is writing to the market"""
+
+
+@dataclass(frozen=True)
+class ColeDBShard:
+    """A subset of the markets, so that several processes can write to ColeDB
+
+    Each market belongs to exactly one of num_shards shards based on a hash of
+    its ticker. Collectors that run with the same num_shards and different
+    indexes never write to the same market."""
+
+    index: int
+    num_shards: int
+
+    def __post_init__(self):
+        if not 0 <= self.index < self.num_shards:
+            raise ValueError(f"Shard {self.index} is not in [0, {self.num_shards})")
+
+    def owns(self, ticker: MarketTicker) -> bool:
+        # The built in hash is randomized per process
+        return zlib.crc32(ticker.encode()) % self.num_shards == self.index
+
+
+@dataclass
+class _FollowPosition:
+    """Where we are in a market that we're following (see ColeDBInterface.follow)
+
+    chunk_num: the chunk that we're reading
+    num_msgs: number of messages that we read from the chunk
+    byte_offset: offset in the chunk of the next message
+    num_msgs_in_market: number of messages that we read from all of the chunks
+    orderbook: orderbook after the last message that we read
+    metadata_version: (metadata mtime, journal size) of the last metadata we loaded
+    generation: generation of the chunks that we're reading
+    """
+
+    chunk_num: int = field(default=1)
+    num_msgs: int = field(default=0)
+    byte_offset: int = field(default=0)
+    num_msgs_in_market: int = field(default=0)
+    orderbook: Orderbook | None = field(default=None)
+    metadata_version: Tuple[int, int] | None = field(default=None)
+    generation: int | None = field(default=None)
+
+    def apply(self, msg: OrderbookDeltaRM | OrderbookSnapshotRM) -> Orderbook:
+        """Applies a message to the orderbook in place and returns it"""
+        if isinstance(msg, OrderbookSnapshotRM):
+            self.orderbook = Orderbook.from_snapshot(msg)
+        else:
+            assert self.orderbook is not None
+            self.orderbook.apply_delta(msg, in_place=True)
+        return self.orderbook
+
+
 class ColeDBInterface:
     """Public interface for ColeDB"""
 
     msgs_per_chunk = 5000
+    # Default number of messages between checkpoints in a chunk index
+    msgs_per_checkpoint = 500
     tz = pytz.timezone("US/Eastern")
+    # Whether our writes keep the catalog up to date
+    updates_catalog: ClassVar[bool] = False
 
-    def __init__(self, storage_path: Path | None = None):
+    def __init__(
+        self,
+        storage_path: Path | None = None,
+        chunk_cache: ColeDBChunkCache | None = None,
+        sealed_chunk_compression: ChunkCompression = ChunkCompression.NONE,
+        shard: ColeDBShard | None = None,
+    ):
         # Metadata files that we opened up already
         self.cole_db_storage_path = storage_path or COLEDB_DEFAULT_STORAGE_PATH
+        # If set, reads replay the cached decoded chunks rather than decoding
+        self.chunk_cache = chunk_cache
+        # If set, we compress each chunk once we start the next one
+        self.sealed_chunk_compression = sealed_chunk_compression
+        # If set, we only write to the markets in the shard
+        self.shard = shard
+        # Write locks that we hold
+        self._market_locks: Dict[MarketTicker, FileLock] = {}
+        self._catalog: ColeDBCatalog | None = None
+        # Timestamp of the last trade that we wrote for each ticker
+        self._last_trade_ts: Dict[MarketTicker, int] = {}
         self._open_metadata_files: Dict[MarketTicker, ColeDBMetadata] = {}
+        # Orderbook at the end of the last chunk for tickers that we write to
+        self._last_orderbooks: Dict[MarketTicker, Orderbook] = {}
 
     def ticker_exists(self, ticker: MarketTicker) -> bool:
         """Returns if a market ticker is in the DB already."""
@@ -216,6 +819,13 @@ class ColeDBInterface:
                 final_markets.append(current_ticker)
         return final_markets
 
+    @property
+    def catalog(self) -> ColeDBCatalog:
+        """Catalog of the markets in the db, loaded the first time you use it"""
+        if self._catalog is None:
+            self._catalog = ColeDBCatalog(self.cole_db_storage_path)
+        return self._catalog
+
     def get_series_tickers(self) -> List[SeriesTicker]:
         return [
             SeriesTicker(d.name)
@@ -238,6 +848,100 @@ class ColeDBInterface:
         """Given a market ticker returns a path to the metadata file"""
         return self.ticker_to_path(ticker) / "metadata"
 
+    def ticker_to_lock_path(self, ticker: MarketTicker) -> Path:
+        """Given a market ticker returns a path to its write lock"""
+        return self.ticker_to_path(ticker) / "write.lock"
+
+    def lock_market(self, ticker: MarketTicker):
+        """Takes the write lock of a market, so no other writer can write to it
+
+        Raises ColeDBLockedError if another writer has the lock. We hold on to
+        the lock until unlock_market or close. The shard already bounds the
+        markets that a writer owns, so we don't let go of locks on our own.
+        Another writer could have written to the market before we took the
+        lock, so we reload what we cached about the market."""
+        self._check_in_shard(ticker)
+        if ticker in self._market_locks:
+            return
+        path = self.ticker_to_lock_path(ticker)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lock = FileLock(str(path), timeout=0)
+        try:
+            lock.acquire()
+        except Timeout as e:
+            raise ColeDBLockedError(
+                f"{ticker} is being written to by another writer"
+            ) from e
+        self._market_locks[ticker] = lock
+        self._forget_market(ticker)
+
+    def unlock_market(self, ticker: MarketTicker):
+        """Lets go of the write lock of a market"""
+        lock = self._market_locks.pop(ticker, None)
+        if lock is not None:
+            lock.release()
+
+    @contextmanager
+    def market_lock(self, ticker: MarketTicker):
+        """Holds the write lock of a market for the duration of the block
+
+        If we already held the lock before the block, we keep holding it."""
+        self._check_not_writing_from_tests()
+        was_locked = ticker in self._market_locks
+        self.lock_market(ticker)
+        try:
+            yield
+        finally:
+            if not was_locked:
+                self.unlock_market(ticker)
+
+    def forget_market(self, ticker: MarketTicker):
+        """Drops what we cached about a market, so that we reload it from disk
+
+        Call this after something else (like the compactor) rewrote it."""
+        self._forget_market(ticker)
+
+    def close(self):
+        """Lets go of the write locks of all of the markets"""
+        for ticker in list(self._market_locks):
+            self.unlock_market(ticker)
+
+    def _forget_market(self, ticker: MarketTicker):
+        """Drops what we cached about a market, it may have changed on disk"""
+        self._open_metadata_files.pop(ticker, None)
+        self._last_orderbooks.pop(ticker, None)
+        self._last_trade_ts.pop(ticker, None)
+
+    def ticker_to_market_info_path(self, ticker: MarketTicker) -> Path:
+        """Given a market ticker returns a path to the market info file"""
+        return self.ticker_to_path(ticker) / "market.json"
+
+    def market_info_exists(self, ticker: MarketTicker) -> bool:
+        return self.ticker_to_market_info_path(ticker).exists()
+
+    def read_market_info(self, ticker: MarketTicker) -> Market:
+        """Reads the market level info (close time, result, strikes, etc.)
+
+        This is filled in by the collector and by backfill_market_info, so
+        research and sims don't need to ask the exchange for it."""
+        path = self.ticker_to_market_info_path(ticker)
+        if not path.exists():
+            raise FileNotFoundError(f"Could not find market info for {ticker}")
+        return Market.model_validate_json(path.read_bytes())
+
+    def write_market_info(self, market: Market):
+        """Saves the market level info next to the market data
+
+        We store the market as json rather than pickling it so that we can
+        add fields to Market without breaking the files."""
+        # The catalog doesn't have the market info
+        self._start_writing(market.ticker, changes_catalog=False)
+        path = self.ticker_to_market_info_path(market.ticker)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(market.model_dump_json())
+        tmp_path.replace(path)
+
     def get_metadata(self, ticker: MarketTicker) -> ColeDBMetadata:
         """Gets the metadata file for the market if it exists. Otherwise, creates it"""
         if ticker in self._open_metadata_files:
@@ -266,22 +970,19 @@ class ColeDBInterface:
 
         while len(folders_to_make) > 0:
             folder_to_make = folders_to_make.pop()
-            folder_to_make.mkdir()
+            # Another process could be making the same series or event folder
+            folder_to_make.mkdir(exist_ok=True)
         metadata = ColeDBMetadata(
             path=path,
+            num_msgs_in_sealed_chunks=0,
         )
         metadata.save()
+        self._open_metadata_files[ticker] = metadata
         return metadata
 
     def write(self, data: OrderbookDeltaRM | OrderbookSnapshotRM):
         """Writes data to cole db"""
-        if (
-            "pytest" in sys.modules
-            and self.cole_db_storage_path == COLEDB_DEFAULT_STORAGE_PATH
-        ):
-            raise RuntimeError(
-                "Pytest is running, are you sure you want to write to ColeDB?"
-            )
+        self._start_writing(data.market_ticker)
         try:
             metadata = self.get_metadata(data.market_ticker)
         except FileNotFoundError:
@@ -293,37 +994,184 @@ class ColeDBInterface:
                     f"New dataset writes must start with a snapshot! Data: {data}"
                 )
             self._create_new_chunk(data, metadata)
+            self._update_last_orderbook(data)
             return
+        # Compacted markets can have more messages in their last chunk
         needs_new_chunk = (
-            metadata.num_msgs_in_last_file == ColeDBInterface.msgs_per_chunk
+            metadata.num_msgs_in_last_file >= ColeDBInterface.msgs_per_chunk
         )
         if needs_new_chunk:
             if isinstance(data, OrderbookSnapshotRM):
                 self._create_new_chunk(data, metadata)
             else:
-                last_chunk_snapshot = ColeDBInterface._read_chunk_apply_deltas(
-                    metadata.path_to_last_chunk,
-                    data.market_ticker,
-                    metadata.latest_chunk_timestamp,
+                last_chunk_snapshot = self._get_last_chunk_orderbook(
+                    data.market_ticker, metadata
                 )
                 last_chunk_snapshot = last_chunk_snapshot.apply_delta(data)
                 self._create_new_chunk(
                     OrderbookSnapshotRM.from_orderbook(last_chunk_snapshot), metadata
                 )
         else:
-            ColeDBInterface._write_data_to_last_file(data, metadata)
+            self._write_data_to_last_file(data, metadata)
+        self._update_last_orderbook(data)
+
+    def _start_writing(self, ticker: MarketTicker, changes_catalog: bool = True):
+        """Checks that we can write to a market before we write to it
+
+        changes_catalog: whether the write changes what the catalog knows
+        about the market"""
+        self._check_not_writing_from_tests()
+        self._check_in_shard(ticker)
+        if changes_catalog and not self.updates_catalog:
+            # The catalog won't know about what we write
+            ColeDBCatalog.mark_incomplete(self.cole_db_storage_path)
+
+    def _check_in_shard(self, ticker: MarketTicker):
+        if self.shard is not None and not self.shard.owns(ticker):
+            raise ValueError(f"{ticker} is not in shard {self.shard}")
+
+    def _check_not_writing_from_tests(self):
+        if (
+            "pytest" in sys.modules
+            and self.cole_db_storage_path == COLEDB_DEFAULT_STORAGE_PATH
+        ):
+            raise RuntimeError(
+                "Pytest is running, are you sure you want to write to ColeDB?"
+            )
+
+    def ticker_to_trades_path(self, ticker: MarketTicker) -> Path:
+        """Given a market ticker returns a path to the trades file"""
+        return self.ticker_to_path(ticker) / "trades"
+
+    def trades_exist(self, ticker: MarketTicker) -> bool:
+        return self.ticker_to_trades_path(ticker).exists()
+
+    def write_trade(self, trade: TradeRM):
+        """Appends a trade to the trades file of the market
+
+        Trades are fixed size records (see TRADE_DTYPE) sorted by ts, so we
+        can binary search for a timestamp. That means trades must be written
+        in order. The no price is not stored since it's 100 - yes price."""
+        self._start_writing(trade.market_ticker)
+        path = self.ticker_to_trades_path(trade.market_ticker)
+        last_ts = self._last_trade_ts.get(trade.market_ticker)
+        if last_ts is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            trades = ColeDBInterface._load_trades(path)
+            if path.exists():
+                # Drop a partially written trade so that we stay aligned
+                os.truncate(path, len(trades) * TRADE_DTYPE.itemsize)
+            last_trade = trades[-1:]
+            last_ts = int(last_trade["ts"][0]) if len(last_trade) > 0 else 0
+        if trade.ts < last_ts:
+            raise ValueError(
+                f"Trades must be written in order. Last ts: {last_ts}, trade: {trade}"
+            )
+        record = np.array(
+            [
+                (
+                    trade.ts,
+                    trade.yes_price,
+                    trade.count,
+                    1 if trade.taker_side == Side.YES else 0,
+                )
+            ],
+            dtype=TRADE_DTYPE,
+        )
+        with open(str(path), "ab") as f:
+            f.write(record.tobytes())
+        self._last_trade_ts[trade.market_ticker] = trade.ts
+
+    def read_trades(
+        self,
+        ticker: MarketTicker,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+    ) -> Generator[TradeRM, None, None]:
+        """Reads the trades of a market with start_ts <= ts <= end_ts
+
+        We binary search the memory mapped trades file for the timestamps,
+        so we only touch the trades that we return."""
+        records = ColeDBInterface._load_trades(self.ticker_to_trades_path(ticker))
+        start = 0
+        end = len(records)
+        if start_ts is not None:
+            start = int(np.searchsorted(records["ts"], start_ts.timestamp()))
+        if end_ts is not None:
+            end = int(np.searchsorted(records["ts"], end_ts.timestamp(), "right"))
+        for ts, yes_price, count, taker_side in records[start:end].tolist():
+            # Construct does not do validation, faster
+            yield TradeRM.model_construct(
+                market_ticker=ticker,
+                yes_price=Price(yes_price),
+                no_price=Price(100 - yes_price),
+                count=Quantity(count),
+                taker_side=Side.YES if taker_side == 1 else Side.NO,
+                ts=ts,
+            )
+
+    @staticmethod
+    def _load_trades(path: Path) -> NDArray:
+        """Memory maps the trades file
+
+        Ignores a partially written trade at the end"""
+        num_trades = path.stat().st_size // TRADE_DTYPE.itemsize if path.exists() else 0
+        if num_trades == 0:
+            # Can't map an empty file
+            return np.empty(0, dtype=TRADE_DTYPE)
+        return np.memmap(path, dtype=TRADE_DTYPE, mode="r", shape=(num_trades,))
+
+    def flush(self, ticker: MarketTicker | None = None):
+        """Makes sure all writes are on disk.
+
+        Writes are not buffered in the base interface, so there is nothing to do.
+        See ColeDBWriter."""
+        return
+
+    def _get_last_chunk_orderbook(
+        self, ticker: MarketTicker, metadata: ColeDBMetadata
+    ) -> Orderbook:
+        """Returns the orderbook at the end of the last chunk
+
+        We keep this orderbook in memory as we write. If we haven't seen the
+        ticker since we started, we rebuild it from disk once."""
+        if ticker not in self._last_orderbooks:
+            path, compression = metadata.chunk_location(metadata.last_chunk_num)
+            self._last_orderbooks[ticker] = ColeDBInterface._read_chunk_apply_deltas(
+                path, ticker, metadata.latest_chunk_timestamp, compression
+            )
+        return self._last_orderbooks[ticker]
+
+    def _update_last_orderbook(self, data: OrderbookDeltaRM | OrderbookSnapshotRM):
+        """Applies a message that we just wrote to the in memory orderbook"""
+        if isinstance(data, OrderbookSnapshotRM):
+            self._last_orderbooks[data.market_ticker] = Orderbook.from_snapshot(data)
+            return
+        orderbook = self._last_orderbooks.get(data.market_ticker)
+        if orderbook is None:
+            # We'll read it from disk if we need it
+            return
+        # We don't validate the orderbook here because we don't validate
+        # the deltas that we write to disk either
+        orderbook.get_side(data.side).apply_delta(data.price, data.delta)
+        orderbook.ts = data.ts
 
     def read_cursor(
         self,
         ticker: MarketTicker,
         start_ts: datetime | None = None,
         end_ts: datetime | None = None,
+        snapshot: bool = False,
     ) -> ColeDBCursor:
         """
         Returns a cursor that can be used to read through coledb entries multiple times.
         """
         return ColeDBCursor(
-            interface=self, ticker=ticker, start_ts=start_ts, end_ts=end_ts
+            interface=self,
+            ticker=ticker,
+            start_ts=start_ts,
+            end_ts=end_ts,
+            snapshot=snapshot,
         )
 
     def read(
@@ -331,10 +1179,17 @@ class ColeDBInterface:
         ticker: MarketTicker,
         start_ts: datetime | None = None,
         end_ts: datetime | None = None,
+        snapshot: bool = False,
     ) -> Generator[Orderbook, None, None]:
+        """Yields the orderbook after each message
+
+        By default, we apply the deltas in place, so the same orderbook object
+        is yielded every time and is only valid until you pull the next one.
+        If you hold on to the orderbooks, pass snapshot=True to get a read only
+        snapshot (see Orderbook.freeze) per message instead."""
         for data in self._read(ticker, start_ts, end_ts, read_raw=False):
             assert isinstance(data, Orderbook)
-            yield data
+            yield data.freeze() if snapshot else data
 
     def read_raw(
         self,
@@ -348,6 +1203,159 @@ class ColeDBInterface:
             )
             yield data
 
+    def read_many(
+        self,
+        tickers: Iterable[MarketTicker],
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+        read_raw: bool = False,
+    ) -> Generator[
+        Tuple[MarketTicker, Orderbook | OrderbookDeltaRM | OrderbookSnapshotRM],
+        None,
+        None,
+    ]:
+        """Reads multiple markets at once, streamed together sorted by time
+
+        We do a heap based k-way merge across the readers of each ticker, so
+        each step costs O(log k). Messages with the same timestamp come out in
+        the order of the tickers passed in. Yields (ticker, orderbook) or
+        (ticker, raw message) if read_raw is true.
+
+        Like read, the orderbook of a ticker is re-used across messages, so it
+        is only valid until you pull the next message for that ticker.
+        """
+        readers = [
+            zip(repeat(ticker), self._read(ticker, start_ts, end_ts, read_raw))
+            for ticker in tickers
+        ]
+        yield from heapq.merge(
+            *readers, key=lambda ticker_and_data: ticker_and_data[1].ts
+        )
+
+    def follow(
+        self,
+        tickers: Iterable[MarketTicker],
+        read_raw: bool = False,
+        poll_interval: timedelta = timedelta(seconds=1),
+    ) -> Generator[
+        Tuple[MarketTicker, Orderbook | OrderbookDeltaRM | OrderbookSnapshotRM],
+        None,
+        None,
+    ]:
+        """Yields the new messages of the markets as they're written, like tail -f
+
+        We start from the end of the data that is on disk when you call follow.
+        Each poll, we reload the metadata of the markets from disk and read the
+        messages that it counts past where we left off. Writers only update the
+        metadata after the data is on disk, so we never read a partially written
+        message. Markets that don't exist yet are picked up once they're
+        written. If there is nothing new, we sleep for poll_interval.
+
+        Messages of different markets come out in the order that we poll them,
+        not sorted by time. Like read_many, yields (ticker, orderbook) or
+        (ticker, raw message) if read_raw is true, and the orderbook of a
+        ticker is re-used across messages. The generator never ends.
+        """
+        positions: Dict[MarketTicker, _FollowPosition] = {}
+        for ticker in tickers:
+            position = _FollowPosition()
+            # Skip the messages that are already there
+            for msg in self._read_new_messages(ticker, position):
+                position.apply(msg)
+            positions[ticker] = position
+        return self._follow(positions, read_raw, poll_interval)
+
+    def _follow(
+        self,
+        positions: Dict[MarketTicker, _FollowPosition],
+        read_raw: bool,
+        poll_interval: timedelta,
+    ) -> Generator[
+        Tuple[MarketTicker, Orderbook | OrderbookDeltaRM | OrderbookSnapshotRM],
+        None,
+        None,
+    ]:
+        while True:
+            found_new_msgs = False
+            for ticker, position in positions.items():
+                for msg in self._read_new_messages(ticker, position):
+                    found_new_msgs = True
+                    orderbook = position.apply(msg)
+                    yield ticker, msg if read_raw else orderbook
+            if not found_new_msgs:
+                time.sleep(poll_interval.total_seconds())
+
+    def _read_new_messages(
+        self, ticker: MarketTicker, position: _FollowPosition
+    ) -> List[OrderbookDeltaRM | OrderbookSnapshotRM]:
+        """Reads the messages of a market written since the position and moves
+        the position past them. The caller applies them to the orderbook."""
+        path = self.ticker_to_metadata_path(ticker)
+        if not path.exists():
+            return []
+        journal_path = path.with_name(path.name + ".journal")
+        metadata_version = (
+            path.stat().st_mtime_ns,
+            journal_path.stat().st_size if journal_path.exists() else -1,
+        )
+        if metadata_version == position.metadata_version:
+            # Nothing was written since the last poll
+            return []
+        position.metadata_version = metadata_version
+        metadata = ColeDBMetadata.load(path)
+        # If the chunks were rewritten (see compaction.py), our position in
+        # them doesn't mean anything anymore. The messages of the new chunks
+        # map one to one to the old ones, so we read the new chunks from the
+        # start and skip as many messages as we already read. Our orderbook
+        # already has them applied. The snapshots that the compactor puts at
+        # the start of each chunk take the place of a message, so they don't
+        # change the count.
+        num_msgs_to_skip = 0
+        if position.generation not in (None, metadata.generation):
+            num_msgs_to_skip = position.num_msgs_in_market
+            position.chunk_num = 1
+            position.num_msgs = 0
+            position.byte_offset = 0
+            position.num_msgs_in_market = 0
+        position.generation = metadata.generation
+
+        msgs: List[OrderbookDeltaRM | OrderbookSnapshotRM] = []
+        while position.chunk_num <= metadata.last_chunk_num:
+            is_last_chunk = position.chunk_num == metadata.last_chunk_num
+            # Sealed chunks are complete, so we read them to the end. We only
+            # read up to the count in the metadata from the last chunk.
+            num_msgs_to_read = (
+                metadata.num_msgs_in_last_file - position.num_msgs
+                if is_last_chunk
+                else None
+            )
+            if num_msgs_to_read != 0:
+                with self._map_chunk(
+                    *metadata.chunk_location(position.chunk_num)
+                ) as chunk:
+                    cole_bytes = ColeBytes(chunk, position.byte_offset)
+                    for msg in islice(
+                        self._decode_messages(
+                            cole_bytes,
+                            ticker,
+                            metadata.chunk_first_time_stamps[position.chunk_num - 1],
+                        ),
+                        num_msgs_to_read,
+                    ):
+                        position.num_msgs += 1
+                        position.num_msgs_in_market += 1
+                        if num_msgs_to_skip > 0:
+                            num_msgs_to_skip -= 1
+                            continue
+                        msgs.append(msg)
+                    position.byte_offset = cole_bytes.byte_offset
+            if is_last_chunk:
+                break
+            position.chunk_num += 1
+            position.num_msgs = 0
+            position.byte_offset = 0
+        return msgs
+
     def _read(
         self,
         ticker: MarketTicker,
@@ -358,22 +1366,26 @@ class ColeDBInterface:
         """Reads data from coledb"""
 
         metadata = self.get_metadata(ticker)
-        # If this breaks, this means there are no chunks
-        chunk_start_ts = metadata.chunk_first_time_stamps[0]
-        chunk_name = 1
-        if start_ts and (start_ts > chunk_start_ts):
-            for i, time in enumerate(metadata.chunk_first_time_stamps):
-                if time <= start_ts:
-                    chunk_name = i + 1
-                    chunk_start_ts = time
-                    break
-        while (chunk_index := (chunk_name - 1)) < len(
-            metadata.chunk_first_time_stamps
-        ) and (
-            end_ts is None or (end_ts >= metadata.chunk_first_time_stamps[chunk_index])
-        ):
-            path_to_chunk = metadata.path_to_market_data / str(chunk_name)
-            chunk_start_ts = metadata.chunk_first_time_stamps[chunk_index]
+        is_first_chunk = True
+        for chunk_num in self._get_chunks_to_read(metadata, start_ts, end_ts):
+            path_to_chunk, compression = metadata.chunk_location(chunk_num)
+            chunk_start_ts = metadata.chunk_first_time_stamps[chunk_num - 1]
+            if self.chunk_cache is not None:
+                rows = self._read_chunk_rows(ticker, metadata, chunk_num)
+                yield from ColeDBInterface._apply_deltas_generator(
+                    rows_to_messages(rows, ticker, chunk_start_ts),
+                    start_ts,
+                    end_ts,
+                    read_raw,
+                )
+                continue
+            # Only the first chunk can have messages before start_ts
+            checkpoint = None
+            if is_first_chunk and start_ts:
+                checkpoint = ColeDBInterface._find_checkpoint(
+                    path_to_chunk, ticker, chunk_start_ts, start_ts
+                )
+            is_first_chunk = False
             yield from self._read_chunk_apply_deltas_generator(
                 path_to_chunk,
                 ticker,
@@ -381,8 +1393,239 @@ class ColeDBInterface:
                 start_ts,
                 end_ts,
                 read_raw=read_raw,
+                checkpoint=checkpoint,
+                compression=compression,
+            )
+
+    @staticmethod
+    def _get_chunks_to_read(
+        metadata: ColeDBMetadata,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+    ) -> Generator[int, None, None]:
+        """Yields the number of each chunk that we need to open to read
+        the data between start_ts and end_ts
+
+        We start from the last chunk that begins strictly before start_ts
+        (found with a binary search), since the end of that chunk can have
+        messages at exactly start_ts. We stop once a chunk begins after end_ts."""
+        chunk_first_time_stamps = metadata.chunk_first_time_stamps
+        chunk_index = 0
+        if start_ts:
+            chunk_index = max(bisect_left(chunk_first_time_stamps, start_ts) - 1, 0)
+        while chunk_index < len(chunk_first_time_stamps) and (
+            end_ts is None or (end_ts >= chunk_first_time_stamps[chunk_index])
+        ):
+            # Chunk names are 1 indexed
+            yield chunk_index + 1
+            chunk_index += 1
+
+    def read_arrays(
+        self,
+        ticker: MarketTicker,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+    ) -> NDArray:
+        """Bulk reads the raw messages of a market into a numpy structured array
+
+        This is much faster than read_raw because we read each chunk in one go
+        and decode all of the deltas with vectorized numpy operations. The rows
+        have the dtype COLEDB_ARRAY_DTYPE (see ColeDBRowType for how snapshots
+        are represented). Like read_raw, we return the messages with
+        start_ts <= ts <= end_ts, so the book is not materialized at start_ts.
+        """
+        metadata = self.get_metadata(ticker)
+        start = None if start_ts is None else start_ts.timestamp()
+        end = None if end_ts is None else end_ts.timestamp()
+        arrays: List[NDArray] = []
+        is_first_chunk = True
+        for chunk_num in self._get_chunks_to_read(metadata, start_ts, end_ts):
+            path_to_chunk, compression = metadata.chunk_location(chunk_num)
+            chunk_start_ts = metadata.chunk_first_time_stamps[chunk_num - 1]
+            if self.chunk_cache is not None:
+                # Filtering by ts drops the messages before start_ts anyways
+                rows = self._read_chunk_rows(ticker, metadata, chunk_num)
+                rows, reached_end = filter_rows_by_ts(rows, start, end)
+                arrays.append(rows)
+                if reached_end:
+                    break
+                continue
+            raw = ColeDBInterface._read_chunk_bytes(path_to_chunk, compression)
+            if (
+                is_first_chunk
+                and start_ts
+                and (
+                    checkpoint := ColeDBInterface._find_checkpoint(
+                        path_to_chunk, ticker, chunk_start_ts, start_ts
+                    )
+                )
+            ):
+                # All of the messages before the checkpoint are before start_ts
+                raw = raw[checkpoint[0] :]
+            is_first_chunk = False
+            rows = ColeDBInterface._decode_chunk_to_arrays(raw, ticker, chunk_start_ts)
+            rows, reached_end = filter_rows_by_ts(rows, start, end)
+            arrays.append(rows)
+            if reached_end:
+                break
+        if len(arrays) == 0:
+            return np.empty(0, dtype=COLEDB_ARRAY_DTYPE)
+        return np.concatenate(arrays)
+
+    def read_chunk_arrays(
+        self,
+        ticker: MarketTicker,
+        chunk_num: int,
+        metadata: ColeDBMetadata | None = None,
+    ) -> NDArray:
+        """Bulk reads all of the messages in one chunk (1 indexed) of a market
+
+        See read_arrays for the format. Since every chunk starts with a
+        snapshot, you can replay the result with arrays_to_orderbooks. Pass
+        metadata to read the chunk that it describes rather than the one in
+        the metadata that we cached (for example, metadata that you just
+        loaded from disk)."""
+        return self._read_chunk_rows(
+            ticker, metadata or self.get_metadata(ticker), chunk_num
+        )
+
+    def _read_chunk_rows(
+        self, ticker: MarketTicker, metadata: ColeDBMetadata, chunk_num: int
+    ) -> NDArray:
+        """Decodes a whole chunk into rows, going through the chunk cache"""
+        path_to_chunk, compression = metadata.chunk_location(chunk_num)
+        chunk_start_ts = metadata.chunk_first_time_stamps[chunk_num - 1]
+        if self.chunk_cache is None:
+            return ColeDBInterface._decode_chunk_to_arrays(
+                ColeDBInterface._read_chunk_bytes(path_to_chunk, compression),
+                ticker,
+                chunk_start_ts,
+            )
+        chunk_size = os.path.getsize(str(path_to_chunk))
+        rows = self.chunk_cache.get(
+            ticker, chunk_num, chunk_size, generation=metadata.generation
+        )
+        if rows is None:
+            raw = ColeDBInterface._read_chunk_bytes(path_to_chunk, compression)
+            rows = ColeDBInterface._decode_chunk_to_arrays(raw, ticker, chunk_start_ts)
+            self.chunk_cache.put(
+                ticker, chunk_num, chunk_size, rows, generation=metadata.generation
+            )
+        return rows
+
+    @staticmethod
+    def _read_chunk_bytes(
+        path_to_chunk: Path, compression: ChunkCompression = ChunkCompression.NONE
+    ) -> bytes:
+        """Reads a chunk, decompressing it if it's compressed"""
+        return compression.decompress(path_to_chunk.read_bytes())
+
+    def build_index(self, ticker: MarketTicker, msgs_per_checkpoint: int | None = None):
+        """Builds a sidecar index for each chunk of a market
+
+        The index of a chunk stores a checkpoint every msgs_per_checkpoint
+        messages: the byte offset of the next message, its timestamp, and
+        the orderbook at that point (encoded as a snapshot). Reads that start
+        in the middle of a chunk can then jump to the last checkpoint before
+        start_ts rather than decoding from the start of the chunk.
+
+        An index on the last chunk is still valid as the chunk grows, it just
+        won't cover the newer messages until you rebuild it.
+        """
+        msgs_per_checkpoint = msgs_per_checkpoint or self.msgs_per_checkpoint
+        metadata = self.get_metadata(ticker)
+        for chunk_num in self._get_chunks_to_read(metadata):
+            path_to_chunk, compression = metadata.chunk_location(chunk_num)
+            ColeDBInterface._build_chunk_index(
+                path_to_chunk,
+                ticker,
+                metadata.chunk_first_time_stamps[chunk_num - 1],
+                msgs_per_checkpoint,
+                compression,
             )
-            chunk_name += 1
+
+    @staticmethod
+    def chunk_to_index_path(path_to_chunk: Path) -> Path:
+        """Given a path to a chunk, returns the path to its sidecar index
+
+        The offsets in the index are into the uncompressed chunk, so a chunk
+        keeps its index if it gets compressed."""
+        return path_to_chunk.with_suffix(".index")
+
+    @staticmethod
+    def _build_chunk_index(
+        path_to_chunk: Path,
+        ticker: MarketTicker,
+        chunk_start_ts: datetime,
+        msgs_per_checkpoint: int,
+        compression: ChunkCompression = ChunkCompression.NONE,
+    ):
+        """Writes the index for a single chunk. See build_index"""
+        index = bytearray()
+        with ColeDBInterface._map_chunk(path_to_chunk, compression) as chunk:
+            cole_bytes = ColeBytes(chunk)
+            orderbook: Orderbook | None = None
+            num_msgs = 0
+            while True:
+                try:
+                    msg = ColeDBInterface._decode_to_response_message(
+                        cole_bytes, ticker, chunk_start_ts
+                    )
+                except EOFError:
+                    break
+                if isinstance(msg, OrderbookSnapshotRM):
+                    orderbook = Orderbook.from_snapshot(msg)
+                else:
+                    assert orderbook is not None
+                    orderbook.apply_delta(msg, in_place=True)
+                num_msgs += 1
+                if num_msgs % msgs_per_checkpoint == 0:
+                    # Messages are byte aligned
+                    byte_offset = cole_bytes.byte_offset
+                    snapshot_bytes = ColeDBInterface._encode_orderbook_snapshot(
+                        OrderbookSnapshotRM.from_orderbook(orderbook), chunk_start_ts
+                    )
+                    index += _CHECKPOINT_HEADER.pack(
+                        byte_offset, orderbook.ts.timestamp(), len(snapshot_bytes)
+                    )
+                    index += snapshot_bytes
+        index_path = ColeDBInterface.chunk_to_index_path(path_to_chunk)
+        tmp_path = index_path.with_name(index_path.name + ".tmp")
+        tmp_path.write_bytes(bytes(index))
+        tmp_path.replace(index_path)
+
+    @staticmethod
+    def _find_checkpoint(
+        path_to_chunk: Path,
+        ticker: MarketTicker,
+        chunk_start_ts: datetime,
+        start_ts: datetime,
+    ) -> Tuple[int, OrderbookSnapshotRM] | None:
+        """Returns the byte offset and orderbook of the last checkpoint
+        strictly before start_ts, if the chunk has an index"""
+        index_path = ColeDBInterface.chunk_to_index_path(path_to_chunk)
+        if not index_path.exists():
+            return None
+        index = index_path.read_bytes()
+        start = start_ts.timestamp()
+        best: Tuple[int, int, int] | None = None
+        position = 0
+        while position < len(index):
+            byte_offset, ts, length = _CHECKPOINT_HEADER.unpack_from(index, position)
+            position += _CHECKPOINT_HEADER.size
+            if ts >= start:
+                break
+            best = (byte_offset, position, length)
+            position += length
+        if best is None:
+            return None
+        byte_offset, position, length = best
+        cole_bytes = ColeBytes(io.BytesIO(index[position : position + length]))
+        msg = ColeDBInterface._decode_to_response_message(
+            cole_bytes, ticker, chunk_start_ts
+        )
+        assert isinstance(msg, OrderbookSnapshotRM)
+        return byte_offset, msg
 
     def read_df(
         self,
@@ -397,12 +1640,42 @@ class ColeDBInterface:
             if nrows and len(d) == nrows:
                 break
             d.append(orderbook_to_df_row(ob))
-        columns = (
-            ["ts"]
-            + [f"yes_bid_{i}" for i in range(1, 100)]
-            + [f"no_bid_{i}" for i in range(1, 100)]
-        )
-        return DataFrame(d, columns=columns)
+        return DataFrame(d, columns=ORDERBOOK_DF_COLUMNS)
+
+    def read_df_many(
+        self,
+        tickers: List[MarketTicker],
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+        nrows: int | None = None,
+        workers: int | None = None,
+    ) -> List[DataFrame]:
+        """Like read_df, but reads the markets in parallel with a process pool
+
+        Decoding is CPU bound, so each market is read in its own process.
+        Rather than pickling the dataframes back to us, the workers put the
+        rows in shared memory. Returns the dataframes in the order of tickers.
+        workers defaults to the number of cpus."""
+        workers = min(workers or cpu_count(), len(tickers))
+        if workers <= 1:
+            return [self.read_df(ticker, start_ts, end_ts, nrows) for ticker in tickers]
+        # Make sure the workers see everything that we wrote
+        self.flush()
+        # Shared memory from the workers is tracked by our resource tracker,
+        # so it isn't cleaned up when the pool shuts down
+        resource_tracker.ensure_running()
+        with Pool(workers) as p:
+            results = p.starmap(
+                _read_df_to_shared_memory,
+                [
+                    (self.cole_db_storage_path, ticker, start_ts, end_ts, nrows)
+                    for ticker in tickers
+                ],
+            )
+        return [
+            DataFrame(_pop_shared_memory(name, num_rows), columns=ORDERBOOK_DF_COLUMNS)
+            for name, num_rows in results
+        ]
 
     def read_bbo_df(
         self,
@@ -412,16 +1685,51 @@ class ColeDBInterface:
         nrows: int | None = None,
     ) -> DataFrame:
         """Reads data into pandas df for the bbo"""
-        d: List[NDArray] = []
-        for ob in self.read(ticker, start_ts, end_ts):
-            if nrows and len(d) == nrows:
-                break
-            d.append(orderbook_to_bbo_row(ob))
         columns = ["ts", "yes_bid_price", "yes_bid_qty", "yes_ask_price", "yes_ask_qty"]
-        return DataFrame(d, columns=columns)
+        return DataFrame(
+            self.read_bbo_arrays(ticker, start_ts, end_ts, nrows), columns=columns
+        )
+
+    def read_bbo_arrays(
+        self,
+        ticker: MarketTicker,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+        nrows: int | None = None,
+    ) -> NDArray[np.float64]:
+        """Reads the yes side bbo after each message into a (num messages, 5) array
+
+        The columns are the same as orderbook_to_bbo_row. Same messages as read,
+        but much faster than calling get_bbo on each orderbook, since we decode
+        whole chunks with numpy and never build the full book (see arrays_to_bbo).
+        """
+        metadata = self.get_metadata(ticker)
+        start = None if start_ts is None else start_ts.timestamp()
+        end = None if end_ts is None else end_ts.timestamp()
+        arrays: List[NDArray] = []
+        num_rows = 0
+        for chunk_num in self._get_chunks_to_read(metadata, start_ts, end_ts):
+            # We need the whole chunk to know the book at start_ts
+            bbo = arrays_to_bbo(self._read_chunk_rows(ticker, metadata, chunk_num))
+            reached_end = False
+            if end is not None:
+                past_end = np.flatnonzero(bbo[:, 0] > end)
+                if len(past_end) > 0:
+                    bbo = bbo[: past_end[0]]
+                    reached_end = True
+            if start is not None:
+                bbo = bbo[bbo[:, 0] >= start]
+            arrays.append(bbo)
+            num_rows += len(bbo)
+            if reached_end or (nrows and num_rows >= nrows):
+                break
+        if len(arrays) == 0:
+            return np.empty((0, 5))
+        bbo = np.concatenate(arrays)
+        return bbo[:nrows] if nrows else bbo
 
-    @staticmethod
     def _write_data_to_last_file(
+        self,
         data: OrderbookDeltaRM | OrderbookSnapshotRM,
         metadata: ColeDBMetadata,
     ):
@@ -434,7 +1742,7 @@ class ColeDBInterface:
                 )
             )
         metadata.num_msgs_in_last_file += 1
-        metadata.save()
+        metadata.append_to_journal()
 
     @staticmethod
     def _encode_to_bytes(
@@ -847,33 +2155,220 @@ class ColeDBInterface:
                 b, ticker, chunk_start_timestamp
             )
 
+    @staticmethod
+    def _decode_chunk_to_arrays(
+        raw: bytes,
+        ticker: MarketTicker,
+        chunk_start_timestamp: datetime,
+    ) -> NDArray:
+        """Decodes all of the messages in a chunk into a structured array
+
+        Since the messages are variable length, we first walk the chunk to find
+        where each message starts. Deltas have a fixed layout that's fully
+        described by their first byte, so we only need to look at that byte
+        to skip to the next message. Snapshots are rare (usually one per
+        chunk), so we decode those with the regular decoder. Then we decode
+        all of the delta fields at once using numpy.
+        """
+        delta_offsets: List[int] = []
+        # (index of the next delta, decoded snapshot)
+        snapshots: List[Tuple[int, OrderbookSnapshotRM]] = []
+        offset = 0
+        num_bytes = len(raw)
+        raw_view = memoryview(raw)
+        while offset < num_bytes:
+            first_byte = raw[offset]
+            if first_byte & 0x80:
+                # Delta: 15 constant bits + the timestamp and quantity half bytes
+                num_half_bytes = ((first_byte >> 4) & 7) + ((first_byte >> 1) & 7) + 2
+                msg_length = get_num_byte_sections_per_bits(15 + 4 * num_half_bytes, 8)
+                if offset + msg_length > num_bytes:
+                    # Partially written message
+                    break
+                delta_offsets.append(offset)
+                offset += msg_length
+            else:
+                cole_bytes = ColeBytes(raw_view, offset)
+                try:
+                    cole_bytes.read(1)
+                    snapshot = ColeDBInterface._decode_orderbook_snapshot(
+                        cole_bytes, ticker, chunk_start_timestamp
+                    )
+                except EOFError:
+                    break
+                snapshots.append((len(delta_offsets), snapshot))
+                offset = cole_bytes.byte_offset
+
+        deltas = ColeDBInterface._decode_deltas_to_array(
+            raw, np.array(delta_offsets, dtype=np.int64), chunk_start_timestamp
+        )
+        if len(snapshots) == 0:
+            return deltas
+
+        segments: List[NDArray] = []
+        last_index = 0
+        for index, snapshot in snapshots:
+            segments.append(deltas[last_index:index])
+            segments.append(snapshot_to_rows(snapshot))
+            last_index = index
+        segments.append(deltas[last_index:])
+        return np.concatenate(segments)
+
+    @staticmethod
+    def _decode_deltas_to_array(
+        raw: bytes,
+        offsets: NDArray[np.int64],
+        chunk_start_timestamp: datetime,
+    ) -> NDArray:
+        """Decodes the deltas that start at the offsets of raw in a vectorized way
+
+        See _encode_orderbook_delta for the layout of the bits"""
+        rows = np.empty(len(offsets), dtype=COLEDB_ARRAY_DTYPE)
+        if len(offsets) == 0:
+            return rows
+        # Padding so that we can always pull a few bytes after the last message
+        buffer = np.frombuffer(raw + bytes(_MAX_BYTES_PER_FIELD), dtype=np.uint8)
+        first_byte = buffer[offsets].astype(np.int64)
+        timestamp_bits_length = (((first_byte >> 4) & 7) + 1) * 4
+        quantity_bits_length = (((first_byte >> 1) & 7) + 1) * 4
+
+        # Bit offsets of each field relative to the start of the message
+        timestamp_bit_offset = np.full(len(offsets), 7, dtype=np.int64)
+        quantity_bit_offset = timestamp_bit_offset + timestamp_bits_length
+        price_bit_offset = quantity_bit_offset + quantity_bits_length
+        side_bit_offset = price_bit_offset + 7
+
+        timestamp_delta = _extract_bits(
+            buffer, offsets, timestamp_bit_offset, timestamp_bits_length
+        )
+        delta = _extract_bits(
+            buffer, offsets, quantity_bit_offset, quantity_bits_length
+        )
+        price = _extract_bits(buffer, offsets, price_bit_offset, np.int64(7))
+        side = _extract_bits(buffer, offsets, side_bit_offset, np.int64(1))
+
+        # Extract sign bit then zero it out
+        sign_mask = np.left_shift(1, quantity_bits_length - 1)
+        is_negative = (delta & sign_mask) != 0
+        delta &= ~sign_mask
+
+        # We divide by 10 to get the sub-second precision
+        rows["ts"] = chunk_start_timestamp.timestamp() + (timestamp_delta / 10)
+        rows["type"] = ColeDBRowType.DELTA
+        rows["side"] = side
+        rows["price"] = price
+        rows["delta"] = np.where(is_negative, -delta, delta)
+        return rows
+
     def _create_new_chunk(
         self,
         snapshot: OrderbookDeltaRM | OrderbookSnapshotRM,
         metadata: ColeDBMetadata,
     ):
+        if (
+            self.sealed_chunk_compression != ChunkCompression.NONE
+            and metadata.last_chunk_num > 0
+        ):
+            # Nothing gets appended to the last chunk anymore
+            self._compress_chunk(
+                snapshot.market_ticker,
+                metadata,
+                metadata.last_chunk_num,
+                self.sealed_chunk_compression,
+            )
+        metadata.seal_last_chunk()
         metadata.last_chunk_num += 1
         metadata.num_msgs_in_last_file = 0
         metadata.chunk_first_time_stamps.append(snapshot.ts)
-        new_chunk_file = metadata.path_to_market_data / str(metadata.last_chunk_num)
-        new_chunk_file.touch()
-
-        ColeDBInterface._write_data_to_last_file(snapshot, metadata)
+        metadata.path_to_last_chunk.touch()
+
+        self._write_data_to_last_file(snapshot, metadata)
+
+    def compress_sealed_chunks(
+        self, ticker: MarketTicker, compression: ChunkCompression
+    ) -> int:
+        """Compresses the chunks of a market (other than the last one) that
+        aren't compressed yet. Returns the number of chunks we compressed.
+
+        Useful for markets that were written before we turned on
+        sealed_chunk_compression. Don't run this while something is writing
+        to the market from another process."""
+        self._start_writing(ticker)
+        with self.market_lock(ticker):
+            metadata = self.get_metadata(ticker)
+            num_compressed = 0
+            for chunk_num in range(1, metadata.last_chunk_num):
+                if chunk_num not in metadata.chunk_compressions:
+                    self._compress_chunk(ticker, metadata, chunk_num, compression)
+                    num_compressed += 1
+        return num_compressed
+
+    def _compress_chunk(
+        self,
+        ticker: MarketTicker,
+        metadata: ColeDBMetadata,
+        chunk_num: int,
+        compression: ChunkCompression,
+    ) -> int:
+        """Compresses a chunk that no one appends to anymore
+
+        We write the compressed chunk next to the uncompressed one, then
+        record the compression in the metadata, and only then remove the
+        uncompressed chunk. Readers that loaded the metadata before we
+        compressed the chunk find the compressed one (see chunk_location).
+        Returns the number of bytes that we saved."""
+        if chunk_num in metadata.chunk_compressions:
+            return 0
+        path = metadata.path_to_chunk(chunk_num)
+        chunk = path.read_bytes()
+        compressed_path = metadata.path_to_chunk(chunk_num, compression)
+        with open(str(compressed_path), "wb") as f:
+            f.write(compression.compress(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+        metadata.chunk_compressions[chunk_num] = compression
+        metadata.save()
+        path.unlink()
+        return len(chunk) - compressed_path.stat().st_size
 
     @staticmethod
     def _read_chunk_apply_deltas(
         path: Path,
         ticker: MarketTicker,
         chunk_start_ts: datetime,
+        compression: ChunkCompression = ChunkCompression.NONE,
     ) -> Orderbook:
         """Reads a chunk and applies the deltas from the beginning"""
         for orderbook in ColeDBInterface._read_chunk_apply_deltas_generator(
-            path, ticker, chunk_start_ts
+            path, ticker, chunk_start_ts, compression=compression
         ):
             continue
         assert isinstance(orderbook, Orderbook)
         return orderbook
 
+    @staticmethod
+    @contextmanager
+    def _map_chunk(
+        path: Path, compression: ChunkCompression = ChunkCompression.NONE
+    ) -> Generator[memoryview, None, None]:
+        """Memory maps a chunk read only
+
+        Reading through the mapping avoids copying the chunk into our own
+        buffers, and processes reading the same chunk share the page cache.
+        Compressed chunks can't be mapped, so we decompress them into memory."""
+        if compression != ChunkCompression.NONE:
+            with memoryview(ColeDBInterface._read_chunk_bytes(path, compression)) as m:
+                yield m
+            return
+        with open(str(path), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Can't map an empty file
+                yield memoryview(b"")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as chunk:
+                    yield chunk
+
     @staticmethod
     def _read_chunk_apply_deltas_generator(
         path: Path,
@@ -882,51 +2377,88 @@ class ColeDBInterface:
         start_ts: Optional[datetime] = None,
         end_ts: Optional[datetime] = None,
         read_raw: bool = False,
+        checkpoint: Tuple[int, OrderbookSnapshotRM] | None = None,
+        compression: ChunkCompression = ChunkCompression.NONE,
     ) -> Generator[Orderbook | OrderbookSnapshotRM | OrderbookDeltaRM, None, None]:
         """Yields messages with ts >= start_ts and <= end_ts
 
         If no start_ts / end_ts passed in, it will start from beginning /
         go to the end.
+
+        If a checkpoint (byte offset, orderbook at that offset) from the chunk
+        index is passed in, we start reading from there. The checkpoint must be
+        before start_ts since it is not a real message.
         """
         if end_ts and start_ts and (end_ts < start_ts):
             raise ValueError("End ts must be larger than start ts")
-        with open(str(path), "rb") as f:
-            cole_bytes = ColeBytes(f)
-            # First message must be a snapshot. If you get an EOFError here,
-            # it means the chunk was empty.
+        with ColeDBInterface._map_chunk(path, compression) as chunk:
+            if checkpoint is None:
+                cole_bytes = ColeBytes(chunk)
+                # First message must be a snapshot. If you get an EOFError here,
+                # it means the chunk was empty.
+                try:
+                    msg = ColeDBInterface._decode_to_response_message(
+                        cole_bytes, ticker, chunk_start_ts
+                    )
+                except EOFError:
+                    return
+            else:
+                byte_offset, msg = checkpoint
+                cole_bytes = ColeBytes(chunk, byte_offset)
+            assert isinstance(msg, OrderbookSnapshotRM)
+            yield from ColeDBInterface._apply_deltas_generator(
+                chain(
+                    [msg],
+                    ColeDBInterface._decode_messages(
+                        cole_bytes, ticker, chunk_start_ts
+                    ),
+                ),
+                start_ts,
+                end_ts,
+                read_raw,
+            )
+
+    @staticmethod
+    def _decode_messages(
+        b: ColeBytes, ticker: MarketTicker, chunk_start_timestamp: datetime
+    ) -> Generator[OrderbookDeltaRM | OrderbookSnapshotRM, None, None]:
+        """Decodes messages until we run out of bytes"""
+        while True:
             try:
                 msg = ColeDBInterface._decode_to_response_message(
-                    cole_bytes, ticker, chunk_start_ts
+                    b, ticker, chunk_start_timestamp
                 )
             except EOFError:
                 return
-            assert isinstance(msg, OrderbookSnapshotRM)
+            yield msg
+
+    @staticmethod
+    def _apply_deltas_generator(
+        msgs: Iterable[OrderbookDeltaRM | OrderbookSnapshotRM],
+        start_ts: Optional[datetime] = None,
+        end_ts: Optional[datetime] = None,
+        read_raw: bool = False,
+    ) -> Generator[Orderbook | OrderbookSnapshotRM | OrderbookDeltaRM, None, None]:
+        """Yields messages (or the orderbook after each message if not read_raw)
+        with ts >= start_ts and <= end_ts. The first message must be a snapshot.
+        """
+        if end_ts and start_ts and (end_ts < start_ts):
+            raise ValueError("End ts must be larger than start ts")
+        orderbook: Orderbook | None = None
+        for msg in msgs:
+            if end_ts and msg.ts > end_ts:
+                return
             if read_raw:
-                orderbook: OrderbookSnapshotRM | OrderbookDeltaRM = msg
-            else:
+                if start_ts is None or start_ts <= msg.ts:
+                    yield msg
+                continue
+            if isinstance(msg, OrderbookSnapshotRM):
                 orderbook = Orderbook.from_snapshot(msg)
-            file_empty = False
-            while not file_empty:
-                try:
-                    msg = ColeDBInterface._decode_to_response_message(
-                        cole_bytes, ticker, chunk_start_ts
-                    )
-                except EOFError:
-                    file_empty = True
-                if end_ts and orderbook.ts > end_ts:
-                    return
-                if start_ts is None or start_ts <= orderbook.ts:
-                    yield orderbook
-                if not file_empty:
-                    if not read_raw:
-                        if isinstance(msg, OrderbookSnapshotRM):
-                            orderbook = Orderbook.from_snapshot(msg)
-                        else:
-                            assert isinstance(msg, OrderbookDeltaRM)
-                            assert isinstance(orderbook, Orderbook)
-                            orderbook.apply_delta(msg, in_place=True)
-                    else:
-                        orderbook = msg
+            else:
+                assert orderbook is not None
+                orderbook.apply_delta(msg, in_place=True)
+            if start_ts is None or start_ts <= msg.ts:
+                yield orderbook
 
 
 class ReadonlyColeDB(ColeDBInterface):
@@ -936,6 +2468,317 @@ class ReadonlyColeDB(ColeDBInterface):
     def create_metadata_file(self, ticker: MarketTicker) -> ColeDBMetadata:
         raise NotImplementedError("Readonly DB!")
 
+    def write_market_info(self, market: Market):
+        raise NotImplementedError("Readonly DB!")
+
+    def compress_sealed_chunks(
+        self, ticker: MarketTicker, compression: ChunkCompression
+    ) -> int:
+        raise NotImplementedError("Readonly DB!")
+
+    def write_trade(self, trade: TradeRM):
+        raise NotImplementedError("Readonly DB!")
+
+
+class FsyncPolicy(str, Enum):
+    """When the ColeDBWriter fsyncs the chunk files"""
+
+    # Leave it up to the OS
+    NEVER = "never"
+    # After every flush. This is the most durable, but the slowest
+    FLUSH = "flush"
+    # When a chunk file is closed (evicted from the pool or on close)
+    CLOSE = "close"
+
+
+class ColeDBWriter(ColeDBInterface):
+    """Buffered writer for ColeDB
+
+    The base interface opens, appends to, and closes the chunk file for
+    every message. The writer instead buffers the encoded messages per
+    ticker and group commits them once the buffer is max_buffer_bytes
+    large, or when max_buffer_age has passed since the last flush (checked
+    on each write). The metadata journal is only appended to after the data
+    is written, so readers never see messages that are not on disk yet.
+    The catalog is updated on each flush as well.
+
+    Open chunk files are kept in an LRU pool of max_open_files so that we
+    don't run out of file descriptors when collecting the whole exchange.
+
+    Use the writer as a context manager (or call close), otherwise the
+    buffered messages are lost. If a writer is garbage collected (or the
+    interpreter exits) before it's closed, we only close its chunk files and
+    let go of its locks.
+    """
+
+    updates_catalog: ClassVar[bool] = True
+
+    def __init__(
+        self,
+        storage_path: Path | None = None,
+        max_buffer_bytes: int = 64 * 1024,
+        max_buffer_age: timedelta = timedelta(seconds=1),
+        max_open_files: int = 256,
+        fsync: FsyncPolicy = FsyncPolicy.NEVER,
+        sealed_chunk_compression: ChunkCompression = ChunkCompression.NONE,
+        shard: ColeDBShard | None = None,
+    ):
+        super().__init__(
+            storage_path,
+            sealed_chunk_compression=sealed_chunk_compression,
+            shard=shard,
+        )
+        self.max_buffer_bytes = max_buffer_bytes
+        self.max_buffer_age = max_buffer_age
+        self.max_open_files = max_open_files
+        self.fsync = fsync
+        # Encoded messages that belong at the end of the last chunk of a ticker
+        self._buffers: Dict[MarketTicker, bytearray] = {}
+        # Last ts, num msgs, and num bytes in the buffer of a ticker
+        self._catalog_updates: Dict[MarketTicker, Tuple[datetime, int, int]] = {}
+        # Catalog entries of the tickers that we flushed, which we record in
+        # the catalog journal together at the end of the flush
+        self._catalog_batch: Dict[MarketTicker, ColeDBCatalogEntry] = {}
+        # Chunk path to open file, least recently used first
+        self._open_chunk_files: OrderedDict[Path, io.FileIO] = OrderedDict()
+        self._last_flush_time = time.monotonic()
+        # In case someone forgets to close the writer. This can't reference
+        # the writer, or it would keep it alive until the interpreter exits
+        self._finalizer = weakref.finalize(
+            self,
+            ColeDBWriter._release,
+            self._open_chunk_files,
+            self._market_locks,
+            self.fsync,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def flush(self, ticker: MarketTicker | None = None):
+        """Writes the buffered messages of a ticker (or all tickers) to disk"""
+        if ticker is not None:
+            self._flush_ticker(ticker)
+            self._write_catalog_batch()
+            return
+        for buffered_ticker in list(self._buffers):
+            self._flush_ticker(buffered_ticker)
+        self._write_catalog_batch()
+        self._last_flush_time = time.monotonic()
+
+    def close(self):
+        """Flushes all of the buffers, closes the chunk files, and unlocks the
+        markets"""
+        self.flush()
+        while self._open_chunk_files:
+            _, f = self._open_chunk_files.popitem(last=False)
+            self._close_chunk_file(f)
+        super().close()
+        self._finalizer.detach()
+
+    def unlock_market(self, ticker: MarketTicker):
+        """Flushes the market and closes its chunk file before we unlock it"""
+        if ticker in self._market_locks:
+            self._close_market(ticker)
+        super().unlock_market(ticker)
+
+    def _start_writing(self, ticker: MarketTicker, changes_catalog: bool = True):
+        self._check_not_writing_from_tests()
+        self.lock_market(ticker)
+
+    def _close_market(self, ticker: MarketTicker):
+        """Flushes the market and closes its chunk file"""
+        self._flush_ticker(ticker)
+        self._write_catalog_batch()
+        # Markets that only have trades don't have metadata
+        metadata = self._open_metadata_files.get(ticker)
+        if metadata is not None:
+            f = self._open_chunk_files.pop(metadata.path_to_last_chunk, None)
+            if f is not None:
+                self._close_chunk_file(f)
+
+    def _forget_market(self, ticker: MarketTicker):
+        # The chunk file could be from before the market was rewritten
+        self._close_market(ticker)
+        super()._forget_market(ticker)
+        # Another process may have written to the market, so we rebuild its
+        # catalog entry from disk on the next flush
+        self.catalog.entries.pop(ticker, None)
+
+    def _read(
+        self,
+        ticker: MarketTicker,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+        read_raw: bool = False,
+    ) -> Generator[Orderbook | OrderbookDeltaRM | OrderbookSnapshotRM, None, None]:
+        self.flush(ticker)
+        yield from super()._read(ticker, start_ts, end_ts, read_raw)
+
+    def read_arrays(
+        self,
+        ticker: MarketTicker,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+    ) -> NDArray:
+        self.flush(ticker)
+        return super().read_arrays(ticker, start_ts, end_ts)
+
+    def read_bbo_arrays(
+        self,
+        ticker: MarketTicker,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+        nrows: int | None = None,
+    ) -> NDArray[np.float64]:
+        self.flush(ticker)
+        return super().read_bbo_arrays(ticker, start_ts, end_ts, nrows)
+
+    def _write_data_to_last_file(
+        self,
+        data: OrderbookDeltaRM | OrderbookSnapshotRM,
+        metadata: ColeDBMetadata,
+    ):
+        """Buffers the message instead of writing it to the file right away"""
+        buffer = self._buffers.setdefault(data.market_ticker, bytearray())
+        encoded = ColeDBInterface._encode_to_bytes(
+            data, metadata.latest_chunk_timestamp
+        )
+        buffer += encoded
+        metadata.num_msgs_in_last_file += 1
+        # Catalog changes that we'll record when we flush the buffer
+        _, num_msgs, num_bytes = self._catalog_updates.get(
+            data.market_ticker, (data.ts, 0, 0)
+        )
+        self._catalog_updates[data.market_ticker] = (
+            data.ts,
+            num_msgs + 1,
+            num_bytes + len(encoded),
+        )
+        if len(buffer) >= self.max_buffer_bytes:
+            self._flush_ticker(data.market_ticker)
+        if (
+            time.monotonic() - self._last_flush_time
+            >= self.max_buffer_age.total_seconds()
+        ):
+            self.flush()
+
+    def _create_new_chunk(
+        self,
+        snapshot: OrderbookDeltaRM | OrderbookSnapshotRM,
+        metadata: ColeDBMetadata,
+    ):
+        # The buffered messages belong to the previous chunk
+        self._flush_ticker(snapshot.market_ticker)
+        # We won't append to the previous chunk anymore
+        f = self._open_chunk_files.pop(metadata.path_to_last_chunk, None)
+        if f is not None:
+            self._close_chunk_file(f)
+        super()._create_new_chunk(snapshot, metadata)
+
+    def _compress_chunk(
+        self,
+        ticker: MarketTicker,
+        metadata: ColeDBMetadata,
+        chunk_num: int,
+        compression: ChunkCompression,
+    ) -> int:
+        num_bytes_saved = super()._compress_chunk(
+            ticker, metadata, chunk_num, compression
+        )
+        entry = self.catalog.get(ticker)
+        if entry is not None and num_bytes_saved != 0:
+            entry.num_bytes -= num_bytes_saved
+            self._catalog_batch[ticker] = entry
+        return num_bytes_saved
+
+    def _get_last_chunk_orderbook(
+        self, ticker: MarketTicker, metadata: ColeDBMetadata
+    ) -> Orderbook:
+        self._flush_ticker(ticker)
+        return super()._get_last_chunk_orderbook(ticker, metadata)
+
+    def _flush_ticker(self, ticker: MarketTicker):
+        buffer = self._buffers.pop(ticker, None)
+        if not buffer:
+            return
+        metadata = self.get_metadata(ticker)
+        f = self._get_chunk_file(metadata.path_to_last_chunk)
+        view = memoryview(buffer)
+        while len(view) > 0:
+            num_written = f.write(view)
+            assert num_written is not None
+            view = view[num_written:]
+        if self.fsync == FsyncPolicy.FLUSH:
+            os.fsync(f.fileno())
+        metadata.append_to_journal()
+        self._update_catalog(ticker, metadata)
+
+    def _update_catalog(self, ticker: MarketTicker, metadata: ColeDBMetadata):
+        """Records the messages that we just flushed in the catalog
+
+        The catalog is shared by all of the writers, so we only append the
+        entries to its journal once per flush (see _write_catalog_batch)."""
+        last_ts, num_msgs, num_bytes = self._catalog_updates.pop(ticker)
+        entry = self.catalog.get(ticker)
+        if entry is None:
+            # First time we see this market. Everything is on disk now.
+            entry = ColeDBCatalog.entry_from_disk(self, ticker)
+            assert entry is not None
+            self.catalog.entries[ticker] = entry
+        else:
+            entry.last_ts = last_ts
+            entry.num_msgs += num_msgs
+            entry.num_bytes += num_bytes
+            entry.num_chunks = metadata.last_chunk_num
+        self._catalog_batch[ticker] = entry
+
+    def _write_catalog_batch(self):
+        """Records the catalog entries that changed since the last batch"""
+        if self._catalog_batch:
+            self.catalog.update_many(self._catalog_batch.values())
+            self._catalog_batch = {}
+
+    def _get_chunk_file(self, path: Path) -> io.FileIO:
+        """Gets the chunk file from the pool, or opens it"""
+        if path in self._open_chunk_files:
+            self._open_chunk_files.move_to_end(path)
+            return self._open_chunk_files[path]
+        # We do our own buffering
+        f = io.FileIO(str(path), "ab")
+        self._open_chunk_files[path] = f
+        if len(self._open_chunk_files) > self.max_open_files:
+            _, least_recently_used = self._open_chunk_files.popitem(last=False)
+            self._close_chunk_file(least_recently_used)
+        return f
+
+    def _close_chunk_file(self, f: io.FileIO):
+        ColeDBWriter._close_file(f, self.fsync)
+
+    @staticmethod
+    def _close_file(f: io.FileIO, fsync: FsyncPolicy):
+        if fsync == FsyncPolicy.CLOSE:
+            os.fsync(f.fileno())
+        f.close()
+
+    @staticmethod
+    def _release(
+        open_chunk_files: OrderedDict[Path, io.FileIO],
+        market_locks: Dict[MarketTicker, FileLock],
+        fsync: FsyncPolicy,
+    ):
+        """Closes the chunk files and lets go of the locks of a writer that
+        wasn't closed"""
+        while open_chunk_files:
+            _, f = open_chunk_files.popitem(last=False)
+            ColeDBWriter._close_file(f, fsync)
+        while market_locks:
+            _, lock = market_locks.popitem()
+            lock.release()
+
 
 def get_num_byte_sections_per_bits(num_bits: int, byte_section_size: int) -> int:
     """Return min num of byte sections needed to fit num_bits in byte_section_size bits
@@ -954,6 +2797,312 @@ def get_num_byte_sections_per_bits(num_bits: int, byte_section_size: int) -> int
     return (num_bits // byte_section_size) + min(num_bits % byte_section_size, 1)
 
 
+class ColeDBRowType(IntEnum):
+    """The type of a row in the arrays returned by read_arrays
+
+    A snapshot is represented by a SNAPSHOT row (which means you should clear
+    the book) followed by a SNAPSHOT_LEVEL row for each level in the snapshot,
+    where the delta column holds the quantity at that level. So you can
+    always rebuild the book by summing the deltas since the last SNAPSHOT row.
+    """
+
+    DELTA = 0
+    SNAPSHOT = 1
+    SNAPSHOT_LEVEL = 2
+
+
+# ts: seconds since epoch
+# type: ColeDBRowType
+# side: 1 for yes, 0 for no (same as the encoding)
+# price: 1-99 (0 on SNAPSHOT rows)
+# delta: quantity delta (or quantity on SNAPSHOT_LEVEL rows)
+COLEDB_ARRAY_DTYPE = np.dtype(
+    [
+        ("ts", np.float64),
+        ("type", np.uint8),
+        ("side", np.uint8),
+        ("price", np.uint8),
+        ("delta", np.int64),
+    ]
+)
+
+# A trade in the trades file of a market
+# ts: seconds since epoch (same as TradeRM)
+# yes_price: 1-99
+# count: number of contracts traded
+# taker_side: 1 for yes, 0 for no
+TRADE_DTYPE = np.dtype(
+    [
+        ("ts", ">u4"),
+        ("yes_price", "u1"),
+        ("count", ">u4"),
+        ("taker_side", "u1"),
+    ]
+)
+
+# Columns of read_df
+ORDERBOOK_DF_COLUMNS = (
+    ["ts"]
+    + [f"yes_bid_{i}" for i in range(1, 100)]
+    + [f"no_bid_{i}" for i in range(1, 100)]
+)
+
+# Last chunk num, number of messages in the last chunk, and the first
+# timestamp of the last chunk (in microseconds)
+_JOURNAL_RECORD = struct.Struct(">IIq")
+
+# Catalog journal records are the length of the ticker, the ticker, and then
+# the first ts, last ts (in microseconds), num msgs, num chunks, and num bytes
+_CATALOG_RECORD_HEADER = struct.Struct(">H")
+_CATALOG_RECORD = struct.Struct(">qqQIQ")
+
+# Byte offset of the next message, timestamp, and length of the encoded snapshot
+_CHECKPOINT_HEADER = struct.Struct(">IdI")
+
+# A field is at most 32 bits and can start anywhere within a byte, so it can
+# span up to 5 bytes
+_MAX_BYTES_PER_FIELD = 5
+
+
+def _extract_bits(
+    buffer: NDArray[np.uint8],
+    byte_offsets: NDArray[np.int64],
+    bit_offsets: NDArray[np.int64],
+    bit_lengths: NDArray[np.int64] | np.int64,
+) -> NDArray[np.int64]:
+    """Vectorized read of the big endian bit fields in buffer
+
+    Each field starts bit_offsets bits after byte_offsets and is bit_lengths long
+    (up to 32 bits). The buffer needs to be padded so that we can pull
+    _MAX_BYTES_PER_FIELD bytes from the start of each field."""
+    start_bytes = byte_offsets + (bit_offsets >> 3)
+    word = np.zeros(len(byte_offsets), dtype=np.int64)
+    for i in range(_MAX_BYTES_PER_FIELD):
+        word <<= 8
+        word |= buffer[start_bytes + i]
+    shift = (_MAX_BYTES_PER_FIELD * 8) - (bit_offsets & 7) - bit_lengths
+    return (word >> shift) & ((np.int64(1) << bit_lengths) - 1)
+
+
+def snapshot_to_rows(snapshot: OrderbookSnapshotRM) -> NDArray:
+    """Converts a snapshot into rows with the COLEDB_ARRAY_DTYPE"""
+    rows = np.zeros(1 + len(snapshot.yes) + len(snapshot.no), dtype=COLEDB_ARRAY_DTYPE)
+    rows["ts"] = snapshot.ts.timestamp()
+    rows["type"] = ColeDBRowType.SNAPSHOT_LEVEL
+    rows[0]["type"] = ColeDBRowType.SNAPSHOT
+    i = 1
+    for side, levels in ((1, snapshot.yes), (0, snapshot.no)):
+        for price, quantity in levels:
+            rows[i]["side"] = side
+            rows[i]["price"] = price
+            rows[i]["delta"] = quantity
+            i += 1
+    return rows
+
+
+def rows_to_messages(
+    rows: NDArray, ticker: MarketTicker, chunk_start_ts: datetime
+) -> Generator[OrderbookDeltaRM | OrderbookSnapshotRM, None, None]:
+    """Converts the rows of a chunk back into the messages that we decoded
+
+    The timestamps in the chunk are tenths of a second after the start of the
+    chunk, so we round to that to get the exact same ts as the decoder."""
+    tenths = (
+        np.rint((rows["ts"] - chunk_start_ts.timestamp()) * 10)
+        .astype(np.int64)
+        .tolist()
+    )
+    # Python ints are much faster to work with than numpy scalars
+    types = rows["type"].tolist()
+    sides = rows["side"].tolist()
+    prices = rows["price"].tolist()
+    deltas = rows["delta"].tolist()
+    snapshot: OrderbookSnapshotRM | None = None
+    for i, row_type in enumerate(types):
+        if row_type == ColeDBRowType.SNAPSHOT_LEVEL:
+            assert snapshot is not None
+            level = (Price(prices[i]), Quantity(deltas[i]))
+            (snapshot.yes if sides[i] == 1 else snapshot.no).append(level)
+            continue
+        if snapshot is not None:
+            yield snapshot
+            snapshot = None
+        ts = chunk_start_ts + timedelta(seconds=tenths[i] / 10)
+        ts = ts.astimezone(ColeDBInterface.tz)
+        if row_type == ColeDBRowType.SNAPSHOT:
+            snapshot = OrderbookSnapshotRM.model_construct(
+                market_ticker=ticker, ts=ts, yes=[], no=[]
+            )
+        else:
+            # Construct does not do validation, faster
+            yield OrderbookDeltaRM.model_construct(
+                market_ticker=ticker,
+                price=Price(prices[i]),
+                delta=QuantityDelta(deltas[i]),
+                side=Side.YES if sides[i] == 1 else Side.NO,
+                ts=ts,
+            )
+    if snapshot is not None:
+        yield snapshot
+
+
+def arrays_to_orderbooks(
+    rows: NDArray,
+) -> Tuple[NDArray[np.float64], NDArray[np.int64]]:
+    """Replays rows from read_arrays into the full orderbook after each message
+
+    Returns the timestamp of each message and a (num messages, 198) array with
+    the quantity at yes prices 1-99 followed by no prices 1-99 (0 if empty),
+    which is the same layout as read_df. The rows must start with a snapshot.
+    """
+    num_rows = len(rows)
+    if num_rows == 0:
+        return np.empty(0, dtype=np.float64), np.empty((0, 198), dtype=np.int64)
+    is_snapshot = rows["type"] == ColeDBRowType.SNAPSHOT
+    if not is_snapshot[0]:
+        raise ValueError("Rows must start with a snapshot")
+
+    # Every row other than a snapshot row changes the quantity at one level
+    level_rows = np.flatnonzero(~is_snapshot)
+    columns = (rows["price"][level_rows].astype(np.int64) - 1) + np.where(
+        rows["side"][level_rows] == 1, 0, 99
+    )
+    deltas = np.zeros((num_rows, 198), dtype=np.int64)
+    deltas[level_rows, columns] = rows["delta"][level_rows]
+    orderbooks = np.cumsum(deltas, axis=0)
+
+    # A snapshot clears the book, so remove everything before the last snapshot
+    last_snapshot = np.maximum.accumulate(np.where(is_snapshot, np.arange(num_rows), 0))
+    before_snapshot = last_snapshot - 1
+    has_previous = before_snapshot >= 0
+    orderbooks[has_previous] -= orderbooks[before_snapshot[has_previous]]
+
+    # A snapshot spans multiple rows, so only keep the last row of each message
+    is_end_of_msg = np.ones(num_rows, dtype=bool)
+    is_end_of_msg[:-1] = rows["type"][1:] != ColeDBRowType.SNAPSHOT_LEVEL
+    return rows["ts"][is_end_of_msg], orderbooks[is_end_of_msg]
+
+
+def arrays_to_bbo(rows: NDArray) -> NDArray[np.float64]:
+    """Replays rows from read_arrays into the yes side bbo after each message
+
+    Returns a (num messages, 5) array with the same columns as
+    orderbook_to_bbo_row. Unlike arrays_to_orderbooks, we don't build the
+    book for each message. We keep track of the best level of each side as
+    we go and only rescan a side when its best level empties. The rows must
+    start with a snapshot.
+    """
+    num_rows = len(rows)
+    if num_rows == 0:
+        return np.empty((0, 5))
+    if rows["type"][0] != ColeDBRowType.SNAPSHOT:
+        raise ValueError("Rows must start with a snapshot")
+    # A snapshot spans multiple rows, so only keep the last row of each message
+    is_end_of_msg = np.ones(num_rows, dtype=bool)
+    is_end_of_msg[:-1] = rows["type"][1:] != ColeDBRowType.SNAPSHOT_LEVEL
+
+    snapshot = int(ColeDBRowType.SNAPSHOT)
+    # Quantity at each price of the no (0) and yes (1) side
+    levels = [[0] * 100, [0] * 100]
+    # Highest price with a quantity on each side, 0 if the side is empty
+    best = [0, 0]
+    # Yes price, yes quantity, no price, no quantity after each message
+    bbo_levels: List[Tuple[int, int, int, int]] = []
+    for row_type, side, price, delta, end_of_msg in zip(
+        rows["type"].tolist(),
+        rows["side"].tolist(),
+        rows["price"].tolist(),
+        rows["delta"].tolist(),
+        is_end_of_msg.tolist(),
+    ):
+        if row_type == snapshot:
+            levels = [[0] * 100, [0] * 100]
+            best = [0, 0]
+        else:
+            side_levels = levels[side]
+            quantity = side_levels[price] + delta
+            side_levels[price] = quantity
+            if quantity > 0:
+                if price > best[side]:
+                    best[side] = price
+            elif price == best[side]:
+                while price > 0 and side_levels[price] <= 0:
+                    price -= 1
+                best[side] = price
+        if end_of_msg:
+            yes, no = best[1], best[0]
+            bbo_levels.append((yes, levels[1][yes], no, levels[0][no]))
+
+    best_levels = np.array(bbo_levels, dtype=np.float64).reshape(-1, 4)
+    bbo = np.full((len(best_levels), 5), np.nan)
+    bbo[:, 0] = rows["ts"][is_end_of_msg]
+    has_bid = best_levels[:, 0] > 0
+    bbo[has_bid, 1] = best_levels[has_bid, 0]
+    bbo[has_bid, 2] = best_levels[has_bid, 1]
+    # The yes ask is the opposite of the best no bid
+    has_ask = best_levels[:, 2] > 0
+    bbo[has_ask, 3] = 100 - best_levels[has_ask, 2]
+    bbo[has_ask, 4] = best_levels[has_ask, 3]
+    return bbo
+
+
+def filter_rows_by_ts(
+    rows: NDArray, start: float | None, end: float | None
+) -> Tuple[NDArray, bool]:
+    """Keeps the rows with start <= ts <= end.
+
+    Like the chunk generator, we stop at the first row past the end. Also
+    returns whether we reached the end."""
+    reached_end = False
+    if end is not None:
+        past_end = np.flatnonzero(rows["ts"] > end)
+        if len(past_end) > 0:
+            rows = rows[: past_end[0]]
+            reached_end = True
+    if start is not None:
+        rows = rows[rows["ts"] >= start]
+    return rows, reached_end
+
+
+def _read_df_to_shared_memory(
+    storage_path: Path,
+    ticker: MarketTicker,
+    start_ts: datetime | None,
+    end_ts: datetime | None,
+    nrows: int | None,
+) -> Tuple[str | None, int]:
+    """Worker for read_df_many
+
+    Puts the df rows into a new shared memory block and returns its name
+    and the number of rows. The caller is responsible for unlinking it."""
+    rows = [
+        orderbook_to_df_row(ob)
+        for ob in islice(
+            ColeDBInterface(storage_path).read(ticker, start_ts, end_ts),
+            nrows or None,
+        )
+    ]
+    if len(rows) == 0:
+        # Can't create an empty shared memory block
+        return None, 0
+    shm = shared_memory.SharedMemory(create=True, size=len(rows) * 199 * 8)
+    np.ndarray((len(rows), 199), dtype=np.float64, buffer=shm.buf)[:] = rows
+    shm.close()
+    return shm.name, len(rows)
+
+
+def _pop_shared_memory(name: str | None, num_rows: int) -> NDArray:
+    """Copies the df rows out of shared memory and unlinks it"""
+    if name is None:
+        return np.empty((0, 199))
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray((num_rows, 199), dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
 def orderbook_to_df_row(ob: Orderbook):
     """Converts orderbook info into df row
 
@@ -0,0 +1,194 @@
+"""Columnar copy of ColeDB for research
+
+Replaying ColeDB builds a Python Orderbook per message, which is slow if all
+you want is a dataframe of the book over a day. This module exports markets
+into a columnar layout that can be memory mapped with numpy:
+
+Series Ticker folders
+|   |   |
+Event Ticker folders
+|   |   |
+Market Ticker folders
+    ts      float64 seconds since epoch, one per message
+    book    int64 quantities, 198 per message (yes prices 1-99 then no prices
+            1-99, 0 if the level is empty). Same layout as ColeDBInterface.read_df
+    metadata
+
+The exports are incremental. The metadata file remembers the last chunk that
+we exported and how many messages of it we exported, so running the export
+again only appends the new messages. If the underlying chunks are rewritten
+by compaction, their generation changes and we export the market again from
+scratch.
+
+We don't use parquet because pyarrow is not one of our dependencies.
+"""
+
+import pickle
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from pandas import DataFrame
+
+from data.coledb.coledb import (
+    ColeDBInterface,
+    ColeDBMetadata,
+    arrays_to_orderbooks,
+)
+from helpers.constants import COLEDB_COLUMNAR_DEFAULT_STORAGE_PATH
+from helpers.types.markets import MarketTicker, SeriesTicker
+
+BOOK_WIDTH = 198
+
+
+@dataclass
+class ColumnarExportMetadata:
+    """Keeps track of how much of a market we exported
+
+    WARNING: this class is pickled, be careful with backwards compatibility
+
+    path: path to the metadata file
+    num_rows: number of messages that we exported
+    last_chunk_num: the last ColeDB chunk that we exported from
+    num_msgs_in_last_chunk: number of messages we exported from that chunk
+    generation: generation of the ColeDB chunks that we exported from
+    """
+
+    path: Path
+    num_rows: int = field(default=0)
+    last_chunk_num: int = field(default=0)
+    num_msgs_in_last_chunk: int = field(default=0)
+    generation: int = field(default=0)
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_bytes(pickle.dumps(self))
+        tmp_path.replace(self.path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ColumnarExportMetadata":
+        if not path.exists():
+            return cls(path)
+        metadata: ColumnarExportMetadata = pickle.loads(path.read_bytes())
+        # In case we move around the folder structure
+        metadata.path = path
+        return metadata
+
+
+class ColeDBColumnarStore:
+    """Exports ColeDB markets into columnar files and loads them back"""
+
+    def __init__(self, db: ColeDBInterface, storage_path: Path | None = None):
+        self.db = db
+        self.storage_path = storage_path or COLEDB_COLUMNAR_DEFAULT_STORAGE_PATH
+
+    def ticker_to_path(self, ticker: MarketTicker) -> Path:
+        """Given a market ticker returns a path to where its export lives"""
+        return self.storage_path / (ticker.replace("-", "/"))
+
+    def export(self, ticker: MarketTicker) -> int:
+        """Exports the messages of a market that are not exported yet
+
+        We decode and replay one chunk at a time, so we never have more
+        than one chunk in memory. Returns the number of new messages."""
+        # Another process (like the collector or the compactor) could have
+        # changed the market since db cached its metadata
+        cole_metadata = ColeDBMetadata.load(self.db.ticker_to_metadata_path(ticker))
+        path = self.ticker_to_path(ticker)
+        path.mkdir(parents=True, exist_ok=True)
+        metadata = ColumnarExportMetadata.load(path / "metadata")
+        if metadata.generation != cole_metadata.generation:
+            # The chunks were compacted, start over
+            metadata = ColumnarExportMetadata(
+                metadata.path, generation=cole_metadata.generation
+            )
+        ts_path = path / "ts"
+        book_path = path / "book"
+        # Drop anything that was written after the last metadata save
+        # (for example, if we crashed in the middle of an export)
+        for column_path, row_size in ((ts_path, 8), (book_path, 8 * BOOK_WIDTH)):
+            with open(str(column_path), "ab") as f:
+                f.truncate(metadata.num_rows * row_size)
+
+        num_new_rows = 0
+        first_chunk_num = max(metadata.last_chunk_num, 1)
+        with open(str(ts_path), "ab") as ts_file, open(
+            str(book_path), "ab"
+        ) as book_file:
+            for chunk_num in range(first_chunk_num, cole_metadata.last_chunk_num + 1):
+                ts, books = arrays_to_orderbooks(
+                    self.db.read_chunk_arrays(ticker, chunk_num, cole_metadata)
+                )
+                num_already_exported = (
+                    metadata.num_msgs_in_last_chunk
+                    if chunk_num == metadata.last_chunk_num
+                    else 0
+                )
+                ts_file.write(ts[num_already_exported:].astype("<f8").tobytes())
+                book_file.write(books[num_already_exported:].astype("<i8").tobytes())
+                num_new_rows += len(ts) - num_already_exported
+                metadata.last_chunk_num = chunk_num
+                metadata.num_msgs_in_last_chunk = len(ts)
+        metadata.num_rows += num_new_rows
+        metadata.save()
+        return num_new_rows
+
+    def export_series(self, series_ticker: SeriesTicker) -> int:
+        """Exports all of the markets in a series"""
+        num_new_rows = 0
+        for event_ticker in self.db.get_event_tickers(series_ticker):
+            for ticker in self.db.get_market_tickers(event_ticker):
+                num_new_rows += self.export(ticker)
+        return num_new_rows
+
+    def load(
+        self,
+        ticker: MarketTicker,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+    ) -> Tuple[NDArray[np.float64], NDArray[np.int64]]:
+        """Memory maps the exported timestamps and books between start_ts and end_ts
+
+        Returns read only arrays of the timestamps (num messages) and the
+        books (num messages, 198)."""
+        path = self.ticker_to_path(ticker)
+        metadata = ColumnarExportMetadata.load(path / "metadata")
+        if metadata.num_rows == 0:
+            return np.empty(0, dtype="<f8"), np.empty((0, BOOK_WIDTH), dtype="<i8")
+        ts = np.memmap(path / "ts", dtype="<f8", mode="r", shape=(metadata.num_rows,))
+        books = np.memmap(
+            path / "book",
+            dtype="<i8",
+            mode="r",
+            shape=(metadata.num_rows, BOOK_WIDTH),
+        )
+        start = 0 if start_ts is None else np.searchsorted(ts, start_ts.timestamp())
+        end = (
+            len(ts)
+            if end_ts is None
+            else np.searchsorted(ts, end_ts.timestamp(), side="right")
+        )
+        return ts[start:end], books[start:end]
+
+    def load_df(
+        self,
+        ticker: MarketTicker,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+    ) -> DataFrame:
+        """Loads the export into the same dataframe as ColeDBInterface.read_df"""
+        ts, books = self.load(ticker, start_ts, end_ts)
+        data = np.empty((len(ts), BOOK_WIDTH + 1))
+        data[:, 0] = ts
+        data[:, 1:] = books
+        # Empty levels are nans in read_df
+        data[:, 1:][books == 0] = np.nan
+        columns = (
+            ["ts"]
+            + [f"yes_bid_{i}" for i in range(1, 100)]
+            + [f"no_bid_{i}" for i in range(1, 100)]
+        )
+        return DataFrame(data, columns=columns)
@@ -0,0 +1,223 @@
+"""Offline compaction of ColeDB markets
+
+The collector starts a new chunk every msgs_per_chunk messages, no matter how
+active the market is. Quiet markets end up with lots of tiny chunk files, and
+busy markets have chunks that span very little time. The compactor rewrites
+the chunks of a market so that each one is about target_chunk_bytes (before
+compression) or spans about target_chunk_span, and can compress the sealed
+chunks with zlib or lzma. The last chunk is never compressed, so the collector
+can keep appending to it.
+
+The new chunks are written into a new generation folder (see ColeDBMetadata).
+Replacing the metadata file is the commit point. It's an atomic rename, so
+readers either see all of the old chunks or all of the new ones. Readers that
+loaded the old metadata before the swap keep reading the old chunks, so we
+leave them on disk. The next compaction of the market removes them (along
+with their .index files and whatever a crashed compaction left behind).
+
+We take the write lock of the market, so a collector can't write to it while we
+compact it (its writes fail with ColeDBLockedError until we let go of the lock
+at the end of the compaction).
+
+The messages map one to one to the old ones, except that the first message of
+each new chunk becomes a snapshot, like when the collector starts a new chunk.
+Timestamps are stored in tenths of a second since the start of their chunk, so
+they can move by up to 0.05 seconds when they end up in a different chunk.
+
+Things that depend on the chunks:
+    catalog: we update the entry of the market
+    chunk cache, columnar exports, and rollups: they notice that the generation
+        changed
+    chunk indexes: they're removed, run build_index again if you need them
+"""
+
+import os
+import shutil
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List
+
+from data.coledb.coledb import (
+    ChunkCompression,
+    ColeDBCatalog,
+    ColeDBInterface,
+    ColeDBMetadata,
+)
+from helpers.types.markets import MarketTicker, SeriesTicker
+from helpers.types.orderbook import Orderbook
+from helpers.types.websockets.response import OrderbookSnapshotRM
+
+DEFAULT_TARGET_CHUNK_BYTES = 256 * 1024
+
+
+@dataclass
+class CompactionResult:
+    """How the chunks of a market changed after compaction"""
+
+    ticker: MarketTicker
+    num_chunks_before: int
+    num_chunks_after: int
+    num_bytes_before: int
+    num_bytes_after: int
+
+
+def compact_market(
+    db: ColeDBInterface,
+    ticker: MarketTicker,
+    target_chunk_bytes: int | None = DEFAULT_TARGET_CHUNK_BYTES,
+    target_chunk_span: timedelta | None = None,
+    compression: ChunkCompression = ChunkCompression.NONE,
+) -> CompactionResult:
+    """Rewrites the chunks of a market, see the module docstring
+
+    We start a new chunk once the current one has at least target_chunk_bytes
+    of messages or once a message is at least target_chunk_span after the
+    start of the chunk, whichever comes first."""
+    if target_chunk_bytes is None and target_chunk_span is None:
+        raise ValueError("Need a target chunk size or time span")
+    with db.market_lock(ticker):
+        return _compact_locked_market(
+            db, ticker, target_chunk_bytes, target_chunk_span, compression
+        )
+
+
+def _compact_locked_market(
+    db: ColeDBInterface,
+    ticker: MarketTicker,
+    target_chunk_bytes: int | None,
+    target_chunk_span: timedelta | None,
+    compression: ChunkCompression,
+) -> CompactionResult:
+    """Compacts a market that we hold the write lock of"""
+    # Make sure that we read the chunks that are on disk (this flushes the
+    # buffers of a ColeDBWriter)
+    db.forget_market(ticker)
+    old_metadata = ColeDBMetadata.load(db.ticker_to_metadata_path(ticker))
+    # Chunks of the generation before the old one. No one should be reading
+    # them anymore.
+    remove_stale_chunks(old_metadata)
+    num_bytes_before = _get_num_bytes(old_metadata)
+    if old_metadata.last_chunk_num == 0:
+        return CompactionResult(ticker, 0, 0, 0, 0)
+    # Fold the journal into the metadata file. Otherwise, the journal of the
+    # old chunks could get replayed on top of the new metadata.
+    old_metadata.save()
+
+    new_metadata = ColeDBMetadata(
+        path=old_metadata.path,
+        generation=old_metadata.generation + 1,
+        num_msgs_in_sealed_chunks=0,
+    )
+    new_metadata.path_to_chunks.mkdir()
+    chunk = bytearray()
+    chunk_start_ts: datetime | None = None
+    orderbook: Orderbook | None = None
+    for msg in db.read_raw(ticker):
+        if isinstance(msg, OrderbookSnapshotRM):
+            orderbook = Orderbook.from_snapshot(msg)
+        else:
+            assert orderbook is not None
+            orderbook.apply_delta(msg, in_place=True)
+        if chunk_start_ts is not None and (
+            (target_chunk_bytes is not None and len(chunk) >= target_chunk_bytes)
+            or (
+                target_chunk_span is not None
+                and msg.ts - chunk_start_ts >= target_chunk_span
+            )
+        ):
+            _write_chunk(new_metadata, bytes(chunk), compression)
+            new_metadata.seal_last_chunk()
+            chunk = bytearray()
+            chunk_start_ts = None
+        if chunk_start_ts is None:
+            # Each chunk needs to start with a snapshot
+            if not isinstance(msg, OrderbookSnapshotRM):
+                msg = OrderbookSnapshotRM.from_orderbook(orderbook)
+            chunk_start_ts = msg.ts
+            new_metadata.last_chunk_num += 1
+            new_metadata.num_msgs_in_last_file = 0
+            new_metadata.chunk_first_time_stamps.append(chunk_start_ts)
+        chunk += ColeDBInterface._encode_to_bytes(msg, chunk_start_ts)
+        new_metadata.num_msgs_in_last_file += 1
+    _write_chunk(new_metadata, bytes(chunk), ChunkCompression.NONE)
+
+    # Commit point. We leave the old chunks for the readers that still have
+    # the old metadata.
+    new_metadata.save()
+    db.forget_market(ticker)
+    entry = ColeDBCatalog.entry_from_disk(db, ticker)
+    if entry is not None:
+        db.catalog.update(entry)
+    return CompactionResult(
+        ticker=ticker,
+        num_chunks_before=old_metadata.last_chunk_num,
+        num_chunks_after=new_metadata.last_chunk_num,
+        num_bytes_before=num_bytes_before,
+        num_bytes_after=_get_num_bytes(new_metadata),
+    )
+
+
+def compact_series(
+    db: ColeDBInterface,
+    series_ticker: SeriesTicker,
+    target_chunk_bytes: int | None = DEFAULT_TARGET_CHUNK_BYTES,
+    target_chunk_span: timedelta | None = None,
+    compression: ChunkCompression = ChunkCompression.NONE,
+) -> List[CompactionResult]:
+    """Compacts all of the markets in a series"""
+    return [
+        compact_market(db, ticker, target_chunk_bytes, target_chunk_span, compression)
+        for event_ticker in db.get_event_tickers(series_ticker)
+        for ticker in db.get_market_tickers(event_ticker)
+    ]
+
+
+def remove_stale_chunks(metadata: ColeDBMetadata):
+    """Removes the chunks (and indexes) that aren't part of the current generation
+
+    These are left over from compactions: either the old chunks, or the new
+    chunks of a compaction that crashed before it swapped the metadata."""
+    market_folder = metadata.path_to_market_data
+    for path in market_folder.iterdir():
+        if path.is_dir():
+            if (
+                path.name.startswith("gen")
+                and path.name[3:].isdigit()
+                and path != metadata.path_to_chunks
+            ):
+                shutil.rmtree(path)
+        elif metadata.generation != 0 and path.name.split(".")[0].isdigit():
+            # Chunks of generation 0 live in the market folder
+            path.unlink()
+
+
+def _write_chunk(metadata: ColeDBMetadata, chunk: bytes, compression: ChunkCompression):
+    """Writes out the last chunk of metadata"""
+    if compression != ChunkCompression.NONE:
+        metadata.chunk_compressions[metadata.last_chunk_num] = compression
+    with open(str(metadata.path_to_last_chunk), "wb") as f:
+        f.write(compression.compress(chunk))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _get_num_bytes(metadata: ColeDBMetadata) -> int:
+    return sum(
+        metadata.path_to_chunk(chunk_num).stat().st_size
+        for chunk_num in range(1, metadata.last_chunk_num + 1)
+    )
+
+
+if __name__ == "__main__":
+    # pragma: no cover
+    cole = ColeDBInterface()
+    for series_ticker in cole.get_series_tickers():
+        results = compact_series(cole, series_ticker, compression=ChunkCompression.ZLIB)
+        num_chunks_before = sum(result.num_chunks_before for result in results)
+        num_chunks_after = sum(result.num_chunks_after for result in results)
+        num_bytes_before = sum(result.num_bytes_before for result in results)
+        num_bytes_after = sum(result.num_bytes_after for result in results)
+        print(
+            f"{series_ticker}: {num_chunks_before} -> {num_chunks_after} chunks, "
+            + f"{num_bytes_before} -> {num_bytes_after} bytes"
+        )
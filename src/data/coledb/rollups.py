@@ -0,0 +1,283 @@
+"""OHLC rollups of ColeDB for charting and features
+
+Charting a market over a few days doesn't need every message, just candles of
+the top of the book. The exchange has a candlestick endpoint, but it's limited
+to 5000 periods per request. This module rolls ColeDB up into bars of the yes
+bid, the yes ask, and their midpoint for each interval in ROLLUP_INTERVALS:
+
+Series Ticker folders
+|   |   |
+Event Ticker folders
+|   |   |
+Market Ticker folders
+    1s, 1m, 1h  float64 bars, BAR_WIDTH per bar (see BAR_COLUMNS)
+    metadata
+
+A bar covers the messages with ts in [ts, ts + interval), and there are only
+bars for periods with at least one message. The open and close are the bbo
+after the first and last message of the period. A price is nan if that side of
+the book was empty (the mid is nan if either side was empty).
+
+Like the columnar exports, the rollups are incremental. The metadata file
+remembers how far into the chunks we got, so running update again only rolls
+up the new messages. The last bar of each interval is still open: it's on
+disk, but its metadata copy is the source of truth, and we rewrite it when new
+messages for its period come in. If the chunks are compacted, their generation
+changes and we roll up the market again from scratch.
+"""
+
+import pickle
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+from numpy.typing import NDArray
+from pandas import DataFrame
+
+from data.coledb.coledb import ColeDBInterface, ColeDBMetadata, arrays_to_bbo
+from helpers.constants import COLEDB_ROLLUPS_DEFAULT_STORAGE_PATH
+from helpers.types.markets import MarketTicker, SeriesTicker
+
+ROLLUP_INTERVALS: Dict[str, timedelta] = {
+    "1s": timedelta(seconds=1),
+    "1m": timedelta(minutes=1),
+    "1h": timedelta(hours=1),
+}
+BAR_COLUMNS = (
+    ["ts"]
+    + [
+        f"{price}_{part}"
+        for price in ("bid", "ask", "mid")
+        for part in ("open", "high", "low", "close")
+    ]
+    + ["num_msgs"]
+)
+BAR_WIDTH = len(BAR_COLUMNS)
+# Columns of the opens of the bid, ask, and mid (high, low, close follow them)
+_OPEN_COLUMNS = (1, 5, 9)
+
+
+@dataclass
+class RollupMetadata:
+    """Keeps track of how much of a market we rolled up
+
+    WARNING: this class is pickled, be careful with backwards compatibility
+
+    path: path to the metadata file
+    last_chunk_num: the last ColeDB chunk that we rolled up
+    num_msgs_in_last_chunk: number of messages we rolled up from that chunk
+    generation: generation of the ColeDB chunks that we rolled up
+    num_closed_bars: number of bars per interval that won't change anymore
+    open_bars: the last bar of each interval, which can still change
+    """
+
+    path: Path
+    last_chunk_num: int = field(default=0)
+    num_msgs_in_last_chunk: int = field(default=0)
+    generation: int = field(default=0)
+    num_closed_bars: Dict[str, int] = field(
+        default_factory=lambda: {name: 0 for name in ROLLUP_INTERVALS}
+    )
+    open_bars: Dict[str, NDArray[np.float64]] = field(default_factory=dict)
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_bytes(pickle.dumps(self))
+        tmp_path.replace(self.path)
+
+    @classmethod
+    def load(cls, path: Path) -> "RollupMetadata":
+        if not path.exists():
+            return cls(path)
+        metadata: RollupMetadata = pickle.loads(path.read_bytes())
+        # In case we move around the folder structure
+        metadata.path = path
+        return metadata
+
+
+class ColeDBRollupStore:
+    """Rolls ColeDB markets up into bars and loads them back"""
+
+    def __init__(self, db: ColeDBInterface, storage_path: Path | None = None):
+        self.db = db
+        self.storage_path = storage_path or COLEDB_ROLLUPS_DEFAULT_STORAGE_PATH
+
+    def ticker_to_path(self, ticker: MarketTicker) -> Path:
+        """Given a market ticker returns a path to where its rollups live"""
+        return self.storage_path / (ticker.replace("-", "/"))
+
+    def update(self, ticker: MarketTicker) -> int:
+        """Rolls up the messages of a market that are not rolled up yet
+
+        We replay one chunk at a time, so we never have more than one chunk
+        in memory. Returns the number of new messages."""
+        # Another process (like the collector or the compactor) could have
+        # changed the market since db cached its metadata
+        cole_metadata = ColeDBMetadata.load(self.db.ticker_to_metadata_path(ticker))
+        path = self.ticker_to_path(ticker)
+        path.mkdir(parents=True, exist_ok=True)
+        metadata = RollupMetadata.load(path / "metadata")
+        if metadata.generation != cole_metadata.generation:
+            # The chunks were compacted, start over
+            metadata = RollupMetadata(
+                metadata.path, generation=cole_metadata.generation
+            )
+
+        num_new_msgs = 0
+        first_chunk_num = max(metadata.last_chunk_num, 1)
+        for chunk_num in range(first_chunk_num, cole_metadata.last_chunk_num + 1):
+            # We replay the whole chunk, since we need the book from its snapshot
+            bbo = arrays_to_bbo(
+                self.db.read_chunk_arrays(ticker, chunk_num, cole_metadata)
+            )
+            num_already_rolled_up = (
+                metadata.num_msgs_in_last_chunk
+                if chunk_num == metadata.last_chunk_num
+                else 0
+            )
+            new_bbo = bbo[num_already_rolled_up:]
+            if len(new_bbo) > 0:
+                for name, interval in ROLLUP_INTERVALS.items():
+                    self._append_bars(
+                        path / name, metadata, name, bbo_to_bars(new_bbo, interval)
+                    )
+            num_new_msgs += len(new_bbo)
+            metadata.last_chunk_num = chunk_num
+            metadata.num_msgs_in_last_chunk = len(bbo)
+        metadata.save()
+        return num_new_msgs
+
+    def update_series(self, series_ticker: SeriesTicker) -> int:
+        """Rolls up all of the markets in a series"""
+        num_new_msgs = 0
+        for event_ticker in self.db.get_event_tickers(series_ticker):
+            for ticker in self.db.get_market_tickers(event_ticker):
+                num_new_msgs += self.update(ticker)
+        return num_new_msgs
+
+    def load(
+        self,
+        ticker: MarketTicker,
+        interval: timedelta,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+    ) -> NDArray[np.float64]:
+        """Memory maps the bars of an interval that start between start_ts and end_ts
+
+        Returns a read only (num bars, BAR_WIDTH) array, see BAR_COLUMNS."""
+        name = _interval_to_name(interval)
+        path = self.ticker_to_path(ticker)
+        metadata = RollupMetadata.load(path / "metadata")
+        num_bars = metadata.num_closed_bars[name] + (name in metadata.open_bars)
+        if num_bars == 0:
+            return np.empty((0, BAR_WIDTH), dtype="<f8")
+        bars = np.memmap(
+            path / name, dtype="<f8", mode="r", shape=(num_bars, BAR_WIDTH)
+        )
+        ts = bars[:, 0]
+        start = 0 if start_ts is None else np.searchsorted(ts, start_ts.timestamp())
+        end = (
+            len(ts)
+            if end_ts is None
+            else np.searchsorted(ts, end_ts.timestamp(), side="right")
+        )
+        return bars[start:end]
+
+    def load_df(
+        self,
+        ticker: MarketTicker,
+        interval: timedelta,
+        start_ts: datetime | None = None,
+        end_ts: datetime | None = None,
+    ) -> DataFrame:
+        """Loads the bars into a dataframe with the BAR_COLUMNS columns"""
+        return DataFrame(
+            np.array(self.load(ticker, interval, start_ts, end_ts)),
+            columns=BAR_COLUMNS,
+        )
+
+    @staticmethod
+    def _append_bars(
+        path: Path, metadata: RollupMetadata, name: str, bars: NDArray[np.float64]
+    ):
+        """Adds new bars after the closed bars of an interval
+
+        The first new bar is merged into the open bar if they're in the same
+        period. Otherwise, the open bar is closed. The last new bar is open."""
+        open_bar = metadata.open_bars.get(name)
+        if open_bar is not None:
+            if open_bar[0] == bars[0, 0]:
+                bars[0] = merge_bars(open_bar, bars[0])
+            else:
+                bars = np.concatenate([open_bar[np.newaxis], bars])
+        num_closed_bars = metadata.num_closed_bars[name]
+        with open(str(path), "ab") as f:
+            # Drop the old open bar, and anything that was written after the
+            # last metadata save (for example, if we crashed during an update)
+            f.truncate(num_closed_bars * BAR_WIDTH * 8)
+            f.write(bars.astype("<f8").tobytes())
+        metadata.num_closed_bars[name] = num_closed_bars + len(bars) - 1
+        metadata.open_bars[name] = bars[-1].copy()
+
+
+def bbo_to_bars(bbo: NDArray[np.float64], interval: timedelta) -> NDArray[np.float64]:
+    """Aggregates rows from read_bbo_arrays into bars of an interval
+
+    Returns a (num bars, BAR_WIDTH) array, see BAR_COLUMNS."""
+    if len(bbo) == 0:
+        return np.empty((0, BAR_WIDTH))
+    # Timestamps are at most microsecond precise, so we round away float errors
+    # before we bucket them
+    seconds = interval.total_seconds()
+    period_starts = np.floor(np.round(bbo[:, 0], 6) / seconds) * seconds
+    starts = np.flatnonzero(
+        np.concatenate([[True], period_starts[1:] != period_starts[:-1]])
+    )
+    ends = np.append(starts[1:], len(bbo)) - 1
+
+    bars = np.empty((len(starts), BAR_WIDTH))
+    bars[:, 0] = period_starts[starts]
+    bid = bbo[:, 1]
+    ask = bbo[:, 3]
+    for open_column, prices in zip(_OPEN_COLUMNS, (bid, ask, (bid + ask) / 2)):
+        bars[:, open_column] = prices[starts]
+        # fmax and fmin ignore nans, unless the whole period is nan
+        bars[:, open_column + 1] = np.fmax.reduceat(prices, starts)
+        bars[:, open_column + 2] = np.fmin.reduceat(prices, starts)
+        bars[:, open_column + 3] = prices[ends]
+    bars[:, -1] = ends - starts + 1
+    return bars
+
+
+def merge_bars(
+    first: NDArray[np.float64], second: NDArray[np.float64]
+) -> NDArray[np.float64]:
+    """Merges two bars of the same period, where first comes before second"""
+    merged = second.copy()
+    for open_column in _OPEN_COLUMNS:
+        merged[open_column] = first[open_column]
+        merged[open_column + 1] = np.fmax(
+            first[open_column + 1], second[open_column + 1]
+        )
+        merged[open_column + 2] = np.fmin(
+            first[open_column + 2], second[open_column + 2]
+        )
+    merged[-1] = first[-1] + second[-1]
+    return merged
+
+
+def _interval_to_name(interval: timedelta) -> str:
+    for name, rollup_interval in ROLLUP_INTERVALS.items():
+        if rollup_interval == interval:
+            return name
+    raise ValueError(f"No rollups for {interval}, we have {list(ROLLUP_INTERVALS)}")
+
+
+if __name__ == "__main__":
+    # pragma: no cover
+    cole = ColeDBInterface()
+    store = ColeDBRollupStore(cole)
+    for series_ticker in cole.get_series_tickers():
+        print(f"{series_ticker}: rolled up {store.update_series(series_ticker)} msgs")
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from data.coledb.coledb import ColeDBInterface
+from exchange.interface import ExchangeInterface
+from helpers.types.markets import MarketResult, MarketTicker
+
+
+def backfill_market_info(
+    exchange_interface: ExchangeInterface, cole: ColeDBInterface
+) -> int:
+    """Fills in the market info for the markets in ColeDB
+
+    We fetch the info for markets that don't have any, and re-fetch it for
+    closed markets that did not have a result the last time we saved it.
+    Returns the number of markets that we updated."""
+    now = datetime.now(ColeDBInterface.tz)
+    num_updated = 0
+    for series_ticker in cole.get_series_tickers():
+        for event_ticker in cole.get_event_tickers(series_ticker):
+            for ticker in cole.get_market_tickers(event_ticker):
+                if not needs_market_info(cole, ticker, now):
+                    continue
+                cole.write_market_info(exchange_interface.get_market(ticker))
+                num_updated += 1
+    return num_updated
+
+
+def needs_market_info(cole: ColeDBInterface, ticker: MarketTicker, now: datetime):
+    """Whether the market info is missing or may have changed since we saved it"""
+    if not cole.market_info_exists(ticker):
+        return True
+    market = cole.read_market_info(ticker)
+    return market.result == MarketResult.NOT_DETERMINED and market.close_time <= now
+
+
+if __name__ == "__main__":
+    num_updated = backfill_market_info(
+        # pragma: no cover
+        ExchangeInterface(is_test_run=False),
+        ColeDBInterface(),
+    )
+    print(f"Updated the market info of {num_updated} markets")
@@ -1,66 +1,116 @@
+import sys
 from datetime import datetime, timedelta
 from time import sleep
+from typing import Dict, List
 
 from rich.live import Live
 from rich.table import Table
 import traceback
-from data.coledb.coledb import ColeDBInterface
+from data.coledb.coledb import (
+    ColeDBInterface,
+    ColeDBLockedError,
+    ColeDBShard,
+    ColeDBWriter,
+)
 from exchange.interface import ExchangeInterface
 from exchange.orderbook import OrderbookSubscription
-from helpers.types.websockets.response import OrderbookDeltaWR, OrderbookSnapshotWR
+from helpers.types.markets import Market, MarketTicker
+from helpers.types.websockets.response import (
+    OrderbookDeltaRM,
+    OrderbookDeltaWR,
+    OrderbookSnapshotRM,
+    OrderbookSnapshotWR,
+    TradeRM,
+    TradeWR,
+)
 from helpers.utils import send_alert_email
 
+# Messages that the collector writes to cole
+ColeMessage = OrderbookSnapshotRM | OrderbookDeltaRM | TradeRM
 
-def generate_table(num_snapshot_msgs: int, num_delta_msgs: int) -> Table:
+
+def generate_table(
+    num_snapshot_msgs: int, num_delta_msgs: int, num_trade_msgs: int | None = None
+) -> Table:
+    """The trade column is only shown if num_trade_msgs is passed in"""
     table = Table(show_header=True, header_style="bold", title="Orderbook Collection")
 
     table.add_column("Snapshot msgs", style="cyan", width=12)
     table.add_column("Delta msgs", style="cyan", width=12)
+    row = [str(num_snapshot_msgs), str(num_delta_msgs)]
+    if num_trade_msgs is not None:
+        table.add_column("Trade msgs", style="cyan", width=12)
+        row.append(str(num_trade_msgs))
 
-    table.add_row(
-        str(num_snapshot_msgs),
-        str(num_delta_msgs),
-    )
+    table.add_row(*row)
 
     return table
 
 
 def collect_orderbook_data(
-    exchange_interface: ExchangeInterface, cole: ColeDBInterface
+    exchange_interface: ExchangeInterface,
+    cole: ColeDBInterface,
+    collect_trades: bool = False,
 ):
     """Writes live data to coledb
 
     We assume the influx databse is up already by the time you
     hit this function.
+
+    If collect_trades is set, we also subscribe to the trade channel and
+    store the trades in coledb.
+
+    If cole has a shard, we only collect the markets in the shard.
+
+    If another process (like the compactor) has a market locked, we hold on
+    to its messages and write them once we get the lock (see write_to_cole).
     """
     is_test_run = exchange_interface.is_test_run
     pages = 1 if is_test_run else None
-    open_markets = list(exchange_interface.get_active_markets(pages=pages))
+    open_markets = get_open_markets(exchange_interface, cole, pages)
     market_tickers = [market.ticker for market in open_markets]
     db = cole
+    save_market_info(db, open_markets)
     num_snapshot_msgs = 0
     num_delta_msgs = 0
+    num_trade_msgs: int | None = 0 if collect_trades else None
+    pending_msgs: Dict[MarketTicker, List[ColeMessage]] = {}
 
     last_update_time = datetime.now()
     time_5pm = 17
     time_5am = 5
 
     with exchange_interface.get_websocket() as ws:
-        sub = OrderbookSubscription(ws, market_tickers)
+        sub = OrderbookSubscription(
+            ws, market_tickers, send_trade_updates=collect_trades
+        )
         gen = sub.continuous_receive()
         with Live(
-            generate_table(num_snapshot_msgs, num_delta_msgs), refresh_per_second=1
+            generate_table(num_snapshot_msgs, num_delta_msgs, num_trade_msgs),
+            refresh_per_second=1,
         ) as live:
             while True:
                 data: OrderbookSubscription.MESSAGE_TYPES_TO_RETURN = next(gen)
+                if isinstance(data, TradeWR):
+                    assert num_trade_msgs is not None
+                    num_trade_msgs += 1
+                    write_to_cole(db, data.msg, pending_msgs)
+                    live.update(
+                        generate_table(
+                            num_snapshot_msgs, num_delta_msgs, num_trade_msgs
+                        )
+                    )
+                    continue
                 if isinstance(data, OrderbookSnapshotWR):
                     num_snapshot_msgs += 1
                 elif isinstance(data, OrderbookDeltaWR):
                     num_delta_msgs += 1
                 else:
                     continue
-                live.update(generate_table(num_snapshot_msgs, num_delta_msgs))
-                db.write(data.msg)
+                live.update(
+                    generate_table(num_snapshot_msgs, num_delta_msgs, num_trade_msgs)
+                )
+                write_to_cole(db, data.msg, pending_msgs)
 
                 if is_test_run and num_snapshot_msgs + num_delta_msgs == 3:
                     # For testing, we don't want to run it too many times
@@ -72,26 +122,111 @@ def collect_orderbook_data(
                 if (now := datetime.now()) - last_update_time > timedelta(hours=8) and (
                     time_5pm <= now.hour or now.hour <= time_5am
                 ):
-                    open_markets = list(
-                        exchange_interface.get_active_markets(pages=pages)
-                    )
+                    open_markets = get_open_markets(exchange_interface, db, pages)
                     market_tickers = [market.ticker for market in open_markets]
+                    save_market_info(db, open_markets)
                     sub.update_subscription(market_tickers)
                     last_update_time = now
+    # Make sure buffered writes make it to disk
+    db.flush()
+
+
+def write_to_cole(
+    db: ColeDBInterface,
+    msg: ColeMessage,
+    pending_msgs: Dict[MarketTicker, List[ColeMessage]],
+):
+    """Writes a message to cole, or holds on to it if the market is locked
+
+    While another process has the market locked, we keep its messages in
+    pending_msgs. With each new message of the market, we try to write the
+    messages that we held on to (in order) before the new one. Dropping them
+    instead would leave the orderbook that we store wrong."""
+    ticker = msg.market_ticker
+    if ticker not in pending_msgs:
+        try:
+            _write_msg(db, msg)
+        except ColeDBLockedError:
+            pending_msgs[ticker] = [msg]
+        return
+    msgs = pending_msgs[ticker]
+    msgs.append(msg)
+    num_written = 0
+    try:
+        for pending_msg in msgs:
+            _write_msg(db, pending_msg)
+            num_written += 1
+    except ColeDBLockedError:
+        del msgs[:num_written]
+        return
+    del pending_msgs[ticker]
+
+
+def _write_msg(db: ColeDBInterface, msg: ColeMessage):
+    if isinstance(msg, TradeRM):
+        db.write_trade(msg)
+    else:
+        db.write(msg)
+
+
+def get_open_markets(
+    exchange_interface: ExchangeInterface, cole: ColeDBInterface, pages: int | None
+) -> List[Market]:
+    """Returns the open markets that are in the shard of cole"""
+    return [
+        market
+        for market in exchange_interface.get_active_markets(pages=pages)
+        if cole.shard is None or cole.shard.owns(market.ticker)
+    ]
+
+
+def save_market_info(cole: ColeDBInterface, markets: List[Market]):
+    """Saves the market info (close time, strikes, etc.) of the markets we collect
+
+    The result is filled in later by the backfill_market_info job, which
+    also picks up the markets that another process had locked"""
+    for market in markets:
+        try:
+            cole.write_market_info(market)
+        except ColeDBLockedError:
+            continue
 
 
 def retry_collect_orderbook_data(
     exchange_interface: ExchangeInterface,
-    cole: ColeDBInterface = ColeDBInterface(),
+    cole: ColeDBInterface | None = None,
+    shard: ColeDBShard | None = None,
+    collect_trades: bool = False,
+):
+    """Adds retries to collect_orderbook_data
+
+    By default, we write with a buffered ColeDBWriter for the shard, which
+    we close when we stop collecting"""
+    if cole is not None:
+        _retry_collect_orderbook_data(exchange_interface, cole, collect_trades)
+        return
+    with ColeDBWriter(shard=shard) as writer:
+        _retry_collect_orderbook_data(exchange_interface, writer, collect_trades)
+
+
+def _retry_collect_orderbook_data(
+    exchange_interface: ExchangeInterface,
+    cole: ColeDBInterface,
+    collect_trades: bool,
 ):
-    """Adds retries to collect_orderbook_data"""
     time_between_emails = timedelta(days=1)
     # We send the last email sent in the past so we trigger send on the first alert
     last_email_sent_ts = datetime.now() - time_between_emails
     while True:
         try:
-            collect_orderbook_data(exchange_interface=exchange_interface, cole=cole)
+            collect_orderbook_data(
+                exchange_interface=exchange_interface,
+                cole=cole,
+                collect_trades=collect_trades,
+            )
         except Exception as e:
+            # Don't lose the buffered writes while we wait to retry
+            cole.flush()
             error_msg = f"Received error: {str(e)}. Re-running collect orderbook algo"
             traceback.print_exc()
             print(error_msg)
@@ -102,7 +237,19 @@ def retry_collect_orderbook_data(
 
 
 if __name__ == "__main__":
+    # To run several collectors, pass each one its shard index and the
+    # number of shards, like: python orderbook.py 0 4
+    # To collect trades as well, add --trades
+    args = [arg for arg in sys.argv[1:] if arg != "--trades"]
+    shard = (
+        # pragma: no cover
+        ColeDBShard(int(args[0]), int(args[1]))
+        if len(args) == 2
+        else None
+    )
     retry_collect_orderbook_data(
         # pragma: no cover
         ExchangeInterface(is_test_run=False),
+        shard=shard,
+        collect_trades="--trades" in sys.argv,
     )
@@ -54,5 +54,7 @@ LOCAL_STORAGE_FOLDER = pathlib.Path(__file__).parent.parent.parent / pathlib.Pat
     "local/"
 )
 COLEDB_DEFAULT_STORAGE_PATH = LOCAL_STORAGE_FOLDER / "coledb_storage"
+COLEDB_COLUMNAR_DEFAULT_STORAGE_PATH = LOCAL_STORAGE_FOLDER / "coledb_columnar"
+COLEDB_ROLLUPS_DEFAULT_STORAGE_PATH = LOCAL_STORAGE_FOLDER / "coledb_rollups"
 
 RAW_FEATURES_BUCKET = "dead-gecco-prod-features-raw"
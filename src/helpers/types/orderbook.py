@@ -1,5 +1,5 @@
-import copy
 import typing
+from collections.abc import Iterable, Iterator, Mapping, MutableMapping, Sequence
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
@@ -16,98 +16,378 @@ if typing.TYPE_CHECKING:
     from helpers.types.websockets.response import OrderbookDeltaRM, OrderbookSnapshotRM
 
 
-@dataclass
-class OrderbookSide:
-    """Represents levels on side of the order book (either the no side or yes side)
+# Prices 1-99, so that we don't validate a new Price every time we return one
+_PRICES = tuple(Price(price) for price in range(1, 100))
 
-    We use a basemodel because this is used for type validation when
-    we read an orderbook snapshot on the websocket layer."""
 
-    # TODO: make a level class variable so that we can return Level(Price, Quantity).
-    # or make it a named tuple. Also make the representation more compact
-    levels: Dict[Price, Quantity] = field(default_factory=dict)
+class OrderbookLevels(MutableMapping[Price, Quantity]):
+    """Dict-like view of the levels of an OrderbookSide, in price order
 
-    # Cached values
-    _cached_min: Tuple[Price, Quantity] | None = field(
-        default_factory=lambda: None, compare=False, repr=False
-    )
-    _cached_max: Tuple[Price, Quantity] | None = field(
-        default_factory=lambda: None, compare=False, repr=False
-    )
-    _cached_sum: Quantity = field(
-        default_factory=lambda: Quantity(0), compare=False, repr=False
+    Reads and writes go through to the side. Setting a level to 0 removes it."""
+
+    __slots__ = ("_side",)
+
+    def __init__(self, side: "OrderbookSide"):
+        self._side = side
+
+    def __getitem__(self, price: Price) -> Quantity:
+        if not isinstance(price, int) or not 1 <= price <= 99:
+            raise KeyError(price)
+        quantity = self._side._get_quantity(price)
+        if quantity == 0:
+            raise KeyError(price)
+        return Quantity(quantity)
+
+    def __setitem__(self, price: Price, quantity: Quantity):
+        self._side._set_quantity(Price(price), Quantity(quantity))
+
+    def __delitem__(self, price: Price):
+        self[price]
+        self._side._set_quantity(price, Quantity(0))
+
+    def __contains__(self, price: object) -> bool:
+        return (
+            isinstance(price, int)
+            and 1 <= price <= 99
+            and self._side._get_quantity(price) != 0
+        )
+
+    def __iter__(self) -> Iterator[Price]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self._side)
+
+    def __repr__(self) -> str:
+        return repr(self.copy())
+
+    def get(self, price: Price, default=None):  # type:ignore[override]
+        return self[price] if price in self else default
+
+    def keys(self) -> List[Price]:  # type:ignore[override]
+        return [price for price, _ in self.items()]
+
+    def values(self) -> List[Quantity]:  # type:ignore[override]
+        return [quantity for _, quantity in self.items()]
+
+    def items(self) -> List[Tuple[Price, Quantity]]:  # type:ignore[override]
+        return self._side._level_items()
+
+    def copy(self) -> Dict[Price, Quantity]:
+        return dict(self.items())
+
+
+class OrderbookSide:
+    """Represents levels on side of the order book (either the no side or yes side)
+
+    Prices are bounded to 1-99, so we store the quantities in an array indexed
+    by price (0 means there's no level). We keep the largest and smallest
+    prices and the total quantity up to date as we apply deltas, so getting
+    the top of the book doesn't need to scan the levels. We only rescan when
+    the best level empties. Use levels for a dict-like view of the side."""
+
+    __slots__ = (
+        "_quantities",
+        "_max_price",
+        "_min_price",
+        "_total_quantity",
+        "_num_levels",
     )
 
-    def _reset_cache(self):
-        self._cached_min = None
-        self._cached_max = None
-        self._cached_sum = Quantity(0)
+    def __init__(self, levels: Mapping[Price, Quantity] | None = None):
+        # Index 0 is unused so that we can index by price
+        self._quantities = [0] * 100
+        # 0 and 100 when the side is empty
+        self._max_price = 0
+        self._min_price = 100
+        self._total_quantity = 0
+        self._num_levels = 0
+        if levels is not None:
+            for price, quantity in levels.items():
+                self.add_level(price, quantity)
+
+    @property
+    def levels(self) -> OrderbookLevels:
+        return OrderbookLevels(self)
+
+    def _get_quantity(self, price: int) -> int:
+        return self._quantities[price]
+
+    def _level_items(self) -> List[Tuple[Price, Quantity]]:
+        """The levels in price order"""
+        quantities = self._quantities
+        return [
+            (_PRICES[price - 1], Quantity(quantities[price]))
+            for price in range(self._min_price, self._max_price + 1)
+            if quantities[price] != 0
+        ]
 
     def add_level(self, price: Price, quantity: Quantity):
-        if price in self.levels:
+        if self._quantities[price] != 0:
             raise ValueError(
                 f"Price {price} to quantity {quantity} already exists in {self.levels}"
             )
-        self.levels[price] = quantity
-
-        self._reset_cache()
+        self._set_quantity(Price(price), quantity)
 
     def apply_delta(self, price: Price, delta: QuantityDelta):
         """Destructively applies an orderbook delta to the orderbook side"""
-        if price not in self.levels:
-            self.levels[price] = Quantity(0)
-        self.levels[price] += delta
-
-        if self.levels[price] == 0:
-            self._remove_level(price)
-
-        self._reset_cache()
+        self._set_quantity(price, self._quantities[price] + delta)
+
+    def apply_deltas(self, deltas: Iterable[Tuple[Price, QuantityDelta]]):
+        """Destructively applies several deltas to the orderbook side
+
+        Same as calling apply_delta on each of them, but we only rescan for
+        the best prices once at the end, rather than every time the best
+        level empties (like when a sweep clears several levels)."""
+        quantities = self._quantities
+        max_price = self._max_price
+        min_price = self._min_price
+        try:
+            for price, delta in deltas:
+                old_quantity = quantities[price]
+                quantity = int(old_quantity + delta)
+                if quantity < 0:
+                    raise ValueError(f"{quantity} invalid quantity")
+                quantities[price] = quantity
+                self._total_quantity += quantity - old_quantity
+                if old_quantity == 0:
+                    if quantity == 0:
+                        continue
+                    self._num_levels += 1
+                    if price > max_price:
+                        max_price = price
+                    if price < min_price:
+                        min_price = price
+                elif quantity == 0:
+                    self._num_levels -= 1
+        finally:
+            # The best prices can only be too far out (not too far in), so we
+            # scan inwards from them. This also keeps the side consistent if
+            # one of the deltas was invalid.
+            while max_price > 0 and quantities[max_price] == 0:
+                max_price -= 1
+            while min_price < 100 and quantities[min_price] == 0:
+                min_price += 1
+            self._max_price = max_price
+            self._min_price = min_price
+
+    def _set_quantity(self, price: Price, quantity: int):
+        """Sets the quantity at a level and updates the best prices and total"""
+        if quantity < 0:
+            raise ValueError(f"{quantity} invalid quantity")
+        # Plain ints are faster, and Quantity can't hold the negative differences
+        quantity = int(quantity)
+        quantities = self._quantities
+        old_quantity = quantities[price]
+        quantities[price] = quantity
+        self._total_quantity += quantity - old_quantity
+        if old_quantity == 0:
+            if quantity == 0:
+                return
+            self._num_levels += 1
+            if price > self._max_price:
+                self._max_price = price
+            if price < self._min_price:
+                self._min_price = price
+        elif quantity == 0:
+            self._num_levels -= 1
+            if price == self._max_price:
+                max_price: int = price
+                while max_price > 0 and quantities[max_price] == 0:
+                    max_price -= 1
+                self._max_price = max_price
+            if price == self._min_price:
+                min_price: int = price
+                while min_price < 100 and quantities[min_price] == 0:
+                    min_price += 1
+                self._min_price = min_price
 
     def __len__(self) -> int:
-        return len(self.levels)
+        return self._num_levels
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, OrderbookSide):
+            return NotImplemented
+        if not isinstance(self, InvertedOrderbookSide) and not isinstance(
+            other, InvertedOrderbookSide
+        ):
+            return self._quantities == other._quantities
+        return self._level_items() == other._level_items()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(levels={self.levels!r})"
+
+    def __deepcopy__(self, memo) -> "OrderbookSide":
+        return self._copy()
+
+    def __getstate__(self):
+        return self._quantities
+
+    def __setstate__(self, state):
+        # Sides that were pickled before we used an array have a levels dict
+        levels = (
+            state["levels"]
+            if isinstance(state, dict)
+            else {
+                Price(price): Quantity(quantity)
+                for price, quantity in enumerate(state)
+                if quantity != 0
+            }
+        )
+        OrderbookSide.__init__(self, levels)
 
     def is_empty(self):
-        return len(self.levels) == 0
+        return self._num_levels == 0
 
     def get_largest_price_level(self) -> Tuple[Price, Quantity] | None:
-        if self._cached_max:
-            return self._cached_max
-        if self.is_empty():
+        price = self._max_price
+        if price == 0:
             return None
-        max_level = max(self.levels.items())
-        self._cached_max = max_level
-        return max_level
+        return _PRICES[price - 1], Quantity(self._quantities[price])
 
     def get_smallest_price_level(self) -> Tuple[Price, Quantity] | None:
-        if self._cached_min:
-            return self._cached_min
-        if self.is_empty():
+        price = self._min_price
+        if price == 100:
             return None
-        min_level = min(self.levels.items())
-        self._cached_min = min_level
-        return min_level
+        return _PRICES[price - 1], Quantity(self._quantities[price])
 
     def get_total_quantity(self) -> Quantity:
-        if self._cached_sum:
-            return self._cached_sum
-        sum_ = Quantity(sum(quantity for quantity in self.levels.values()))
-        self._cached_sum = sum_
-        return sum_
+        return Quantity(self._total_quantity)
 
-    def invert_prices(self) -> "OrderbookSide":
-        """Non-destructively inverts prices on orderbook side
+    def inverted_view(self) -> "OrderbookSide":
+        """Read only view of the side with inverted prices, without copying it
 
         Useful for changing the view of the orderbook"""
-        inverted_levels: Dict[Price, Quantity] = {}
-        for price, quantity in self.levels.items():
-            inverted_levels[get_opposite_side_price(price)] = quantity
+        return InvertedOrderbookSide(self)
+
+    def invert_prices(self) -> "OrderbookSide":
+        """Non-destructively inverts prices on orderbook side
 
-        return OrderbookSide(inverted_levels)
+        Unlike inverted_view, this copies the levels, so you can modify them"""
+        inverted = OrderbookSide()
+        # Price p moves to 100 - p
+        inverted._quantities = [0] + self._quantities[:0:-1]
+        inverted._max_price = 100 - self._min_price
+        inverted._min_price = 100 - self._max_price
+        inverted._total_quantity = self._total_quantity
+        inverted._num_levels = self._num_levels
+        return inverted
+
+    def _copy(self) -> "OrderbookSide":
+        copied = OrderbookSide()
+        copied._quantities = self._quantities.copy()
+        copied._max_price = self._max_price
+        copied._min_price = self._min_price
+        copied._total_quantity = self._total_quantity
+        copied._num_levels = self._num_levels
+        return copied
 
     def _remove_level(self, price: Price):
         del self.levels[price]
 
 
+class InvertedOrderbookSide(OrderbookSide):
+    """Read only projection of an OrderbookSide that maps price p to 100 - p
+
+    It shares the array of the side, so it's free to create, and it reflects
+    later changes to the side. The largest price of the view is the smallest
+    price of the side and vice versa, so we reuse the best prices that the side
+    keeps up to date. Deep copies are regular (writable) OrderbookSides, and
+    the inverted view of an inverted view is a FrozenOrderbookSide."""
+
+    __slots__ = ("_side",)
+
+    def __init__(self, side: OrderbookSide):
+        self._side = side
+
+    def _get_quantity(self, price: int) -> int:
+        return self._side._quantities[100 - price]
+
+    def _level_items(self) -> List[Tuple[Price, Quantity]]:
+        return [
+            (_PRICES[99 - price], quantity)
+            for price, quantity in reversed(self._side._level_items())
+        ]
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Inverted views are read only, modify the side instead")
+
+    add_level = _read_only
+    apply_delta = _read_only
+    apply_deltas = _read_only
+    _set_quantity = _read_only
+    _remove_level = _read_only
+
+    def __len__(self) -> int:
+        return self._side._num_levels
+
+    def __deepcopy__(self, memo) -> OrderbookSide:
+        return self._side.invert_prices()
+
+    def __reduce__(self):
+        return InvertedOrderbookSide, (self._side,)
+
+    def is_empty(self):
+        return self._side._num_levels == 0
+
+    def get_largest_price_level(self) -> Tuple[Price, Quantity] | None:
+        price = self._side._min_price
+        if price == 100:
+            return None
+        return _PRICES[99 - price], Quantity(self._side._quantities[price])
+
+    def get_smallest_price_level(self) -> Tuple[Price, Quantity] | None:
+        price = self._side._max_price
+        if price == 0:
+            return None
+        return _PRICES[99 - price], Quantity(self._side._quantities[price])
+
+    def get_total_quantity(self) -> Quantity:
+        return Quantity(self._side._total_quantity)
+
+    def inverted_view(self) -> OrderbookSide:
+        # Handing out the side itself would let callers modify it through
+        # the view, so we give back a read only copy of it
+        return FrozenOrderbookSide(self._side)
+
+    def invert_prices(self) -> OrderbookSide:
+        return self._side._copy()
+
+    def _copy(self) -> OrderbookSide:
+        return self._side.invert_prices()
+
+
+class FrozenOrderbookSide(OrderbookSide):
+    """Read only copy of an OrderbookSide
+
+    It has its own array, so later changes to the side don't show up in it.
+    Copies are regular (writable) OrderbookSides."""
+
+    __slots__ = ()
+
+    def __init__(self, side: OrderbookSide):
+        # Inverted views don't have an array of their own
+        if isinstance(side, InvertedOrderbookSide):
+            side = side._copy()
+        self._quantities = side._quantities.copy()
+        self._max_price = side._max_price
+        self._min_price = side._min_price
+        self._total_quantity = side._total_quantity
+        self._num_levels = side._num_levels
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Frozen sides are read only, copy the side first")
+
+    add_level = _read_only
+    apply_delta = _read_only
+    apply_deltas = _read_only
+    _set_quantity = _read_only
+    _remove_level = _read_only
+
+    def __reduce__(self):
+        return FrozenOrderbookSide, (self._copy(),)
+
+
 class OrderbookView(str, Enum):
     # The sell view is the same as the maker view on the website
     BID = "maker"
@@ -195,7 +475,7 @@ class Orderbook:
             )
         if self.view != OrderbookView.BID:
             raise ValueError("Can only apply delta on bid view")
-        new_orderbook = self if in_place else copy.deepcopy(self)
+        new_orderbook = self if in_place else self.copy()
         if delta.side == Side.NO:
             new_orderbook.no.apply_delta(delta.price, delta.delta)
         else:
@@ -210,6 +490,76 @@ class Orderbook:
         new_orderbook.ts = delta.ts
         return new_orderbook
 
+    def apply_deltas(
+        self, deltas: Sequence["OrderbookDeltaRM"], in_place=False
+    ) -> "AppliedDeltas":
+        """Applies a burst of deltas to the orderbook, in order
+
+        Unlike calling apply_delta on each delta, we only check that the
+        orderbook is valid once at the end (so it can be crossed in between),
+        and each side updates its best prices once. Also reports which sides
+        had their best level (price or quantity) change."""
+        for delta in deltas:
+            if delta.market_ticker != self.market_ticker:
+                raise ValueError(
+                    f"Market tickers don't match. Orderbook: {self}. Delta: {delta}"
+                )
+        if self.view != OrderbookView.BID:
+            raise ValueError("Can only apply delta on bid view")
+        old_yes_top = self.yes.get_largest_price_level()
+        old_no_top = self.no.get_largest_price_level()
+        new_orderbook = self if in_place else self.copy()
+        # The sides are independent, so we only need to keep the order per side
+        new_orderbook.yes.apply_deltas(
+            (delta.price, delta.delta) for delta in deltas if delta.side == Side.YES
+        )
+        new_orderbook.no.apply_deltas(
+            (delta.price, delta.delta) for delta in deltas if delta.side == Side.NO
+        )
+        if not new_orderbook._is_valid_orderbook():
+            raise ValueError(
+                "Not a valid orderbook after deltas. "
+                + f"Old orderbook: {self}. Deltas: {deltas}."
+                + f"Neworderbook: {new_orderbook}"
+            )
+        if deltas:
+            new_orderbook.ts = deltas[-1].ts
+        return AppliedDeltas(
+            orderbook=new_orderbook,
+            yes_bbo_changed=new_orderbook.yes.get_largest_price_level() != old_yes_top,
+            no_bbo_changed=new_orderbook.no.get_largest_price_level() != old_no_top,
+        )
+
+    def copy(self) -> "Orderbook":
+        """Returns a copy of the orderbook that doesn't share its levels
+
+        This is much cheaper than a deepcopy: we copy the price arrays of the
+        sides and share the rest (the ticker, view, and ts are immutable)."""
+        return Orderbook(
+            market_ticker=self.market_ticker,
+            yes=self.yes._copy(),
+            no=self.no._copy(),
+            view=self.view,
+            ts=self.ts,
+        )
+
+    def __deepcopy__(self, memo) -> "Orderbook":
+        return self.copy()
+
+    def freeze(self) -> "Orderbook":
+        """Returns a read only snapshot of the orderbook
+
+        Like copy, it doesn't share its levels, but applying deltas to the
+        snapshot in place raises a TypeError. Applying them non-destructively
+        (or copying the snapshot) gives you a regular orderbook."""
+        return Orderbook(
+            market_ticker=self.market_ticker,
+            yes=FrozenOrderbookSide(self.yes),
+            no=FrozenOrderbookSide(self.no),
+            view=self.view,
+            ts=self.ts,
+        )
+
     def get_side(self, side: Side) -> OrderbookSide:
         if side == Side.NO:
             return self.no
@@ -296,15 +646,24 @@ class Orderbook:
         )
 
     def get_view(self, view: OrderbookView) -> "Orderbook":
-        """Returns a different view of the orderbook"""
+        """Returns a different view of the orderbook
+
+        The view shares the levels of this orderbook (see inverted_view), so
+        it reflects later changes to them, and it's read only: applying a
+        delta to it in place raises a TypeError. Apply deltas to it
+        non-destructively, or copy it, to get an orderbook that you can
+        modify. The view of a view is a read only copy (see freeze) rather
+        than this orderbook, so that it can't be used to modify it."""
         if view == self.view:
             return self
 
+        # Views share the levels of this orderbook, so they're cheap to make
         return Orderbook(
             market_ticker=self.market_ticker,
-            yes=self.no.invert_prices(),
-            no=self.yes.invert_prices(),
+            yes=self.no.inverted_view(),
+            no=self.yes.inverted_view(),
             view=view,
+            ts=self.ts,
         )
 
     def _get_small_price_level(self, side) -> Tuple[Price, Quantity] | None:
@@ -379,6 +738,20 @@ class Orderbook:
         return orders
 
 
+@dataclass
+class AppliedDeltas:
+    """Result of Orderbook.apply_deltas"""
+
+    orderbook: Orderbook
+    # Whether the best level (in the bid view) of each side changed
+    yes_bbo_changed: bool
+    no_bbo_changed: bool
+
+    @property
+    def bbo_changed(self) -> bool:
+        return self.yes_bbo_changed or self.no_bbo_changed
+
+
 class ApiOrderbook(ExternalApi):
     yes: List[List] | None = []
     no: List[List] | None = []
@@ -6,6 +6,7 @@ from itertools import chain
 from pathlib import Path
 from typing import TYPE_CHECKING, Dict, List, Tuple, Union
 
+import numpy as np
 from matplotlib import pyplot as plt
 
 from data.coledb.coledb import ColeDBInterface
@@ -670,19 +671,15 @@ class PortfolioHistory:
             if only_graph_if_orders:
                 return
 
-        bids = []
-        asks = []
-        midpoints = []
-        times = []
-        for orderbook in ColeDBInterface().read_cursor(
+        bbo = ColeDBInterface().read_bbo_arrays(
             ticker=ticker, start_ts=start_ts, end_ts=end_ts
-        ):
-            bbo = orderbook.get_bbo()
-            if bbo.bid and bbo.ask:
-                bids.append(bbo.bid.price)
-                asks.append(bbo.ask.price)
-                midpoints.append(((bbo.bid.price + bbo.ask.price) / 2))
-                times.append(orderbook.ts)
+        )
+        # Only keep the messages with both a bid and an ask
+        bbo = bbo[~np.isnan(bbo[:, 1]) & ~np.isnan(bbo[:, 3])]
+        bids = bbo[:, 1]
+        asks = bbo[:, 3]
+        midpoints = (bids + asks) / 2
+        times = [datetime.fromtimestamp(ts, ColeDBInterface.tz) for ts in bbo[:, 0]]
 
         for order in orders:
             color = "red" if order.trade == TradeType.BUY else "green"
@@ -107,8 +107,9 @@ def kalshi_orderbook_ts_name(ticker: MarketTicker) -> str:
 def hist_kalshi_orderbook_feature(
     ticker: MarketTicker, start_ts: datetime.datetime, end_ts: datetime.datetime
 ) -> ObservationCursor:
+    # The observations keep the orderbooks around, so they can't share one
     for orderbook in ColeDBInterface().read_cursor(
-        ticker=ticker, start_ts=start_ts, end_ts=end_ts
+        ticker=ticker, start_ts=start_ts, end_ts=end_ts, snapshot=True
     ):
         yield Observation.from_any(
             feature_name=kalshi_orderbook_feature_name(ticker=ticker),
@@ -55,7 +55,7 @@ import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import MinMaxScaler
 
-from data.coledb.coledb import ColeDBInterface
+from data.coledb.coledb import ColeDBInterface, ReadonlyColeDB
 from exchange.interface import ExchangeInterface
 from helpers.constants import LOCAL_STORAGE_FOLDER
 from helpers.types.markets import MarketResult, MarketTicker
@@ -208,7 +208,10 @@ def vectors_to_csv():
 def bbo_vec_to_output_vec(
     e: ExchangeInterface,
     base_path=LOCAL_STORAGE_FOLDER / "research/single_market_model/",
+    db: ColeDBInterface | None = None,
 ):
+    """If the market info is in ColeDB, we use it rather than asking the exchange"""
+    db = db or ReadonlyColeDB()
     tickers = os.listdir(base_path)
 
     for ticker in tickers:
@@ -225,7 +228,10 @@ def bbo_vec_to_output_vec(
         # TODO: also handle gapped markets
 
         # We use the settlement info to determine the last price
-        m = e.get_market(MarketTicker(ticker))
+        if db.market_info_exists(MarketTicker(ticker)):
+            m = db.read_market_info(MarketTicker(ticker))
+        else:
+            m = e.get_market(MarketTicker(ticker))
 
         if m.result == MarketResult.NOT_DETERMINED:
             # There is an edge case where Nov28 was not determined properly
@@ -2,15 +2,18 @@
 This is a very useful chart that lets you see the fills
 made on a market overlayed with the market history of the chart.
 The y axis of the chart is in yes prices, and it's shown based on the
-yes bid and the yes ask candelsticks per minute buckets
+yes bid and the yes ask candelsticks per minute buckets. The candlesticks come
+from the local ColeDB rollups (see data/coledb/rollups.py).
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pandas as pd
 import plotly.graph_objects as go
 import pytz
 
+from data.coledb.coledb import ColeDBInterface
+from data.coledb.rollups import ColeDBRollupStore
 from exchange.interface import ExchangeInterface
 from helpers.types.markets import MarketTicker
 from helpers.types.orders import Side
@@ -33,26 +36,26 @@ fills.sort(key=lambda x: x.created_time)
 other_trades = e.get_trades(ticker=ticker, min_ts=start, max_ts=end)
 
 # Get market history
-candlesticks = e.get_market_candlesticks(ticker, min_ts=start, max_ts=end)
+rollups = ColeDBRollupStore(ColeDBInterface())
+rollups.update(ticker)
+candlesticks = rollups.load_df(ticker, timedelta(minutes=1), start, end)
 
 
 def plot_dual_candlestick():
     # Convert data to lists for Plotly
-    timestamps = [
-        pd.to_datetime(candle.end_period_ts, unit="s") for candle in candlesticks
-    ]
+    timestamps = pd.to_datetime(candlesticks.ts, unit="s")
 
     # yes_ask candlestick data
-    yes_ask_open = [candle.yes_ask.open for candle in candlesticks]
-    yes_ask_high = [candle.yes_ask.high for candle in candlesticks]
-    yes_ask_low = [candle.yes_ask.low for candle in candlesticks]
-    yes_ask_close = [candle.yes_ask.close for candle in candlesticks]
+    yes_ask_open = candlesticks.ask_open
+    yes_ask_high = candlesticks.ask_high
+    yes_ask_low = candlesticks.ask_low
+    yes_ask_close = candlesticks.ask_close
 
     # yes_bid candlestick data
-    yes_bid_open = [candle.yes_bid.open for candle in candlesticks]
-    yes_bid_high = [candle.yes_bid.high for candle in candlesticks]
-    yes_bid_low = [candle.yes_bid.low for candle in candlesticks]
-    yes_bid_close = [candle.yes_bid.close for candle in candlesticks]
+    yes_bid_open = candlesticks.bid_open
+    yes_bid_high = candlesticks.bid_high
+    yes_bid_low = candlesticks.bid_low
+    yes_bid_close = candlesticks.bid_close
 
     # Create Plotly figure with two candlestick traces
     fig = go.Figure()
@@ -64,18 +64,29 @@ class SimExchange(BaseExchangeInterface):
         # TODO: limitation: only returns daily markets on that day
         # that have the day in the event ticker
         # Also does not consider active markets that are beyond daily
-        series = self.db.get_series_tickers()
-        for s in series:
+        for m in self._get_market_tickers_for_day():
+            yield Market(
+                status=MarketStatus.ACTIVE,
+                ticker=m,
+                result=MarketResult.NOT_DETERMINED,
+                # TODO: not great, but I think this field is unused
+                close_time=datetime.combine(self.day, datetime.min.time()),
+            )
+
+    def _get_market_tickers_for_day(self) -> Generator[MarketTicker, None, None]:
+        """Market tickers that have the day at the end of their event ticker"""
+        day_suffix = self.day.strftime("%y%b%d").upper()
+        if self.db.catalog.complete:
+            # Avoids walking all of the folders
+            for entry in self.db.catalog.markets():
+                event_ticker = "-".join(entry.ticker.split("-")[:2])
+                if event_ticker.endswith(day_suffix):
+                    yield entry.ticker
+            return
+        for s in self.db.get_series_tickers():
             for e in self.db.get_event_tickers(s):
-                if e.endswith(self.day.strftime("%y%b%d").upper()):
-                    for m in self.db.get_market_tickers(e):
-                        yield Market(
-                            status=MarketStatus.ACTIVE,
-                            ticker=m,
-                            result=MarketResult.NOT_DETERMINED,
-                            # TODO: not great, but I think this field is unused
-                            close_time=datetime.combine(self.day, datetime.min.time()),
-                        )
+                if e.endswith(day_suffix):
+                    yield from self.db.get_market_tickers(e)
 
     def get_websocket(self) -> ContextManager[Websocket]:
         raise NotImplementedError()
@@ -90,14 +90,17 @@ def run_simple_passive_sim(m: MarketTicker, s: BaseStrategy):
     portfolio = PortfolioHistory(BalanceCents(100000))
     register_helper_functions(s, portfolio, pending_orders)
 
-    trades = e.get_trades(m)
     orderbook = db.read_raw(m)
 
-    trades_rm: Generator[TradeRM, None, None] = (trade_to_trade_rm(t) for t in trades)
+    trades_rm: Generator[TradeRM, None, None]
+    if db.trades_exist(m):
+        trades_rm = db.read_trades(m)
+    else:
+        trades_rm = (trade_to_trade_rm(t) for t in e.get_trades(m))
 
-    msgs: Generator[TradeRM | OrderbookSnapshotRM | OrderbookDeltaRM, None, None] = (
-        merge_historical_generators(trades_rm, orderbook, "created_time", "ts")
-    )
+    msgs: Generator[
+        TradeRM | OrderbookSnapshotRM | OrderbookDeltaRM, None, None
+    ] = merge_historical_generators(trades_rm, orderbook, "ts", "ts")
     # TODO: update portfolio on new orders
     # and make sure to store the OrderId for the fills
     # START HERE: making pending orders return Order Id's
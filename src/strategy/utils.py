@@ -588,7 +588,7 @@ def get_market_data_from_event_ticker(
         if not x.is_file()
     ]
 
-    return [db.read_df(ticker, nrows=nrows) for ticker in market_tickers]
+    return db.read_df_many(market_tickers, nrows=nrows)
 
 
 def merge_live_generators(gen1: Generator, gen2: Generator):
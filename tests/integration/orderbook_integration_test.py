@@ -33,8 +33,10 @@ def test_live_orderbook_reader(exchange_interface: ExchangeInterface):
 
 def test_collect_orderbook_data(exchange_interface: ExchangeInterface):
     mock_cole_db = MagicMock(spec=ColeDBInterface)
+    mock_cole_db.shard = None
     collect_orderbook_data(exchange_interface, cole=mock_cole_db)
     assert len(mock_cole_db.write.call_args_list) == 3
+    assert mock_cole_db.write_market_info.call_count > 0
 
 
 @pytest.mark.usefixtures("local_only")
@@ -1,25 +1,61 @@
+import gc
 import io
+import pickle
 import random
 import time
+import weakref
 from datetime import datetime, timedelta
 from io import BytesIO
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import pytest
 from mock import MagicMock, patch
 from pytz import timezone
 
 from data.coledb.coledb import (
+    COLEDB_ARRAY_DTYPE,
+    TRADE_DTYPE,
+    ChunkCompression,
     ColeBytes,
+    ColeDBCatalog,
+    ColeDBCatalogEntry,
+    ColeDBChunkCache,
+    ColeDBCursor,
     ColeDBInterface,
+    ColeDBLockedError,
     ColeDBMetadata,
+    ColeDBRowType,
+    ColeDBShard,
+    ColeDBWriter,
+    FsyncPolicy,
+    ReadonlyColeDB,
+    arrays_to_bbo,
+    arrays_to_orderbooks,
     get_num_byte_sections_per_bits,
+    orderbook_to_bbo_row,
+)
+from data.coledb.columnar import ColeDBColumnarStore
+from data.coledb.compaction import compact_market
+from data.coledb.rollups import (
+    BAR_COLUMNS,
+    ROLLUP_INTERVALS,
+    ColeDBRollupStore,
+    bbo_to_bars,
+)
+from helpers.types.markets import (
+    EventTicker,
+    Market,
+    MarketResult,
+    MarketStatus,
+    MarketTicker,
+    SeriesTicker,
 )
-from helpers.types.markets import EventTicker, MarketTicker, SeriesTicker
 from helpers.types.money import Price, get_opposite_side_price
 from helpers.types.orderbook import Orderbook, OrderbookSide, OrderbookView
 from helpers.types.orders import Quantity, QuantityDelta, Side
-from helpers.types.websockets.response import OrderbookSnapshotRM
+from helpers.types.websockets.response import OrderbookSnapshotRM, TradeRM
 from tests.fake_exchange import OrderbookDeltaRM
 
 
@@ -35,6 +71,88 @@ def test_read_write_metadata(tmp_path: Path):
     assert ColeDBMetadata.load(path) == ColeDBMetadata(path, [now], 5, 1000)
 
 
+def test_metadata_journal(tmp_path: Path):
+    path = tmp_path / "metadata"
+    metadata = ColeDBMetadata(path)
+    metadata.save()
+    first_ts = datetime(2023, 8, 9, 20, 31, 55, 123456).astimezone(ColeDBInterface.tz)
+    second_ts = first_ts + timedelta(hours=1, microseconds=1)
+
+    metadata.chunk_first_time_stamps.append(first_ts)
+    metadata.last_chunk_num = 1
+    for i in range(1, 4):
+        metadata.num_msgs_in_last_file = i
+        metadata.append_to_journal()
+    metadata.chunk_first_time_stamps.append(second_ts)
+    metadata.last_chunk_num = 2
+    metadata.num_msgs_in_last_file = 1
+    metadata.append_to_journal()
+
+    # The metadata file itself was not rewritten
+    assert pickle.loads(path.read_bytes()).last_chunk_num == 0
+    loaded = ColeDBMetadata.load(path)
+    assert loaded == ColeDBMetadata(path, [first_ts, second_ts], 2, 1)
+    assert loaded.num_journal_records == 4
+
+    # Partially written record at the end is ignored
+    with open(str(metadata.journal_path), "ab") as f:
+        f.write(b"123")
+    assert ColeDBMetadata.load(path) == loaded
+
+    # Compaction folds the journal into the metadata file
+    with patch.object(ColeDBMetadata, "max_journal_records", 5):
+        metadata.num_msgs_in_last_file = 2
+        metadata.append_to_journal()
+    assert not metadata.journal_path.exists()
+    assert pickle.loads(path.read_bytes()) == ColeDBMetadata(
+        path, [first_ts, second_ts], 2, 2
+    )
+    assert ColeDBMetadata.load(path) == ColeDBMetadata(
+        path, [first_ts, second_ts], 2, 2
+    )
+
+    # Records already in the metadata file are skipped when replaying
+    metadata.num_msgs_in_last_file = 1
+    metadata.append_to_journal()
+    assert ColeDBMetadata.load(path) == ColeDBMetadata(
+        path, [first_ts, second_ts], 2, 2
+    )
+
+
+def test_write_appends_to_metadata_journal(cole_db: ColeDBInterface):
+    ColeDBInterface.msgs_per_chunk = 5000
+    ticker = MarketTicker("TEST-METADATA-JOURNAL")
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    cole_db.write(
+        OrderbookSnapshotRM(
+            market_ticker=ticker,
+            yes=[[2, 100]],  # type:ignore[list-item]
+            no=[[1, 20]],  # type:ignore[list-item]
+            ts=now,
+        )
+    )
+    with patch.object(ColeDBMetadata, "save") as mock_save:
+        for i in range(1, 10):
+            cole_db.write(
+                OrderbookDeltaRM(
+                    market_ticker=ticker,
+                    price=Price(31),
+                    delta=QuantityDelta(1),
+                    side=Side.YES,
+                    ts=now + timedelta(seconds=i),
+                )
+            )
+    mock_save.assert_not_called()
+
+    metadata = cole_db.get_metadata(ticker)
+    assert metadata.journal_path.stat().st_size == 10 * 16
+    # A fresh reader sees all of the writes
+    assert ColeDBMetadata.load(metadata.path) == metadata
+    assert (
+        len(list(ColeDBInterface(cole_db.cole_db_storage_path).read_raw(ticker))) == 10
+    )
+
+
 def test_ticker_to_path(cole_db: ColeDBInterface):
     ticker = MarketTicker("SERIES-EVENT-MARKET")
     assert cole_db.ticker_to_path(ticker) == Path(
@@ -921,3 +1039,1443 @@ def test_read_raw_coledb(cole_db: ColeDBInterface):
     reader = cole_db.read_raw(ticker)
     assert next(reader) == snapshot
     assert next(reader) == delta
+
+
+def raw_msgs_to_rows(msgs) -> np.ndarray:
+    """Converts messages from read_raw into the rows that read_arrays returns"""
+    rows = []
+    for msg in msgs:
+        ts = msg.ts.timestamp()
+        if isinstance(msg, OrderbookSnapshotRM):
+            rows.append((ts, ColeDBRowType.SNAPSHOT, 0, 0, 0))
+            rows.extend((ts, ColeDBRowType.SNAPSHOT_LEVEL, 1, p, q) for p, q in msg.yes)
+            rows.extend((ts, ColeDBRowType.SNAPSHOT_LEVEL, 0, p, q) for p, q in msg.no)
+        else:
+            side = 1 if msg.side == Side.YES else 0
+            rows.append((ts, ColeDBRowType.DELTA, side, msg.price, msg.delta))
+    return np.array(rows, dtype=COLEDB_ARRAY_DTYPE)
+
+
+def assert_rows_equal(actual: np.ndarray, expected: np.ndarray):
+    assert actual.dtype == COLEDB_ARRAY_DTYPE
+    assert len(actual) == len(expected)
+    # Timestamps go through a float conversion
+    assert np.allclose(actual["ts"], expected["ts"])
+    for column in ("type", "side", "price", "delta"):
+        assert (actual[column] == expected[column]).all()
+
+
+def test_read_arrays_backward_compatibility():
+    cole_db = ColeDBInterface(storage_path=Path("tests/data/coledb"))
+    ticker = MarketTicker("INXD-23AUG31-B4512")
+    assert_rows_equal(
+        cole_db.read_arrays(ticker), raw_msgs_to_rows(cole_db.read_raw(ticker))
+    )
+
+    start_ts = datetime(2023, 8, 31, 10, 30).astimezone(ColeDBInterface.tz)
+    end_ts = datetime(2023, 8, 31, 11, 30).astimezone(ColeDBInterface.tz)
+    expected = raw_msgs_to_rows(cole_db.read_raw(ticker, start_ts, end_ts))
+    assert len(expected) > 0
+    assert_rows_equal(cole_db.read_arrays(ticker, start_ts, end_ts), expected)
+
+
+def test_read_arrays(cole_db: ColeDBInterface):
+    ColeDBInterface.msgs_per_chunk = 3
+    ticker = MarketTicker("TEST-READ-ARRAYS")
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    msgs: list[OrderbookSnapshotRM | OrderbookDeltaRM] = [
+        OrderbookSnapshotRM(
+            market_ticker=ticker,
+            yes=[[2, 100], [5, 1 << 31]],  # type:ignore[list-item]
+            no=[[1, 20]],  # type:ignore[list-item]
+            ts=now,
+        )
+    ]
+    for i in range(1, 10):
+        msgs.append(
+            OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(10 + i),
+                delta=QuantityDelta(random.randint(1, 1 << 30)),
+                side=Side.YES if i % 2 else Side.NO,
+                ts=msgs[-1].ts + timedelta(seconds=random.randint(1, 10000)),
+            )
+        )
+        msgs.append(
+            OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(10 + i),
+                delta=QuantityDelta(-1 * msgs[-1].delta),  # type:ignore[union-attr]
+                side=msgs[-1].side,  # type:ignore[union-attr]
+                ts=msgs[-1].ts,
+            )
+        )
+    # Snapshot in the middle of a chunk
+    msgs.append(
+        OrderbookSnapshotRM(
+            market_ticker=ticker,
+            yes=[],
+            no=[[50, 3]],  # type:ignore[list-item]
+            ts=msgs[-1].ts + timedelta(seconds=1),
+        )
+    )
+    for msg in msgs:
+        cole_db.write(msg)
+
+    assert_rows_equal(
+        cole_db.read_arrays(ticker), raw_msgs_to_rows(cole_db.read_raw(ticker))
+    )
+    start_ts = msgs[3].ts
+    end_ts = msgs[-4].ts
+    assert_rows_equal(
+        cole_db.read_arrays(ticker, start_ts, end_ts),
+        raw_msgs_to_rows(cole_db.read_raw(ticker, start_ts, end_ts)),
+    )
+    assert len(cole_db.read_arrays(ticker, end_ts=now - timedelta(days=1))) == 0
+
+
+def test_read_seeks_to_start_chunk(cole_db: ColeDBInterface):
+    """Reading a narrow window should open the same number of chunks
+    no matter how much history the market has"""
+    ColeDBInterface.msgs_per_chunk = 10
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+
+    num_chunks_opened = []
+    for num_msgs in (50, 1000):
+        ticker = MarketTicker(f"TEST-SEEK-HISTORY{num_msgs}")
+        cole_db.write(
+            OrderbookSnapshotRM(
+                market_ticker=ticker,
+                yes=[[2, 100]],  # type:ignore[list-item]
+                no=[[1, 20]],  # type:ignore[list-item]
+                ts=now,
+            )
+        )
+        for i in range(1, num_msgs):
+            cole_db.write(
+                OrderbookDeltaRM(
+                    market_ticker=ticker,
+                    price=Price(31),
+                    delta=QuantityDelta(1),
+                    side=Side.YES,
+                    ts=now + timedelta(seconds=i),
+                )
+            )
+        # Last few seconds of the history
+        start_ts = now + timedelta(seconds=num_msgs - 5)
+        end_ts = now + timedelta(seconds=num_msgs - 2)
+        with patch.object(
+            ColeDBInterface,
+            "_read_chunk_apply_deltas_generator",
+            wraps=ColeDBInterface._read_chunk_apply_deltas_generator,
+        ) as mock_generator:
+            # The reader re-uses the same orderbook object, so copy out values
+            books = [
+                (ob.ts, ob.yes.levels[Price(31)])
+                for ob in cole_db.read(ticker, start_ts=start_ts, end_ts=end_ts)
+            ]
+        num_chunks_opened.append(mock_generator.call_count)
+        assert books == [
+            (now + timedelta(seconds=i), i) for i in range(num_msgs - 5, num_msgs - 1)
+        ]
+
+        # Before the first chunk, we start from the beginning
+        assert next(cole_db.read(ticker, start_ts=now - timedelta(days=1))).ts == now
+
+    assert num_chunks_opened[0] == num_chunks_opened[1] == 1
+
+
+def test_read_start_ts_on_chunk_boundary(cole_db: ColeDBInterface):
+    ColeDBInterface.msgs_per_chunk = 3
+    ticker = MarketTicker("TEST-SEEK-BOUNDARY")
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    cole_db.write(
+        OrderbookSnapshotRM(
+            market_ticker=ticker,
+            yes=[[2, 100]],  # type:ignore[list-item]
+            no=[[1, 20]],  # type:ignore[list-item]
+            ts=now,
+        )
+    )
+    # The second chunk starts at the same ts as the end of the first chunk
+    for seconds in (1, 2, 2, 2, 3):
+        cole_db.write(
+            OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(31),
+                delta=QuantityDelta(1),
+                side=Side.YES,
+                ts=now + timedelta(seconds=seconds),
+            )
+        )
+    boundary_ts = now + timedelta(seconds=2)
+    assert cole_db.get_metadata(ticker).chunk_first_time_stamps[1] == boundary_ts
+    assert [msg.ts for msg in cole_db.read_raw(ticker, start_ts=boundary_ts)] == [
+        boundary_ts
+    ] * 3 + [now + timedelta(seconds=3)]
+    assert [
+        ob.yes.levels[Price(31)] for ob in cole_db.read(ticker, start_ts=boundary_ts)
+    ] == [2, 3, 4, 5]
+    rows = cole_db.read_arrays(ticker, start_ts=boundary_ts)
+    assert (rows["type"] != ColeDBRowType.SNAPSHOT_LEVEL).sum() == 4
+
+
+def test_read_with_chunk_index(cole_db: ColeDBInterface):
+    ColeDBInterface.msgs_per_chunk = 50
+    ticker = MarketTicker("TEST-CHUNK-INDEX")
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    cole_db.write(
+        OrderbookSnapshotRM(
+            market_ticker=ticker,
+            yes=[[2, 100]],  # type:ignore[list-item]
+            no=[[1, 20]],  # type:ignore[list-item]
+            ts=now,
+        )
+    )
+    for i in range(1, 120):
+        cole_db.write(
+            OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(random.randint(3, 50)),
+                delta=QuantityDelta(random.randint(1, 100)),
+                side=Side.YES,
+                ts=now + timedelta(seconds=i),
+            )
+        )
+
+    def read_all(start_ts, end_ts):
+        books = [
+            Orderbook.from_snapshot(OrderbookSnapshotRM.from_orderbook(ob))
+            for ob in cole_db.read(ticker, start_ts, end_ts)
+        ]
+        raw = list(cole_db.read_raw(ticker, start_ts, end_ts))
+        arrays = cole_db.read_arrays(ticker, start_ts, end_ts)
+        return books, raw, arrays
+
+    windows = [
+        (now + timedelta(seconds=start), now + timedelta(seconds=end))
+        for start, end in ((0, 5), (3, 30), (13, 14), (20, 80), (99, 200))
+    ]
+    expected = [read_all(start_ts, end_ts) for start_ts, end_ts in windows]
+
+    cole_db.build_index(ticker, msgs_per_checkpoint=7)
+    metadata = cole_db.get_metadata(ticker)
+    for chunk_num in range(1, metadata.last_chunk_num + 1):
+        assert ColeDBInterface.chunk_to_index_path(
+            metadata.path_to_market_data / str(chunk_num)
+        ).exists()
+
+    checkpoints = []
+    find_checkpoint = ColeDBInterface._find_checkpoint
+
+    def record_checkpoint(*args):
+        checkpoint = find_checkpoint(*args)
+        checkpoints.append(checkpoint)
+        return checkpoint
+
+    with patch.object(
+        ColeDBInterface, "_find_checkpoint", side_effect=record_checkpoint
+    ):
+        for (start_ts, end_ts), (books, raw, arrays) in zip(windows, expected):
+            actual_books, actual_raw, actual_arrays = read_all(start_ts, end_ts)
+            assert actual_books == books
+            assert [ob.ts for ob in actual_books] == [ob.ts for ob in books]
+            assert actual_raw == raw
+            assert_rows_equal(actual_arrays, arrays)
+    assert len([c for c in checkpoints if c is not None]) > 0
+
+
+def generate_msgs(ticker: MarketTicker, num_msgs: int):
+    """Generates a snapshot followed by deltas one second apart"""
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    msgs: list[OrderbookSnapshotRM | OrderbookDeltaRM] = [
+        OrderbookSnapshotRM(
+            market_ticker=ticker,
+            yes=[[2, 100]],  # type:ignore[list-item]
+            no=[[1, 20]],  # type:ignore[list-item]
+            ts=now,
+        )
+    ]
+    for i in range(1, num_msgs):
+        msgs.append(
+            OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(random.randint(3, 50)),
+                delta=QuantityDelta(random.randint(1, 100)),
+                side=Side.YES,
+                ts=now + timedelta(seconds=i),
+            )
+        )
+    return msgs
+
+
+def test_coledb_writer_buffers_writes(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 4
+    ticker = MarketTicker("TEST-WRITER-BUFFER")
+    msgs = generate_msgs(ticker, 11)
+    unbuffered = ColeDBInterface(storage_path=tmp_path / "unbuffered")
+    for msg in msgs:
+        unbuffered.write(msg)
+    reader = ColeDBInterface(storage_path=tmp_path / "buffered")
+    with ColeDBWriter(
+        storage_path=tmp_path / "buffered",
+        max_buffer_bytes=1 << 20,
+        max_buffer_age=timedelta(days=1),
+    ) as writer:
+        for msg in msgs:
+            writer.write(msg)
+        metadata = writer.get_metadata(ticker)
+        assert metadata.last_chunk_num == 3
+        # The last chunk only has data in memory
+        assert metadata.path_to_last_chunk.stat().st_size == 0
+        assert len(list(reader.read_raw(ticker))) == 8
+
+        # Reading through the writer flushes first
+        assert list(writer.read_raw(ticker)) == list(unbuffered.read_raw(ticker))
+        assert (
+            len(list(ColeDBInterface(reader.cole_db_storage_path).read_raw(ticker)))
+            == 11
+        )
+
+        writer.write(
+            OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(31),
+                delta=QuantityDelta(1),
+                side=Side.YES,
+                ts=msgs[-1].ts,
+            )
+        )
+    # Flushed on exit
+    assert (
+        len(list(ColeDBInterface(reader.cole_db_storage_path).read_raw(ticker))) == 12
+    )
+    assert len(writer._open_chunk_files) == 0
+
+
+def test_coledb_writer_flush_thresholds(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 5000
+    ticker = MarketTicker("TEST-WRITER-THRESHOLDS")
+    msgs = generate_msgs(ticker, 10)
+
+    # Flushes once the buffer is large enough
+    writer = ColeDBWriter(
+        storage_path=tmp_path, max_buffer_bytes=1, max_buffer_age=timedelta(days=1)
+    )
+    with patch("data.coledb.coledb.os.fsync") as mock_fsync:
+        for msg in msgs:
+            writer.write(msg)
+            assert len(writer._buffers) == 0
+    mock_fsync.assert_not_called()
+    writer.close()
+
+    # Flushes once the buffer is old enough
+    ticker = MarketTicker("TEST-WRITER-AGE")
+    msgs = generate_msgs(ticker, 3)
+    with patch("data.coledb.coledb.time.monotonic") as mock_monotonic:
+        mock_monotonic.return_value = 0
+        writer = ColeDBWriter(
+            storage_path=tmp_path,
+            max_buffer_age=timedelta(seconds=1),
+            fsync=FsyncPolicy.FLUSH,
+        )
+        with patch("data.coledb.coledb.os.fsync") as mock_fsync:
+            writer.write(msgs[0])
+            writer.write(msgs[1])
+            assert len(writer._buffers[ticker]) > 0
+            mock_monotonic.return_value = 1
+            writer.write(msgs[2])
+            assert len(writer._buffers) == 0
+        mock_fsync.assert_called_once()
+    writer.close()
+    assert list(ColeDBInterface(storage_path=tmp_path).read_raw(ticker)) == msgs
+
+
+def test_coledb_writer_file_pool(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 5000
+    tickers = [MarketTicker(f"TEST-WRITER-POOL{i}") for i in range(3)]
+    all_msgs = [generate_msgs(ticker, 5) for ticker in tickers]
+    with ColeDBWriter(
+        storage_path=tmp_path, max_buffer_bytes=1, max_open_files=2
+    ) as writer:
+        for msgs in zip(*all_msgs):
+            for msg in msgs:
+                writer.write(msg)
+                assert len(writer._open_chunk_files) <= 2
+    for ticker, msgs in zip(tickers, all_msgs):
+        assert list(ColeDBInterface(storage_path=tmp_path).read_raw(ticker)) == msgs
+
+
+def test_chunk_rollover_uses_in_memory_orderbook(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 3
+    ticker = MarketTicker("TEST-ROLLOVER-INMEMORY")
+    msgs = generate_msgs(ticker, 10)
+    cole_db = ColeDBInterface(storage_path=tmp_path)
+    with patch.object(
+        ColeDBInterface,
+        "_read_chunk_apply_deltas",
+        wraps=ColeDBInterface._read_chunk_apply_deltas,
+    ) as mock_read_chunk:
+        for msg in msgs[:7]:
+            cole_db.write(msg)
+        mock_read_chunk.assert_not_called()
+
+        # Cold start: we only read the last chunk from disk once
+        cole_db = ColeDBInterface(storage_path=tmp_path)
+        for msg in msgs[7:]:
+            cole_db.write(msg)
+        mock_read_chunk.assert_called_once()
+        cole_db.write(
+            OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(31),
+                delta=QuantityDelta(1),
+                side=Side.YES,
+                ts=msgs[-1].ts,
+            )
+        )
+        mock_read_chunk.assert_called_once()
+
+    expected = Orderbook.from_snapshot(msgs[0])  # type:ignore[arg-type]
+    num_chunks = 0
+    for msg, orderbook in zip(msgs[1:], list(cole_db.read_raw(ticker))[1:]):
+        expected = expected.apply_delta(msg)  # type:ignore[arg-type]
+        if isinstance(orderbook, OrderbookSnapshotRM):
+            num_chunks += 1
+            assert Orderbook.from_snapshot(orderbook) == expected
+    assert num_chunks == 3
+    assert cole_db._last_orderbooks[ticker] == expected.apply_delta(
+        OrderbookDeltaRM(
+            market_ticker=ticker,
+            price=Price(31),
+            delta=QuantityDelta(1),
+            side=Side.YES,
+            ts=msgs[-1].ts,
+        )
+    )
+
+
+def test_read_many(cole_db: ColeDBInterface):
+    ColeDBInterface.msgs_per_chunk = 3
+    tickers = [MarketTicker(f"TEST-READ-MANY-{i}") for i in range(3)]
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    expected_raw: list[
+        tuple[datetime, int, MarketTicker, OrderbookSnapshotRM | OrderbookDeltaRM]
+    ] = []
+    for i, ticker in enumerate(tickers):
+        snapshot = OrderbookSnapshotRM(
+            market_ticker=ticker,
+            yes=[[2, 100]],  # type:ignore[list-item]
+            no=[[1, 20]],  # type:ignore[list-item]
+            ts=now,
+        )
+        cole_db.write(snapshot)
+        expected_raw.append((now, i, ticker, snapshot))
+        # Each ticker gets messages at different times
+        for j in range(1, 6):
+            delta = OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(31),
+                delta=QuantityDelta(j),
+                side=Side.YES,
+                ts=now + timedelta(seconds=j * (i + 1)),
+            )
+            cole_db.write(delta)
+            expected_raw.append((delta.ts, i, ticker, delta))
+    expected_raw.sort(key=lambda x: (x[0], x[1]))
+
+    actual_raw = list(cole_db.read_many(tickers, read_raw=True))
+    # Rollover turns deltas into snapshots, so compare against read_raw
+    per_ticker_raw = {ticker: list(cole_db.read_raw(ticker)) for ticker in tickers}
+    assert [(t, m.ts) for t, m in actual_raw] == [
+        (t, m.ts) for _, _, t, m in expected_raw
+    ]
+    for ticker in tickers:
+        assert [m for t, m in actual_raw if t == ticker] == per_ticker_raw[ticker]
+
+    # Orderbooks in a window
+    start_ts = now + timedelta(seconds=2)
+    end_ts = now + timedelta(seconds=6)
+    actual_books = []
+    for ticker, ob in cole_db.read_many(tickers, start_ts, end_ts):
+        assert isinstance(ob, Orderbook)
+        actual_books.append((ticker, ob.ts, ob.yes.levels.get(Price(31))))
+    expected_books = []
+    for _, i, ticker, msg in expected_raw:
+        if start_ts <= msg.ts <= end_ts:
+            j = round((msg.ts - now).total_seconds()) // (i + 1)
+            expected_books.append((ticker, msg.ts, j * (j + 1) // 2))
+    assert actual_books == expected_books
+
+
+def test_arrays_to_orderbooks(cole_db: ColeDBInterface):
+    ColeDBInterface.msgs_per_chunk = 5
+    ticker = MarketTicker("TEST-ARRAYS-TO-ORDERBOOKS")
+    msgs = generate_msgs(ticker, 12)
+    # Remove a level completely
+    msgs.append(
+        OrderbookDeltaRM(
+            market_ticker=ticker,
+            price=Price(1),
+            delta=QuantityDelta(-20),
+            side=Side.NO,
+            ts=msgs[-1].ts + timedelta(seconds=1),
+        )
+    )
+    for msg in msgs:
+        cole_db.write(msg)
+
+    expected_df = cole_db.read_df(ticker)
+    ts, books = arrays_to_orderbooks(cole_db.read_arrays(ticker))
+    assert len(ts) == len(msgs)
+    assert np.array_equal(ts, expected_df["ts"].to_numpy())
+    assert np.array_equal(
+        np.where(books == 0, np.nan, books),
+        expected_df.drop(columns="ts").to_numpy(),
+        equal_nan=True,
+    )
+    # Each chunk replays on its own
+    ts, books = arrays_to_orderbooks(cole_db.read_chunk_arrays(ticker, 2))
+    assert np.array_equal(ts, expected_df["ts"].to_numpy()[5:10])
+
+    with pytest.raises(ValueError):
+        arrays_to_orderbooks(cole_db.read_arrays(ticker)[1:])
+
+
+def test_columnar_store(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 5
+    ticker = MarketTicker("TEST-COLUMNAR-STORE")
+    cole_db = ColeDBInterface(storage_path=tmp_path / "coledb")
+    store = ColeDBColumnarStore(cole_db, storage_path=tmp_path / "columnar")
+    msgs = generate_msgs(ticker, 23)
+    for msg in msgs[:7]:
+        cole_db.write(msg)
+    assert store.export(ticker) == 7
+    assert store.export(ticker) == 0
+    pd.testing.assert_frame_equal(store.load_df(ticker), cole_db.read_df(ticker))
+
+    # Only appends the new messages, even if another interface (like the
+    # collector) wrote them
+    other_db = ColeDBInterface(storage_path=tmp_path / "coledb")
+    for msg in msgs[7:]:
+        other_db.write(msg)
+    assert store.export_series(SeriesTicker("TEST")) == 16
+    cole_db = ColeDBInterface(storage_path=tmp_path / "coledb")
+    pd.testing.assert_frame_equal(store.load_df(ticker), cole_db.read_df(ticker))
+    start_ts = msgs[3].ts
+    end_ts = msgs[12].ts
+    pd.testing.assert_frame_equal(
+        store.load_df(ticker, start_ts, end_ts),
+        cole_db.read_df(ticker, start_ts, end_ts),
+    )
+
+    # Partial writes after the last export are dropped
+    with open(store.ticker_to_path(ticker) / "ts", "ab") as f:
+        f.write(b"garbage")
+    assert store.export(ticker) == 0
+    assert (store.ticker_to_path(ticker) / "ts").stat().st_size == 23 * 8
+    ts, books = store.load(ticker)
+    assert books.shape == (23, 198)
+
+
+def test_read_df_many(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 5
+    cole_db = ColeDBInterface(storage_path=tmp_path)
+    tickers = [MarketTicker(f"TEST-READ-DF-MANY-{i}") for i in range(3)]
+    for i, ticker in enumerate(tickers):
+        for msg in generate_msgs(ticker, 4 * (i + 1)):
+            cole_db.write(msg)
+
+    actual = cole_db.read_df_many(tickers, workers=2)
+    assert len(actual) == len(tickers)
+    for ticker, df in zip(tickers, actual):
+        pd.testing.assert_frame_equal(df, cole_db.read_df(ticker))
+
+    start_ts = datetime.fromtimestamp(1704042451 + 2).astimezone(ColeDBInterface.tz)
+    actual = cole_db.read_df_many(tickers, start_ts=start_ts, nrows=3, workers=2)
+    for ticker, df in zip(tickers, actual):
+        pd.testing.assert_frame_equal(
+            df, cole_db.read_df(ticker, start_ts=start_ts, nrows=3)
+        )
+
+    # Nothing to read
+    end_ts = datetime.fromtimestamp(1704042451 - 1).astimezone(ColeDBInterface.tz)
+    actual = cole_db.read_df_many(tickers, end_ts=end_ts, workers=2)
+    assert all(len(df) == 0 for df in actual)
+
+
+def test_cole_bytes_memoryview():
+    buffer = bytes([0b10110011, 0b01010101]) * 10
+    file_bits = ColeBytes(io.BytesIO(buffer))
+    view_bits = ColeBytes(memoryview(buffer))
+    for size in [3, 5, 8, 1, 7, 16, 40, 2]:
+        assert file_bits.read(size) == view_bits.read(size)
+        assert file_bits.byte_offset == view_bits.byte_offset
+    with pytest.raises(EOFError):
+        view_bits.read(80)
+
+    # Starting at an offset
+    view_bits = ColeBytes(memoryview(buffer), offset=1)
+    assert view_bits.read(8) == 0b01010101
+    assert view_bits.byte_offset == 2
+
+
+def test_read_empty_chunk(tmp_path: Path):
+    (tmp_path / "1").touch()
+    with ColeDBInterface._map_chunk(tmp_path / "1") as chunk:
+        assert len(chunk) == 0
+    assert (
+        list(
+            ColeDBInterface._read_chunk_apply_deltas_generator(
+                tmp_path / "1", MarketTicker("TEST-EMPTY-CHUNK"), datetime.now()
+            )
+        )
+        == []
+    )
+
+
+def test_chunk_cache():
+    cache = ColeDBChunkCache(max_bytes=3 * 10 * COLEDB_ARRAY_DTYPE.itemsize)
+    ticker = MarketTicker("TEST-CHUNK-CACHE")
+
+    def rows():
+        return np.zeros(10, dtype=COLEDB_ARRAY_DTYPE)
+
+    assert cache.get(ticker, 1, 100) is None
+    for chunk_num in range(1, 4):
+        cache.put(ticker, chunk_num, 100, rows())
+    assert cache.get(ticker, 1, 100) is not None
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Chunk 2 is the least recently used
+    cache.put(ticker, 4, 100, rows())
+    assert cache.evictions == 1
+    assert cache.get(ticker, 2, 100) is None
+    assert len(cache) == 3
+    assert cache.num_bytes == cache.max_bytes
+    # The chunk file grew
+    assert cache.get(ticker, 4, 200) is None
+    # Too large to cache
+    cache.put(ticker, 5, 100, np.zeros(31, dtype=COLEDB_ARRAY_DTYPE))
+    assert cache.get(ticker, 5, 100) is None
+    assert len(cache) == 3
+    cache.clear()
+    assert len(cache) == 0 and cache.num_bytes == 0
+
+
+def test_read_with_chunk_cache(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 5
+    ticker = MarketTicker("TEST-READ-CHUNK-CACHE")
+    uncached = ColeDBInterface(storage_path=tmp_path)
+    cache = ColeDBChunkCache()
+    cached = ColeDBInterface(storage_path=tmp_path, chunk_cache=cache)
+    msgs = generate_msgs(ticker, 12)
+    for msg in msgs:
+        uncached.write(msg)
+
+    def books(db: ColeDBInterface, start_ts=None, end_ts=None):
+        return [
+            (ob.ts, ob.yes.levels.copy(), ob.no.levels.copy())
+            for ob in db.read(ticker, start_ts, end_ts)
+        ]
+
+    assert list(cached.read_raw(ticker)) == list(uncached.read_raw(ticker))
+    assert books(cached) == books(uncached)
+    assert (cache.hits, cache.misses) == (3, 3)
+    start_ts = msgs[3].ts
+    end_ts = msgs[8].ts
+    assert books(cached, start_ts, end_ts) == books(uncached, start_ts, end_ts)
+    assert np.array_equal(
+        cached.read_arrays(ticker, start_ts, end_ts),
+        uncached.read_arrays(ticker, start_ts, end_ts),
+    )
+
+    # Repeated cursor passes don't decode again
+    cursor = ColeDBCursor(cached, ticker)
+    with patch.object(
+        ColeDBInterface,
+        "_decode_chunk_to_arrays",
+        side_effect=AssertionError("should be cached"),
+    ):
+        assert len(list(cursor)) == len(list(cursor)) == len(msgs)
+
+    # The last chunk grew, so we decode it again
+    delta = OrderbookDeltaRM(
+        market_ticker=ticker,
+        price=Price(1),
+        delta=QuantityDelta(5),
+        side=Side.NO,
+        ts=msgs[-1].ts + timedelta(seconds=1),
+    )
+    uncached.write(delta)
+    misses = cache.misses
+    assert list(cached.read_raw(ticker))[-1] == delta
+    assert cache.misses == misses + 1
+
+
+def test_catalog(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(ColeDBCatalog, "max_journal_records", 3)
+    catalog = ColeDBCatalog(tmp_path)
+    assert len(catalog) == 0
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    entries = [
+        ColeDBCatalogEntry(
+            ticker=MarketTicker(f"SERIES{i % 2}-EVENT-MARKET{i}"),
+            first_ts=now + timedelta(days=i),
+            last_ts=now + timedelta(days=i, hours=1),
+            num_msgs=i,
+            num_chunks=1,
+            num_bytes=100 * i,
+        )
+        for i in range(5)
+    ]
+    for entry in entries:
+        catalog.update(entry)
+    # The first 3 were compacted into the catalog file
+    assert catalog.num_journal_records == 2
+    assert ColeDBCatalog(tmp_path).entries == catalog.entries
+
+    # Partially written record at the end of the journal
+    with open(catalog.journal_path, "ab") as f:
+        f.write(b"\x00\x05ABC")
+    assert ColeDBCatalog(tmp_path).entries == catalog.entries
+
+    assert catalog.markets(SeriesTicker("SERIES1")) == [entries[1], entries[3]]
+    assert catalog.markets(
+        start_ts=now + timedelta(days=1, minutes=30),
+        end_ts=now + timedelta(days=3),
+    ) == [entries[2], entries[1], entries[3]]
+
+
+def test_writer_updates_catalog(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 4
+    tickers = [MarketTicker(f"SERIES-EVENT-CATALOG{i}") for i in range(2)]
+    # One market already has data before the writer starts
+    for msg in generate_msgs(tickers[0], 6):
+        ColeDBInterface(storage_path=tmp_path).write(msg)
+    with ColeDBWriter(storage_path=tmp_path, max_buffer_bytes=10) as writer:
+        for ticker in tickers:
+            msgs = generate_msgs(ticker, 17)
+            first_ts = msgs[0].ts
+            if ticker == tickers[0]:
+                # Continue after the messages that are already there
+                for msg in msgs:
+                    msg.ts += timedelta(seconds=6)
+            for msg in msgs:
+                writer.write(msg)
+
+    catalog = ColeDBCatalog(tmp_path)
+    (tmp_path / "other").mkdir()
+    expected = ColeDBCatalog(tmp_path / "other")
+    expected.rebuild(ColeDBInterface(storage_path=tmp_path))
+    assert catalog.entries == expected.entries
+    assert catalog.get(tickers[0]).num_msgs == 23  # type:ignore[union-attr]
+    assert catalog.get(tickers[1]).first_ts == first_ts  # type:ignore[union-attr]
+    assert catalog.get(tickers[1]).last_ts == msgs[-1].ts  # type:ignore[union-attr]
+
+    # Each flush appends to the catalog journal once, no matter how many
+    # markets it flushes
+    with ColeDBWriter(storage_path=tmp_path, max_buffer_bytes=1000) as writer:
+        for ticker in tickers:
+            writer.write(
+                OrderbookDeltaRM(
+                    market_ticker=ticker,
+                    price=Price(1),
+                    delta=QuantityDelta(5),
+                    side=Side.NO,
+                    ts=msgs[-1].ts + timedelta(minutes=1),
+                )
+            )
+        with patch.object(
+            writer.catalog, "update_many", wraps=writer.catalog.update_many
+        ) as update_many:
+            writer.flush()
+        assert update_many.call_count == 1
+    assert ColeDBCatalog(tmp_path).entries == writer.catalog.entries
+
+
+def test_catalog_complete(tmp_path: Path):
+    tickers = [MarketTicker(f"SERIES-EVENT-COMPLETE{i}") for i in range(3)]
+    # Written before the catalog existed
+    ColeDBInterface(storage_path=tmp_path).write(generate_msgs(tickers[0], 1)[0])
+    with ColeDBWriter(storage_path=tmp_path) as writer:
+        writer.write(generate_msgs(tickers[1], 1)[0])
+    catalog = ColeDBCatalog(tmp_path)
+    assert [entry.ticker for entry in catalog.markets()] == [tickers[1]]
+    assert not catalog.complete
+
+    catalog.rebuild(ColeDBInterface(storage_path=tmp_path))
+    assert ColeDBCatalog(tmp_path).complete
+    assert [entry.ticker for entry in catalog.markets()] == tickers[:2]
+    # The writer keeps the catalog complete, but the base interface doesn't
+    with ColeDBWriter(storage_path=tmp_path) as writer:
+        writer.write(generate_msgs(tickers[2], 1)[0])
+    assert ColeDBCatalog(tmp_path).complete
+    ColeDBInterface(storage_path=tmp_path).write(
+        generate_msgs(MarketTicker("SERIES-EVENT-OTHER"), 1)[0]
+    )
+    assert not ColeDBCatalog(tmp_path).complete
+
+    # Plain writes to markets that the catalog has make its entries stale
+    catalog.rebuild(ColeDBInterface(storage_path=tmp_path))
+    assert ColeDBCatalog(tmp_path).complete
+    ColeDBInterface(storage_path=tmp_path).write(
+        OrderbookDeltaRM(
+            market_ticker=tickers[0],
+            price=Price(1),
+            delta=QuantityDelta(5),
+            side=Side.NO,
+            ts=datetime.fromtimestamp(1704042452).astimezone(ColeDBInterface.tz),
+        )
+    )
+    assert not ColeDBCatalog(tmp_path).complete
+
+
+def test_read_write_market_info(tmp_path: Path):
+    cole_db = ColeDBInterface(storage_path=tmp_path)
+    ticker = MarketTicker("SERIES-EVENT-MARKETINFO")
+    assert not cole_db.market_info_exists(ticker)
+    with pytest.raises(FileNotFoundError):
+        cole_db.read_market_info(ticker)
+    market = Market(
+        status=MarketStatus.SETTLED,
+        ticker=ticker,
+        result=MarketResult.YES,
+        close_time=datetime(2024, 1, 2, 16, tzinfo=ColeDBInterface.tz),
+        strike_type="between",
+        floor_strike=4500,
+        cap_strike=4524.99,
+    )
+    cole_db.write_market_info(market)
+    assert cole_db.market_info_exists(ticker)
+    assert cole_db.read_market_info(ticker) == market
+    # A market with info but no data is not in the db
+    assert not cole_db.ticker_exists(ticker)
+    assert list(cole_db.get_market_tickers(EventTicker("SERIES-EVENT"))) == []
+
+    with pytest.raises(NotImplementedError):
+        ReadonlyColeDB(storage_path=tmp_path).write_market_info(market)
+
+    # Like the other writes, we only write the markets in our shard
+    shard = ColeDBShard(0, 2)
+    other_shard_market = next(
+        market.model_copy(update={"ticker": MarketTicker(f"SERIES-EVENT-INFO{i}")})
+        for i in range(10)
+        if not shard.owns(MarketTicker(f"SERIES-EVENT-INFO{i}"))
+    )
+    with pytest.raises(ValueError):
+        ColeDBInterface(storage_path=tmp_path, shard=shard).write_market_info(
+            other_shard_market
+        )
+    assert not cole_db.market_info_exists(other_shard_market.ticker)
+    # Writers don't write the info of markets that another writer has locked
+    with ColeDBWriter(storage_path=tmp_path) as writer:
+        writer.lock_market(ticker)
+        with ColeDBWriter(storage_path=tmp_path) as other:
+            with pytest.raises(ColeDBLockedError):
+                other.write_market_info(market)
+
+
+def test_read_write_trades(tmp_path: Path):
+    cole_db = ColeDBInterface(storage_path=tmp_path)
+    ticker = MarketTicker("SERIES-EVENT-TRADES")
+    assert not cole_db.trades_exist(ticker)
+    assert list(cole_db.read_trades(ticker)) == []
+    trades = [
+        TradeRM(
+            market_ticker=ticker,
+            yes_price=Price(i + 1),
+            no_price=Price(99 - i),
+            count=Quantity(1000 * i),
+            taker_side=Side.YES if i % 2 else Side.NO,
+            ts=1704042451 + (i // 2),
+        )
+        for i in range(10)
+    ]
+    for trade in trades:
+        cole_db.write_trade(trade)
+    assert cole_db.trades_exist(ticker)
+    assert list(cole_db.read_trades(ticker)) == trades
+    assert (
+        cole_db.ticker_to_trades_path(ticker).stat().st_size
+        == len(trades) * TRADE_DTYPE.itemsize
+    )
+
+    # Seek by time
+    start_ts = datetime.fromtimestamp(1704042452, ColeDBInterface.tz)
+    end_ts = datetime.fromtimestamp(1704042453.5, ColeDBInterface.tz)
+    assert list(cole_db.read_trades(ticker, start_ts, end_ts)) == trades[2:6]
+    assert list(cole_db.read_trades(ticker, start_ts=end_ts)) == trades[6:]
+
+    # Trades must be in order, even after we reopen the db
+    cole_db.close()
+    reopened_db = ColeDBInterface(storage_path=tmp_path)
+    with pytest.raises(ValueError):
+        reopened_db.write_trade(trades[0])
+    reopened_db.close()
+
+    # Partially written trade at the end
+    with open(cole_db.ticker_to_trades_path(ticker), "ab") as f:
+        f.write(b"\x00\x01")
+    assert list(cole_db.read_trades(ticker)) == trades
+    other_db = ColeDBInterface(storage_path=tmp_path)
+    other_db.write_trade(trades[-1])
+    assert list(other_db.read_trades(ticker)) == trades + [trades[-1]]
+
+    with pytest.raises(NotImplementedError):
+        ReadonlyColeDB(storage_path=tmp_path).write_trade(trades[-1])
+
+
+def test_follow(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 4
+    tickers = [MarketTicker(f"SERIES-EVENT-FOLLOW{i}") for i in range(2)]
+    msgs = {ticker: generate_msgs(ticker, 14) for ticker in tickers}
+    cole_db = ColeDBInterface(storage_path=tmp_path)
+    # Only the first market exists when we start following
+    for msg in msgs[tickers[0]][:6]:
+        cole_db.write(msg)
+    follower = ReadonlyColeDB(storage_path=tmp_path)
+    followed = follower.follow(tickers, read_raw=True)
+
+    # Rolls over into a new chunk, which starts with a snapshot
+    for msg in msgs[tickers[0]][6:9]:
+        cole_db.write(msg)
+    assert [next(followed) for _ in range(3)] == [
+        (tickers[0], msg)
+        for msg in cole_db.read_raw(tickers[0], start_ts=msgs[tickers[0]][6].ts)
+    ]
+
+    # The second market shows up, and the writer only makes messages
+    # visible once it flushes them
+    with ColeDBWriter(storage_path=tmp_path) as writer:
+        for msg in msgs[tickers[1]][:3]:
+            writer.write(msg)
+        # Nothing new until we flush while the follower sleeps
+        with patch("time.sleep", side_effect=lambda _: writer.flush()) as sleep:
+            assert [next(followed) for _ in range(3)] == [
+                (tickers[1], msg) for msg in msgs[tickers[1]][:3]
+            ]
+        sleep.assert_called_once_with(1)
+
+    # Orderbooks match what read gives back
+    followed_orderbooks = follower.follow(tickers[:1])
+    for msg in msgs[tickers[0]][9:]:
+        cole_db.write(msg)
+    num_orderbooks = 0
+    for expected_orderbook in ColeDBInterface(storage_path=tmp_path).read(
+        tickers[0], start_ts=msgs[tickers[0]][9].ts
+    ):
+        ticker, orderbook = next(followed_orderbooks)
+        num_orderbooks += 1
+        assert ticker == tickers[0]
+        assert orderbook == expected_orderbook
+    assert num_orderbooks == 5
+
+    # Messages written between polls are not lost if the market is compacted
+    # in the meantime
+    followed = follower.follow(tickers[:1], read_raw=True)
+    followed_orderbooks = follower.follow(tickers[:1])
+    new_msgs = generate_msgs(tickers[0], 20)[14:]
+    for msg in new_msgs:
+        msg.ts += timedelta(seconds=6)
+    for msg in new_msgs[:3]:
+        cole_db.write(msg)
+    compact_market(cole_db, tickers[0], target_chunk_bytes=100)
+    for msg in new_msgs[3:]:
+        cole_db.write(msg)
+    expected_raw = list(
+        ColeDBInterface(storage_path=tmp_path).read_raw(
+            tickers[0], start_ts=new_msgs[0].ts
+        )
+    )
+    assert len(expected_raw) == 6
+    assert [next(followed) for _ in range(6)] == [
+        (tickers[0], msg) for msg in expected_raw
+    ]
+    for expected_orderbook in ColeDBInterface(storage_path=tmp_path).read(
+        tickers[0], start_ts=new_msgs[0].ts
+    ):
+        assert next(followed_orderbooks) == (tickers[0], expected_orderbook)
+
+
+def test_compaction(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 4
+    ticker = MarketTicker("TEST-COMPACTION-MARKET")
+    cache = ColeDBChunkCache()
+    cole_db = ColeDBInterface(storage_path=tmp_path / "coledb", chunk_cache=cache)
+    store = ColeDBColumnarStore(cole_db, storage_path=tmp_path / "columnar")
+    msgs = generate_msgs(ticker, 30)
+    for msg in msgs[:25]:
+        cole_db.write(msg)
+    cole_db.build_index(ticker, msgs_per_checkpoint=2)
+    store.export(ticker)
+
+    def books(db: ColeDBInterface, start_ts=None):
+        return [
+            (ob.ts, ob.yes.levels.copy(), ob.no.levels.copy())
+            for ob in db.read(ticker, start_ts)
+        ]
+
+    expected_books = books(cole_db)
+    expected_ts, expected_arrays = arrays_to_orderbooks(cole_db.read_arrays(ticker))
+    market_folder = cole_db.ticker_to_path(ticker)
+    old_chunk_names = [p.name for p in market_folder.iterdir() if p.name[0].isdigit()]
+    # Loads the metadata before the compaction
+    old_reader = ReadonlyColeDB(storage_path=tmp_path / "coledb")
+    old_reader.get_metadata(ticker)
+    # Left over from a compaction that crashed
+    (market_folder / "gen1").mkdir()
+    (market_folder / "gen1" / "1").write_bytes(b"garbage")
+
+    result = compact_market(
+        cole_db, ticker, target_chunk_bytes=150, compression=ChunkCompression.ZLIB
+    )
+    metadata = ColeDBMetadata.load(cole_db.ticker_to_metadata_path(ticker))
+    assert metadata.generation == 1
+    assert result.num_chunks_before == 7
+    assert 1 < result.num_chunks_after == metadata.last_chunk_num < 7
+    assert metadata.num_msgs == 25
+    assert set(metadata.chunk_compressions) == set(range(1, metadata.last_chunk_num))
+    # Old chunks stay around for the readers that loaded the old metadata
+    assert sorted(p.name for p in market_folder.iterdir()) == sorted(
+        old_chunk_names + ["gen1", "metadata", "write.lock"]
+    )
+    assert len(list((market_folder / "gen1").iterdir())) == metadata.last_chunk_num
+    assert books(old_reader) == expected_books
+    # We let go of the lock
+    with ColeDBWriter(storage_path=tmp_path / "coledb") as writer:
+        writer.lock_market(ticker)
+
+    # Reads go through the new chunks
+    assert books(cole_db) == expected_books
+    assert books(ColeDBInterface(storage_path=tmp_path / "coledb")) == expected_books
+    assert books(cole_db, msgs[13].ts) == expected_books[13:]
+    ts, arrays = arrays_to_orderbooks(cole_db.read_arrays(ticker))
+    assert np.array_equal(ts, expected_ts)
+    assert np.array_equal(arrays, expected_arrays)
+    assert cole_db.catalog.get(ticker).num_msgs == 25  # type:ignore[union-attr]
+    assert store.export(ticker) == 25
+    pd.testing.assert_frame_equal(store.load_df(ticker), cole_db.read_df(ticker))
+
+    # We can keep writing (with a buffered writer that holds the lock), and
+    # compact again by time span
+    with ColeDBWriter(
+        storage_path=tmp_path / "coledb", max_buffer_bytes=1000
+    ) as writer:
+        for msg in msgs[25:]:
+            writer.write(msg)
+        compact_market(
+            writer,
+            ticker,
+            target_chunk_bytes=None,
+            target_chunk_span=timedelta(seconds=10),
+            compression=ChunkCompression.LZMA,
+        )
+        # We keep holding the lock that we had before the compaction
+        assert ticker in writer._market_locks
+    cole_db.forget_market(ticker)
+    metadata = ColeDBMetadata.load(cole_db.ticker_to_metadata_path(ticker))
+    assert (metadata.generation, metadata.last_chunk_num) == (2, 3)
+    assert metadata.chunk_first_time_stamps == [msg.ts for msg in msgs[::10]]
+    # The chunks of the generation before the last one are gone
+    assert sorted(p.name for p in market_folder.iterdir()) == [
+        "gen1",
+        "gen2",
+        "metadata",
+        "write.lock",
+    ]
+    assert [ob.yes.levels for ob in cole_db.read(ticker, msgs[-1].ts)] == [
+        books(ColeDBInterface(storage_path=tmp_path / "coledb"))[-1][1]
+    ]
+    assert len(list(cole_db.read_raw(ticker))) == 30
+
+    with pytest.raises(ValueError):
+        compact_market(cole_db, ticker, target_chunk_bytes=None)
+
+
+def test_sealed_chunk_compression(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 4
+    ticker = MarketTicker("TEST-SEALED-CHUNK-COMPRESSION")
+    msgs = generate_msgs(ticker, 22)
+    expected_db = ColeDBInterface(storage_path=tmp_path / "expected")
+    for msg in msgs:
+        expected_db.write(msg)
+    expected_raw = list(expected_db.read_raw(ticker))
+
+    def books(db: ColeDBInterface, start_ts=None):
+        return [
+            (ob.ts, ob.yes.levels.copy(), ob.no.levels.copy())
+            for ob in db.read(ticker, start_ts)
+        ]
+
+    cole_db = ColeDBInterface(
+        storage_path=tmp_path / "coledb",
+        sealed_chunk_compression=ChunkCompression.ZLIB,
+    )
+    for msg in msgs[:10]:
+        cole_db.write(msg)
+    cole_db.build_index(ticker, msgs_per_checkpoint=2)
+    # Loads the metadata before the next chunks are compressed
+    reader = ReadonlyColeDB(storage_path=tmp_path / "coledb")
+    assert len(list(reader.read_raw(ticker))) == 10
+    # Picks up where the other interface left off
+    cole_db.close()
+    cole_db = ColeDBInterface(
+        storage_path=tmp_path / "coledb",
+        sealed_chunk_compression=ChunkCompression.ZLIB,
+    )
+    for msg in msgs[10:]:
+        cole_db.write(msg)
+
+    metadata = ColeDBMetadata.load(cole_db.ticker_to_metadata_path(ticker))
+    assert metadata.chunk_compressions == {
+        chunk_num: ChunkCompression.ZLIB for chunk_num in range(1, 6)
+    }
+    assert sorted(p.name for p in metadata.path_to_market_data.iterdir()) == [
+        "1.index",
+        "1.zlib",
+        "2.index",
+        "2.zlib",
+        "3.index",
+        "3.zlib",
+        "4.zlib",
+        "5.zlib",
+        "6",
+        "metadata",
+        "metadata.journal",
+    ]
+    assert list(cole_db.read_raw(ticker)) == expected_raw
+    assert books(cole_db, msgs[5].ts) == books(expected_db, msgs[5].ts)
+    # Finds the compressed chunks even though its metadata is stale
+    assert books(reader, msgs[5].ts)[:3] == books(expected_db, msgs[5].ts)[:3]
+    assert np.array_equal(cole_db.read_arrays(ticker), expected_db.read_arrays(ticker))
+
+    # The writer keeps the catalog in sync with the compressed sizes
+    with ColeDBWriter(
+        storage_path=tmp_path / "writer",
+        max_buffer_bytes=10,
+        sealed_chunk_compression=ChunkCompression.LZMA,
+    ) as writer:
+        for msg in msgs:
+            writer.write(msg)
+    writer_db = ColeDBInterface(storage_path=tmp_path / "writer")
+    assert list(writer_db.read_raw(ticker)) == expected_raw
+    assert ColeDBCatalog(tmp_path / "writer").get(
+        ticker
+    ) == ColeDBCatalog.entry_from_disk(writer_db, ticker)
+
+    # Compress markets that are already written
+    assert expected_db.compress_sealed_chunks(ticker, ChunkCompression.LZMA) == 5
+    assert expected_db.compress_sealed_chunks(ticker, ChunkCompression.LZMA) == 0
+    assert list(expected_db.read_raw(ticker)) == expected_raw
+    with pytest.raises(NotImplementedError):
+        reader.compress_sealed_chunks(ticker, ChunkCompression.LZMA)
+
+
+def test_concurrent_writers(tmp_path: Path, monkeypatch):
+    ColeDBInterface.msgs_per_chunk = 4
+    tickers = [MarketTicker(f"SERIES-EVENT-LOCK{i}") for i in range(2)]
+    msgs = {ticker: generate_msgs(ticker, 10) for ticker in tickers}
+    writer = ColeDBWriter(storage_path=tmp_path, max_buffer_bytes=1000)
+    other = ColeDBWriter(storage_path=tmp_path, max_buffer_bytes=1000)
+    for msg in msgs[tickers[0]][:6]:
+        writer.write(msg)
+    # Another writer can't write to a market that we have locked
+    with pytest.raises(ColeDBLockedError):
+        other.write(msgs[tickers[0]][6])
+    with pytest.raises(ColeDBLockedError):
+        compact_market(other, tickers[0])
+    # But it can write to other markets
+    for msg in msgs[tickers[1]][:6]:
+        other.write(msg)
+    with pytest.raises(ColeDBLockedError):
+        writer.write(msgs[tickers[1]][6])
+
+    # Unlocking flushes, and the other writer picks up where we left off
+    writer.unlock_market(tickers[0])
+    for msg in msgs[tickers[0]][6:]:
+        other.write(msg)
+    other.close()
+    for msg in msgs[tickers[1]][6:]:
+        writer.write(msg)
+    writer.close()
+    reader = ColeDBInterface(storage_path=tmp_path)
+    expected_db = ColeDBInterface(storage_path=tmp_path / "expected")
+    for ticker in tickers:
+        for msg in msgs[ticker]:
+            expected_db.write(msg)
+        assert list(reader.read_raw(ticker)) == list(expected_db.read_raw(ticker))
+        assert ColeDBCatalog(tmp_path).get(ticker) == ColeDBCatalog.entry_from_disk(
+            reader, ticker
+        )
+
+    # Only writers take locks, so plain interfaces can write to the same market
+    ColeDBInterface(storage_path=tmp_path / "plain").write(msgs[tickers[0]][0])
+    ColeDBInterface(storage_path=tmp_path / "plain").write(msgs[tickers[0]][1])
+    # Writers keep the locks of all of their markets until they close
+    with ColeDBWriter(storage_path=tmp_path / "plain") as writer:
+        for ticker in tickers:
+            writer.write(msgs[ticker][2 if ticker == tickers[0] else 0])
+        # Markets can have trades and no orderbook messages
+        writer.write_trade(
+            TradeRM(
+                market_ticker=MarketTicker("SERIES-EVENT-TRADES"),
+                yes_price=Price(50),
+                no_price=Price(50),
+                count=Quantity(1),
+                taker_side=Side.YES,
+                ts=1704042451,
+            )
+        )
+        assert set(writer._market_locks) == set(tickers) | {"SERIES-EVENT-TRADES"}
+    assert writer._market_locks == {}
+
+    # Writers that aren't closed don't stay alive, and they let go of their
+    # locks and files once they're collected
+    writer = ColeDBWriter(storage_path=tmp_path / "plain", max_buffer_bytes=1)
+    writer.write(msgs[tickers[0]][3])
+    chunk_files = list(writer._open_chunk_files.values())
+    assert len(chunk_files) == 1
+    writer_ref = weakref.ref(writer)
+    del writer
+    gc.collect()
+    assert writer_ref() is None
+    assert chunk_files[0].closed
+    with ColeDBWriter(storage_path=tmp_path / "plain") as writer:
+        writer.write(msgs[tickers[0]][4])
+    expected_db = ColeDBInterface(storage_path=tmp_path / "expected_plain")
+    for msg in msgs[tickers[0]][:5]:
+        expected_db.write(msg)
+    plain_db = ColeDBInterface(storage_path=tmp_path / "plain")
+    assert list(plain_db.read_raw(tickers[0])) == list(expected_db.read_raw(tickers[0]))
+
+    # Catalogs of different processes don't drop each other's entries
+    monkeypatch.setattr(ColeDBCatalog, "max_journal_records", 2)
+    catalogs = [ColeDBCatalog(tmp_path / "catalog") for _ in range(2)]
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    entries = [
+        ColeDBCatalogEntry(MarketTicker(f"SERIES-EVENT-MARKET{i}"), now, now, i, 1, i)
+        for i in range(4)
+    ]
+    for i, entry in enumerate(entries):
+        catalogs[i % 2].update(entry)
+    assert ColeDBCatalog(tmp_path / "catalog").entries == {
+        entry.ticker: entry for entry in entries
+    }
+
+
+def test_shards(tmp_path: Path):
+    tickers = [MarketTicker(f"SERIES-EVENT-SHARD{i}") for i in range(20)]
+    shards = [ColeDBShard(i, 3) for i in range(3)]
+    # Each market belongs to exactly one shard
+    for ticker in tickers:
+        assert sum(shard.owns(ticker) for shard in shards) == 1
+    assert all(any(shard.owns(ticker) for ticker in tickers) for shard in shards)
+    with pytest.raises(ValueError):
+        ColeDBShard(3, 3)
+
+    cole_db = ColeDBInterface(storage_path=tmp_path, shard=shards[0])
+    for ticker in tickers:
+        msg = generate_msgs(ticker, 1)[0]
+        if shards[0].owns(ticker):
+            cole_db.write(msg)
+        else:
+            with pytest.raises(ValueError):
+                cole_db.write(msg)
+
+
+def test_read_bbo(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 7
+    ticker = MarketTicker("TEST-READ-BBO")
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    msgs: list[OrderbookSnapshotRM | OrderbookDeltaRM] = [
+        OrderbookSnapshotRM(
+            market_ticker=ticker,
+            yes=[[10, 5], [20, 3]],  # type:ignore[list-item]
+            no=[[30, 4]],  # type:ignore[list-item]
+            ts=now,
+        )
+    ]
+    # Random deltas that empty levels (including the best one) on both sides
+    levels = {Side.YES: {10: 5, 20: 3}, Side.NO: {30: 4}}
+    for i in range(1, 60):
+        side = random.choice([Side.YES, Side.NO])
+        if levels[side] and random.random() < 0.4:
+            price = random.choice([max(levels[side]), *levels[side]])
+            delta = -levels[side].pop(price)
+        else:
+            price = random.randint(1, 49)
+            delta = random.randint(1, 10)
+            levels[side][price] = levels[side].get(price, 0) + delta
+        msgs.append(
+            OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(price),
+                delta=QuantityDelta(delta),
+                side=side,
+                ts=now + timedelta(seconds=i),
+            )
+        )
+    cole_db = ColeDBInterface(storage_path=tmp_path)
+    for msg in msgs:
+        cole_db.write(msg)
+
+    def expected(start_ts=None, end_ts=None):
+        return np.array(
+            [orderbook_to_bbo_row(ob) for ob in cole_db.read(ticker, start_ts, end_ts)]
+        )
+
+    np.testing.assert_array_equal(cole_db.read_bbo_arrays(ticker), expected())
+    start_ts = now + timedelta(seconds=10)
+    end_ts = now + timedelta(seconds=40)
+    np.testing.assert_array_equal(
+        cole_db.read_bbo_arrays(ticker, start_ts, end_ts), expected(start_ts, end_ts)
+    )
+    np.testing.assert_array_equal(
+        cole_db.read_bbo_arrays(ticker, start_ts, nrows=12),
+        expected(start_ts)[:12],
+    )
+    df = cole_db.read_bbo_df(ticker, end_ts=end_ts, nrows=5)
+    np.testing.assert_array_equal(df.to_numpy(), expected(end_ts=end_ts)[:5])
+    assert list(df.columns) == [
+        "ts",
+        "yes_bid_price",
+        "yes_bid_qty",
+        "yes_ask_price",
+        "yes_ask_qty",
+    ]
+    assert cole_db.read_bbo_arrays(ticker, now + timedelta(days=1)).shape == (0, 5)
+
+    # Both sides empty
+    empty_snapshot = np.zeros(1, dtype=COLEDB_ARRAY_DTYPE)
+    empty_snapshot["type"] = ColeDBRowType.SNAPSHOT
+    assert np.isnan(arrays_to_bbo(empty_snapshot)[0, 1:]).all()
+    with pytest.raises(ValueError):
+        arrays_to_bbo(cole_db.read_chunk_arrays(ticker, 1)[1:])
+
+
+def test_rollups(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 5
+    ticker = MarketTicker("TEST-ROLLUPS")
+    cole_db = ColeDBInterface(storage_path=tmp_path / "coledb")
+    store = ColeDBRollupStore(cole_db, storage_path=tmp_path / "rollups")
+    # Messages 0.3 seconds apart, so bars have more than one message
+    msgs = [
+        msg.model_copy(update={"ts": msg.ts - timedelta(seconds=0.7 * i)})
+        for i, msg in enumerate(generate_msgs(ticker, 23))
+    ]
+
+    def expected(interval: timedelta):
+        return bbo_to_bars(cole_db.read_bbo_arrays(ticker), interval)
+
+    # Updates that end in the middle of a period and in the middle of a chunk.
+    # Another interface (like the collector) writes the messages.
+    other_db = ColeDBInterface(storage_path=tmp_path / "coledb")
+    for start, end in ((0, 7), (7, 8), (8, 23)):
+        for msg in msgs[start:end]:
+            other_db.write(msg)
+        assert store.update(ticker) == end - start
+        cole_db.forget_market(ticker)
+        for interval in ROLLUP_INTERVALS.values():
+            np.testing.assert_array_equal(
+                store.load(ticker, interval), expected(interval)
+            )
+    assert store.update_series(SeriesTicker("TEST")) == 0
+
+    bars = store.load_df(ticker, timedelta(seconds=1))
+    assert list(bars.columns) == BAR_COLUMNS
+    assert bars.num_msgs.sum() == 23
+    assert (bars.num_msgs > 1).any()
+    bbo = cole_db.read_bbo_df(ticker)
+    minute_bars = store.load_df(ticker, timedelta(minutes=1))
+    assert len(minute_bars) == 1
+    assert minute_bars.ts[0] % 60 == 0
+    assert minute_bars.bid_open[0] == bbo.yes_bid_price.iloc[0]
+    assert minute_bars.bid_high[0] == bbo.yes_bid_price.max()
+    assert minute_bars.bid_low[0] == bbo.yes_bid_price.min()
+    assert minute_bars.bid_close[0] == bbo.yes_bid_price.iloc[-1]
+    assert minute_bars.ask_high[0] == bbo.yes_ask_price.max()
+    assert minute_bars.mid_low[0] == ((bbo.yes_bid_price + bbo.yes_ask_price) / 2).min()
+
+    start_ts = datetime.fromtimestamp(bars.ts[2], ColeDBInterface.tz)
+    end_ts = datetime.fromtimestamp(bars.ts[5], ColeDBInterface.tz)
+    pd.testing.assert_frame_equal(
+        store.load_df(ticker, timedelta(seconds=1), start_ts, end_ts),
+        bars[2:6].reset_index(drop=True),
+    )
+    assert len(store.load(ticker, timedelta(hours=1), end_ts=start_ts)) == 1
+    assert len(store.load(ticker, timedelta(hours=1), start_ts=start_ts)) == 0
+    with pytest.raises(ValueError):
+        store.load(ticker, timedelta(minutes=5))
+
+    # Partial writes after the last update are dropped
+    with open(store.ticker_to_path(ticker) / "1s", "ab") as f:
+        f.write(b"garbage")
+    cole_db.write(msgs[-1].model_copy(update={"ts": msgs[-1].ts + timedelta(1)}))
+    assert store.update(ticker) == 1
+    np.testing.assert_array_equal(
+        store.load(ticker, timedelta(seconds=1)), expected(timedelta(seconds=1))
+    )
+
+    # Rolls up the market again after compaction
+    compact_market(
+        cole_db, ticker, target_chunk_bytes=None, target_chunk_span=timedelta(hours=1)
+    )
+    assert store.update(ticker) == 24
+    np.testing.assert_array_equal(
+        store.load(ticker, timedelta(hours=1)), expected(timedelta(hours=1))
+    )
+
+
+def test_read_snapshots(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 3
+    ticker = MarketTicker("TEST-READ-SNAPSHOTS")
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+    cole_db = ColeDBInterface(storage_path=tmp_path)
+    cole_db.write(
+        OrderbookSnapshotRM(
+            market_ticker=ticker,
+            yes=[[10, 5]],  # type:ignore[list-item]
+            no=[[30, 4]],  # type:ignore[list-item]
+            ts=now,
+        )
+    )
+    for i in range(1, 8):
+        cole_db.write(
+            OrderbookDeltaRM(
+                market_ticker=ticker,
+                price=Price(10 + i),
+                delta=QuantityDelta(i),
+                side=Side.YES,
+                ts=now + timedelta(seconds=i),
+            )
+        )
+
+    # Without snapshots, we keep yielding the same orderbook within a chunk
+    orderbooks = list(cole_db.read(ticker))
+    assert orderbooks[1] is orderbooks[0]
+    expected = [orderbook.copy() for orderbook in cole_db.read(ticker)]
+
+    snapshots = list(cole_db.read(ticker, snapshot=True))
+    assert snapshots == expected
+    assert [snapshot.ts for snapshot in snapshots] == [
+        orderbook.ts for orderbook in expected
+    ]
+    assert len({id(snapshot) for snapshot in snapshots}) == len(snapshots)
+    assert list(cole_db.read_cursor(ticker, snapshot=True)) == expected
+
+    # Snapshots are read only, but you can derive new orderbooks from them
+    delta = OrderbookDeltaRM(
+        market_ticker=ticker,
+        price=Price(10),
+        delta=QuantityDelta(-5),
+        side=Side.YES,
+        ts=now + timedelta(seconds=10),
+    )
+    with pytest.raises(TypeError):
+        snapshots[0].apply_delta(delta, in_place=True)
+    assert snapshots[0] == expected[0]
+    new_orderbook = snapshots[0].apply_delta(delta)
+    assert Price(10) not in new_orderbook.yes.levels
+    new_orderbook.apply_delta(
+        delta.model_copy(update={"delta": QuantityDelta(2)}), in_place=True
+    )
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from mock import MagicMock
+
+from data.coledb.coledb import ColeDBInterface
+from data.collection.market_info import backfill_market_info
+from exchange.interface import ExchangeInterface
+from helpers.types.markets import Market, MarketResult, MarketStatus, MarketTicker
+from helpers.types.money import Price
+from helpers.types.websockets.response import OrderbookSnapshotRM
+
+
+def test_backfill_market_info(tmp_path: Path):
+    cole_db = ColeDBInterface(storage_path=tmp_path)
+    now = datetime.now(ColeDBInterface.tz)
+    tickers = [MarketTicker(f"SERIES-EVENT-BACKFILL{i}") for i in range(3)]
+    for ticker in tickers:
+        cole_db.write(
+            OrderbookSnapshotRM(
+                market_ticker=ticker,
+                yes=[[Price(2), 100]],  # type:ignore[list-item]
+                no=[],
+                ts=now,
+            )
+        )
+
+    def market(ticker: MarketTicker, result: MarketResult, close_time: datetime):
+        return Market(
+            status=MarketStatus.OPEN,
+            ticker=ticker,
+            result=result,
+            close_time=close_time,
+        )
+
+    # Closed but no result yet
+    cole_db.write_market_info(
+        market(tickers[0], MarketResult.NOT_DETERMINED, now - timedelta(hours=1))
+    )
+    # Still open
+    cole_db.write_market_info(
+        market(tickers[1], MarketResult.NOT_DETERMINED, now + timedelta(hours=1))
+    )
+    # tickers[2] does not have any info yet
+
+    exchange_interface = MagicMock(spec=ExchangeInterface)
+    exchange_interface.get_market.side_effect = lambda ticker: market(
+        ticker, MarketResult.YES, now
+    )
+    assert backfill_market_info(exchange_interface, cole_db) == 2
+    assert cole_db.read_market_info(tickers[0]).result == MarketResult.YES
+    assert cole_db.read_market_info(tickers[1]).result == MarketResult.NOT_DETERMINED
+    assert cole_db.read_market_info(tickers[2]).result == MarketResult.YES
+    # Nothing left to do
+    assert backfill_market_info(exchange_interface, cole_db) == 0
@@ -1,9 +1,24 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
 import pytest
 from mock import MagicMock, call, patch
 
-from data.coledb.coledb import ColeDBInterface
-from data.collection.orderbook import retry_collect_orderbook_data
+from data.coledb.coledb import ColeDBInterface, ColeDBWriter
+from data.collection.orderbook import (
+    ColeMessage,
+    retry_collect_orderbook_data,
+    write_to_cole,
+)
 from exchange.interface import ExchangeInterface
+from helpers.types.markets import MarketTicker
+from helpers.types.money import Price
+from helpers.types.orders import Quantity, QuantityDelta, Side
+from helpers.types.websockets.response import (
+    OrderbookDeltaRM,
+    OrderbookSnapshotRM,
+    TradeRM,
+)
 
 
 def test_retry_collect_orderbook_data(real_readonly_coledb: ColeDBInterface):
@@ -25,7 +40,9 @@ def test_retry_collect_orderbook_data(real_readonly_coledb: ColeDBInterface):
                 ]
                 with pytest.raises(ValueError) as e:
                     retry_collect_orderbook_data(
-                        mock_exchange_interface, cole=real_readonly_coledb
+                        mock_exchange_interface,
+                        cole=real_readonly_coledb,
+                        collect_trades=True,
                     )
                 assert e.match("Error to make while loop stop")
                 mock_collect_orderbook_data.assert_has_calls(
@@ -33,10 +50,12 @@ def test_retry_collect_orderbook_data(real_readonly_coledb: ColeDBInterface):
                         call(
                             exchange_interface=mock_exchange_interface,
                             cole=real_readonly_coledb,
+                            collect_trades=True,
                         ),
                         call(
                             exchange_interface=mock_exchange_interface,
                             cole=real_readonly_coledb,
+                            collect_trades=True,
                         ),
                     ]
                 )
@@ -46,3 +65,61 @@ def test_retry_collect_orderbook_data(real_readonly_coledb: ColeDBInterface):
                 )
                 # But we went through two sleep iterations
                 mock_sleep.assert_has_calls([call(10), call(10)])
+
+
+def test_write_to_cole_holds_messages_of_locked_markets(tmp_path: Path):
+    ColeDBInterface.msgs_per_chunk = 5000
+    tickers = [MarketTicker(f"SERIES-EVENT-COLLECT{i}") for i in range(2)]
+    now = datetime.fromtimestamp(1704042451).astimezone(ColeDBInterface.tz)
+
+    def market_msgs(ticker: MarketTicker) -> list[ColeMessage]:
+        msgs: list[ColeMessage] = [
+            OrderbookSnapshotRM(
+                market_ticker=ticker,
+                yes=[[2, 100]],  # type:ignore[list-item]
+                no=[[1, 20]],  # type:ignore[list-item]
+                ts=now,
+            ),
+            TradeRM(
+                market_ticker=ticker,
+                yes_price=Price(2),
+                no_price=Price(98),
+                count=Quantity(1),
+                taker_side=Side.YES,
+                ts=int(now.timestamp()) + 1,
+            ),
+        ]
+        for i in range(1, 4):
+            msgs.append(
+                OrderbookDeltaRM(
+                    market_ticker=ticker,
+                    price=Price(3),
+                    delta=QuantityDelta(i),
+                    side=Side.YES,
+                    ts=now + timedelta(seconds=i),
+                )
+            )
+        return msgs
+
+    msgs = {ticker: market_msgs(ticker) for ticker in tickers}
+    pending_msgs: dict[MarketTicker, list[ColeMessage]] = {}
+    with ColeDBWriter(storage_path=tmp_path) as collector:
+        with ColeDBWriter(storage_path=tmp_path) as compactor:
+            # Another process has the first market locked
+            compactor.lock_market(tickers[0])
+            for i in range(3):
+                for ticker in tickers:
+                    write_to_cole(collector, msgs[ticker][i], pending_msgs)
+            assert pending_msgs == {tickers[0]: msgs[tickers[0]][:3]}
+            compactor.unlock_market(tickers[0])
+        # The held messages are written in order before the new ones
+        for i in range(3, 5):
+            for ticker in tickers:
+                write_to_cole(collector, msgs[ticker][i], pending_msgs)
+        assert pending_msgs == {}
+    reader = ColeDBInterface(storage_path=tmp_path)
+    for ticker in tickers:
+        assert list(reader.read_raw(ticker)) == [
+            msg for msg in msgs[ticker] if not isinstance(msg, TradeRM)
+        ]
+        assert list(reader.read_trades(ticker)) == [msgs[ticker][1]]
@@ -1,4 +1,6 @@
 import copy
+import pickle
+import random
 from datetime import datetime
 
 import pytest
@@ -259,6 +261,273 @@ def test_invert_prices():
     )
 
 
+def test_side_best_levels_match_scan():
+    # The best levels and total we keep as we go match scanning the levels
+    side = OrderbookSide()
+    for _ in range(2000):
+        price = Price(random.randint(1, 99))
+        quantity = side.levels.get(price, 0)
+        if quantity and random.random() < 0.5:
+            side.apply_delta(price, QuantityDelta(-quantity))
+        else:
+            side.apply_delta(price, QuantityDelta(random.randint(1, 10)))
+        levels = side.levels.copy()
+        assert side.get_largest_price_level() == (
+            max(levels.items()) if levels else None
+        )
+        assert side.get_smallest_price_level() == (
+            min(levels.items()) if levels else None
+        )
+        assert side.get_total_quantity() == sum(levels.values())
+        assert len(side) == len(levels)
+        inverted = side.invert_prices()
+        assert inverted.get_largest_price_level() == (
+            None if side.is_empty() else (Price(100 - min(levels)), levels[min(levels)])
+        )
+        assert inverted.get_total_quantity() == side.get_total_quantity()
+
+
+def test_side_levels_view():
+    side = OrderbookSide(levels={Price(40): Quantity(4), Price(10): Quantity(1)})
+    # Levels are in price order
+    assert list(side.levels) == [Price(10), Price(40)]
+    assert side.levels == {Price(10): Quantity(1), Price(40): Quantity(4)}
+    assert Price(40) in side.levels and Price(41) not in side.levels
+    assert side.levels.get(Price(41), 0) == 0
+    assert repr(side) == "OrderbookSide(levels={10: 1, 40: 4})"
+    with pytest.raises(KeyError):
+        side.levels[Price(41)]
+
+    # Writes go through to the side
+    side.levels[Price(40)] -= Quantity(1)
+    side.levels[Price(50)] = Quantity(5)
+    assert side.get_largest_price_level() == (Price(50), Quantity(5))
+    assert side.get_total_quantity() == Quantity(9)
+    del side.levels[Price(50)]
+    side.levels[Price(10)] = Quantity(0)
+    assert side.levels == {Price(40): Quantity(3)}
+    assert side.get_smallest_price_level() == (Price(40), Quantity(3))
+
+    # Copies and pickles don't share the levels
+    copied = copy.deepcopy(side)
+    side.apply_delta(Price(40), QuantityDelta(1))
+    assert copied.levels == {Price(40): Quantity(3)}
+    assert pickle.loads(pickle.dumps(side)) == side
+    # Sides that were pickled before we used an array
+    old_side = OrderbookSide.__new__(OrderbookSide)
+    old_side.__setstate__({"levels": {Price(40): Quantity(4)}, "_cached_min": None})
+    assert old_side == side
+    assert old_side.get_largest_price_level() == (Price(40), Quantity(4))
+
+
+def test_inverted_view():
+    side = OrderbookSide(levels={Price(10): Quantity(1), Price(40): Quantity(4)})
+    view = side.inverted_view()
+    assert view == side.invert_prices()
+    assert view.levels == {Price(90): Quantity(1), Price(60): Quantity(4)}
+    assert list(view.levels) == [Price(60), Price(90)]
+    assert view.get_largest_price_level() == (Price(90), Quantity(1))
+    assert view.get_smallest_price_level() == (Price(60), Quantity(4))
+    assert view.inverted_view() == side
+
+    # Reflects changes to the side
+    side.apply_delta(Price(5), QuantityDelta(5))
+    side.apply_delta(Price(40), QuantityDelta(-4))
+    assert view.get_largest_price_level() == (Price(95), Quantity(5))
+    assert view.get_smallest_price_level() == (Price(90), Quantity(1))
+    assert view.get_total_quantity() == Quantity(6)
+    assert len(view) == 2 and Price(60) not in view.levels
+
+    with pytest.raises(TypeError):
+        view.apply_delta(Price(95), QuantityDelta(1))
+    with pytest.raises(TypeError):
+        view.levels[Price(95)] = Quantity(1)
+    # Copies are regular sides
+    copied = copy.deepcopy(view)
+    copied.apply_delta(Price(95), QuantityDelta(1))
+    assert view.levels[Price(95)] == Quantity(5)
+    assert pickle.loads(pickle.dumps(view)) == view
+
+    empty_view = OrderbookSide().inverted_view()
+    assert empty_view.get_largest_price_level() is None
+    assert empty_view.get_smallest_price_level() is None
+
+    # Changing the view of an orderbook doesn't copy the levels
+    book = Orderbook(market_ticker=MarketTicker("hi"), yes=side)
+    ask_book = book.get_view(OrderbookView.ASK)
+    assert ask_book.ts == book.ts
+    assert ask_book.no._side is side  # type:ignore[attr-defined]
+
+    # The view of a view can't be used to modify the original book
+    bid_book = ask_book.get_view(OrderbookView.BID)
+    delta = OrderbookDeltaRM(
+        market_ticker=MarketTicker("hi"),
+        price=Price(5),
+        delta=QuantityDelta(1),
+        side=Side.YES,
+    )
+    assert bid_book == book
+    assert bid_book.yes is not side
+    with pytest.raises(TypeError):
+        bid_book.apply_delta(delta, in_place=True)
+    assert bid_book.apply_delta(delta).yes.levels[Price(5)] == Quantity(6)
+    assert side.levels[Price(5)] == Quantity(5)
+
+
+def test_orderbook_copy():
+    book = Orderbook(
+        market_ticker=MarketTicker("hi"),
+        yes=OrderbookSide(levels={Price(10): Quantity(5), Price(20): Quantity(3)}),
+        no=OrderbookSide(levels={Price(50): Quantity(7)}),
+    )
+    book_copy = book.copy()
+    assert book_copy == book
+    assert book_copy.ts is book.ts
+    assert book_copy.yes is not book.yes and book_copy.no is not book.no
+
+    # Changing the copy doesn't change the original
+    book_copy.yes.add_level(Price(30), Quantity(1))
+    book_copy.no.apply_delta(Price(50), QuantityDelta(-7))
+    assert book.yes.levels == {Price(10): Quantity(5), Price(20): Quantity(3)}
+    assert book.no.levels == {Price(50): Quantity(7)}
+
+    # Copies of views own their levels
+    ask_book = book.get_view(OrderbookView.ASK)
+    ask_copy = copy.deepcopy(ask_book)
+    assert ask_copy == ask_book
+    ask_copy.yes.apply_delta(Price(50), QuantityDelta(1))
+    assert ask_book.yes.levels == {Price(50): Quantity(7)}
+
+    # Applying a delta that's not in place leaves the original alone
+    new_book = book.apply_delta(
+        OrderbookDeltaRM(
+            market_ticker=MarketTicker("hi"),
+            price=Price(10),
+            delta=QuantityDelta(-5),
+            side=Side.YES,
+        )
+    )
+    assert new_book.yes.levels == {Price(20): Quantity(3)}
+    assert book.yes.levels == {Price(10): Quantity(5), Price(20): Quantity(3)}
+
+
+def test_freeze():
+    side = OrderbookSide(levels={Price(10): Quantity(5), Price(20): Quantity(3)})
+    book = Orderbook(market_ticker=MarketTicker("hi"), yes=side)
+    frozen = book.freeze()
+    assert frozen == book
+    assert frozen.ts is book.ts
+
+    # The snapshot doesn't change with the orderbook
+    side.apply_delta(Price(10), QuantityDelta(1))
+    assert frozen.yes.levels == {Price(10): Quantity(5), Price(20): Quantity(3)}
+
+    with pytest.raises(TypeError):
+        frozen.yes.apply_delta(Price(10), QuantityDelta(1))
+    with pytest.raises(TypeError):
+        frozen.yes.levels[Price(30)] = Quantity(1)
+    with pytest.raises(TypeError):
+        frozen.no.add_level(Price(30), Quantity(1))
+    assert frozen.yes.levels == {Price(10): Quantity(5), Price(20): Quantity(3)}
+
+    # Freezing a view, copying, and pickling
+    frozen_ask = book.get_view(OrderbookView.ASK).freeze()
+    assert frozen_ask == book.get_view(OrderbookView.ASK)
+    unfrozen = frozen.copy()
+    unfrozen.yes.apply_delta(Price(10), QuantityDelta(1))
+    assert unfrozen.yes.levels[Price(10)] == Quantity(6)
+    unpickled = pickle.loads(pickle.dumps(frozen))
+    assert unpickled == frozen
+    with pytest.raises(TypeError):
+        unpickled.yes.apply_delta(Price(10), QuantityDelta(1))
+
+
+def test_apply_deltas():
+    ticker = MarketTicker("hi")
+    book = Orderbook(
+        market_ticker=ticker,
+        yes=OrderbookSide(levels={Price(p): Quantity(5) for p in range(10, 30)}),
+        no=OrderbookSide(levels={Price(p): Quantity(5) for p in range(10, 30)}),
+    )
+    for _ in range(200):
+        deltas = []
+        quantities = {
+            Side.YES: book.yes.levels.copy(),
+            Side.NO: book.no.levels.copy(),
+        }
+        for _ in range(random.randint(0, 8)):
+            side = random.choice([Side.YES, Side.NO])
+            levels = quantities[side]
+            if levels and random.random() < 0.5:
+                # Sweep the best level
+                price = max(levels)
+                delta = QuantityDelta(-levels.pop(price))
+            else:
+                price = Price(random.randint(1, 40))
+                delta = QuantityDelta(random.randint(1, 10))
+                levels[price] = Quantity(levels.get(price, 0) + delta)
+            deltas.append(
+                OrderbookDeltaRM(
+                    market_ticker=ticker, price=price, delta=delta, side=side
+                )
+            )
+        try:
+            expected = book
+            for delta_msg in deltas:
+                expected = expected.apply_delta(delta_msg)
+        except ValueError:
+            # Crossed orderbook, try another batch
+            continue
+        result = book.apply_deltas(deltas)
+        assert result.orderbook == expected
+        assert result.orderbook.ts == (deltas[-1].ts if deltas else book.ts)
+        for side, changed in (
+            (Side.YES, result.yes_bbo_changed),
+            (Side.NO, result.no_bbo_changed),
+        ):
+            new_side = result.orderbook.get_side(side)
+            assert new_side.get_largest_price_level() == max(
+                new_side.levels.items(), default=None
+            )
+            assert new_side.get_smallest_price_level() == min(
+                new_side.levels.items(), default=None
+            )
+            assert new_side.get_total_quantity() == sum(new_side.levels.values())
+            assert changed == (
+                new_side.get_largest_price_level()
+                != book.get_side(side).get_largest_price_level()
+            )
+        book = result.orderbook
+
+    # The orderbook can be crossed in the middle of the batch, but not at the end
+    book = Orderbook(
+        market_ticker=ticker,
+        yes=OrderbookSide(levels={Price(40): Quantity(5)}),
+        no=OrderbookSide(levels={Price(50): Quantity(5)}),
+    )
+    cross = OrderbookDeltaRM(
+        market_ticker=ticker, price=Price(70), delta=QuantityDelta(1), side=Side.YES
+    )
+    uncross = OrderbookDeltaRM(
+        market_ticker=ticker, price=Price(50), delta=QuantityDelta(-5), side=Side.NO
+    )
+    result = book.apply_deltas([cross, uncross])
+    assert result.yes_bbo_changed and result.no_bbo_changed and result.bbo_changed
+    assert result.orderbook.no.is_empty()
+    assert book.no.levels == {Price(50): Quantity(5)}
+    with pytest.raises(ValueError):
+        book.apply_deltas([cross])
+
+    # In place, and sides that aren't touched don't change
+    touch_no = OrderbookDeltaRM(
+        market_ticker=ticker, price=Price(10), delta=QuantityDelta(1), side=Side.NO
+    )
+    result = book.apply_deltas([touch_no], in_place=True)
+    assert result.orderbook is book
+    assert not result.yes_bbo_changed and not result.no_bbo_changed
+    assert book.no.levels == {Price(10): Quantity(1), Price(50): Quantity(5)}
+
+
 def test_change_view():
     book = Orderbook(
         market_ticker=MarketTicker("hi"),
@@ -527,6 +796,11 @@ def test_generate_table():
     assert table.columns[1].header == "Delta msgs"
     assert table.columns[1]._cells == ["10"]
 
+    table = generate_table(50, 10, 3)
+    assert len(table.columns) == 3
+    assert table.columns[2].header == "Trade msgs"
+    assert table.columns[2]._cells == ["3"]
+
 
 def test_get_bbo():
     o = Orderbook(